@@ -21,6 +21,10 @@ def celery_is_alive():
 
 
 def setUp():
+    # workers and web processes don't create tables, see Database.migrate
+    from wikimetrics.configurables import db
+    db.migrate()
+    
     celery_out = open(devnull, "w")
     celery_cmd = ['wikimetrics', '--mode', 'celery']
     global celery_proc
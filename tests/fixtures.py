@@ -25,6 +25,9 @@ from wikimetrics.models import (
     Page,
     MediawikiUser,
     Logging,
+    UserDailyActivity,
+    UserDailyActivityCoverage,
+    ReportResultChunk,
 )
 
 
@@ -365,6 +368,9 @@ class DatabaseTest(unittest.TestCase):
         self.session.query(Cohort).delete()
         self.session.query(User).delete()
         self.session.query(PersistentReport).delete()
+        self.session.query(UserDailyActivity).delete()
+        self.session.query(UserDailyActivityCoverage).delete()
+        self.session.query(ReportResultChunk).delete()
         self.session.commit()
         self.session.close()
 
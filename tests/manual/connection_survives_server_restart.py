@@ -1,5 +1,8 @@
 from wikimetrics.configurables import db
 
+# connections are only pinged after sitting idle, so ping them every time here
+db.config['CONNECTION_PING_IDLE_SECONDS'] = 0
+
 db.get_session().close()
 db.get_session().close()
 db.get_session().close()
@@ -6,6 +6,7 @@ from wikimetrics.controllers.cohorts import (
     parse_username,
     parse_records,
     normalize_user,
+    normalize_users,
     normalize_newlines,
     normalize_project,
     to_safe_json,
@@ -15,7 +16,7 @@ from wikimetrics.controllers.cohorts import (
     link_to_user_page,
     validate_records,
 )
-from wikimetrics.models import Cohort
+from wikimetrics.models import Cohort, CohortWikiUser, WikiUser
 
 
 class TestCohortsController(WebTest):
@@ -125,6 +126,16 @@ class TestCohortsController(WebTest):
         # look for the newly created cohort
         cohort = self.session.query(Cohort).filter(Cohort.name == new_cohort_name).one()
         assert_equal(cohort.description, new_cohort_description)
+        
+        # and the users that were bulk inserted into it
+        wikiusers = self.session.query(WikiUser)\
+            .join(CohortWikiUser, CohortWikiUser.wiki_user_id == WikiUser.id)\
+            .filter(CohortWikiUser.cohort_id == cohort.id)\
+            .all()
+        assert_equal(
+            sorted((w.mediawiki_username, w.project) for w in wikiusers),
+            [('Dan', 'enwiki'), ('Evan', 'dewiki')]
+        )
     
     def test_cohort_upload_finish_sets_project_from_users(self):
         new_cohort_name = 'New Test Cohort'
@@ -314,3 +325,15 @@ class TestCohortsController(WebTest):
         assert_equal(valid[0]['user_id'], self.test_mediawiki_user_id)
         assert_equal(invalid[0]['reason_invalid'], 'invalid project: blah')
         assert_equal(invalid[1]['reason_invalid'], 'invalid user_name / user_id: blah')
+    
+    def test_normalize_users(self):
+        normalized = normalize_users(
+            ['Dan', str(self.test_mediawiki_user_id_evan), 'blah', '0'],
+            'enwiki'
+        )
+        assert_equal(normalized, {
+            'Dan': (self.test_mediawiki_user_id, 'Dan'),
+            str(self.test_mediawiki_user_id_evan): (
+                self.test_mediawiki_user_id_evan, 'Evan'
+            ),
+        })
@@ -3,10 +3,16 @@ import celery
 import time
 from nose.tools import assert_true, assert_equal
 from tests.fixtures import WebTest
+from wikimetrics.configurables import db
 from wikimetrics.models import PersistentReport
+from wikimetrics.models.report_nodes import Aggregation, MetricResults
+from wikimetrics.result_store import load_result
 from wikimetrics.controllers.reports import (
     get_celery_task,
-    get_celery_task_result
+    get_celery_task_result,
+    legacy_result,
+    stream_csv,
+    stream_ndjson,
 )
 
 
@@ -100,6 +106,9 @@ class ReportsControllerTest(WebTest):
         result = get_celery_task_result(task, report)
         assert_true(result is not None)
         
+        # the report node saved the same result in the result store
+        assert_equal(load_result(result_key), result)
+        
         # Check the status via get
         response = self.app.get('/reports/status/{0}'.format(result_key))
         assert_true(response.data.find('SUCCESS') >= 0)
@@ -121,6 +130,15 @@ class ReportsControllerTest(WebTest):
         report_new.update_status()
         assert_equal(report_new.status, celery.states.SUCCESS)
         
+        # and the same with update_statuses
+        report.status = celery.states.STARTED
+        self.session.commit()
+        PersistentReport.update_statuses([report], self.session)
+        assert_equal(report.status, celery.states.SUCCESS)
+        self.session.commit()
+        self.session.expire(report)
+        assert_equal(report.status, celery.states.SUCCESS)
+        
         # Change this report to look like the old style, to test that still works
         # TODO: delete this test on October 1st
         report.result_key = report.queue_result_key
@@ -128,6 +146,50 @@ class ReportsControllerTest(WebTest):
         result = get_celery_task_result(task, report)
         assert_true(result is not None)
     
+    def test_report_status_updates(self):
+        long_poll = db.config.get('REPORT_STATUS_LONG_POLL')
+        db.config['REPORT_STATUS_LONG_POLL'] = True
+        try:
+            response = self.app.get('/reports/status/updates')
+        finally:
+            db.config['REPORT_STATUS_LONG_POLL'] = long_poll
+        parsed = json.loads(response.data)
+        assert_true('supported' in parsed)
+        if parsed['supported']:
+            # a client that hasn't seen any version yet gets one right away
+            assert_true(parsed['version'] is not None)
+            assert_equal(parsed['changed'], False)
+    
+    def test_report_status_updates_long_poll_off(self):
+        long_poll = db.config.get('REPORT_STATUS_LONG_POLL')
+        db.config['REPORT_STATUS_LONG_POLL'] = False
+        try:
+            response = self.app.get('/reports/status/updates')
+        finally:
+            db.config['REPORT_STATUS_LONG_POLL'] = long_poll
+        assert_equal(json.loads(response.data), {'supported': False})
+    
+    def test_report_status_updates_redis_down(self):
+        import redis
+        from wikimetrics import report_status
+        
+        # nothing listens on port 1
+        clients = dict(report_status.clients)
+        report_status.clients[True] = redis.StrictRedis(port=1, socket_timeout=1)
+        long_poll = db.config.get('REPORT_STATUS_LONG_POLL')
+        db.config['REPORT_STATUS_LONG_POLL'] = True
+        try:
+            response = self.app.get('/reports/status/updates', query_string={
+                'version': '3',
+            })
+        finally:
+            db.config['REPORT_STATUS_LONG_POLL'] = long_poll
+            report_status.clients.clear()
+            report_status.clients.update(clients)
+        
+        # so the client goes back to polling instead of asking again right away
+        assert_equal(json.loads(response.data), {'supported': False})
+    
     def test_report_result_csv_error(self):
         response = self.app.get('/reports/result/blah.csv')
         assert_true(response.data.find('isError') >= 0)
@@ -249,3 +311,50 @@ class ReportsControllerTest(WebTest):
         # Check the csv result
         response = self.app.get('/reports/result/{0}.csv'.format(result_key))
         assert_true(response.data.find('Standard Deviation') >= 0)
+    
+    def test_stream_csv(self):
+        task_result = {
+            Aggregation.IND: [{
+                1: {'edits': 2},
+                2: {'edits': 3},
+            }],
+            Aggregation.SUM: {'edits': 5},
+        }
+        lines = list(stream_csv(task_result))
+        assert_equal(lines[0], 'user_id,edits\r\n')
+        assert_equal(sorted(lines[1:3]), ['1,2\r\n', '2,3\r\n'])
+        assert_equal(lines[3], '{0},5\r\n'.format(Aggregation.SUM))
+    
+    def test_stream_csv_columnar(self):
+        individual = {1: {'edits': 2}, 2: {'edits': 3}}
+        task_result = {
+            Aggregation.IND: [MetricResults.from_dict(individual)],
+            Aggregation.SUM: {'edits': 5},
+        }
+        lines = list(stream_csv(task_result))
+        assert_equal(lines[0], 'user_id,edits\r\n')
+        assert_equal(sorted(lines[1:3]), ['1,2\r\n', '2,3\r\n'])
+        assert_equal(legacy_result(task_result)[Aggregation.IND], [individual])
+    
+    def test_stream_csv_time_series(self):
+        task_result = {
+            Aggregation.IND: [MetricResults.from_dict({
+                1: {'edits': {'2013-06-01': 2, '2013-07-01': 0}},
+            })],
+            Aggregation.SUM: {'edits': {'2013-06-01': 2, '2013-07-01': 0}},
+        }
+        lines = list(stream_csv(task_result))
+        assert_equal(lines[0], 'user_id,edits 2013-06-01,edits 2013-07-01\r\n')
+        assert_equal(lines[1], '1,2,0\r\n')
+        assert_equal(lines[2], '{0},2,0\r\n'.format(Aggregation.SUM))
+    
+    def test_stream_ndjson(self):
+        task_result = {
+            Aggregation.IND: [{
+                1: {'edits': 2},
+            }],
+        }
+        lines = list(stream_ndjson(task_result))
+        assert_equal(len(lines), 1)
+        assert_true(lines[0].endswith('\n'))
+        assert_equal(json.loads(lines[0]), {'edits': 2, 'user_id': 1})
@@ -1,8 +1,14 @@
 import os
+import shutil
+import tempfile
+import time
 from unittest import TestCase
 from nose.tools import assert_equals, assert_true
 from wikimetrics.configurables import db
-from wikimetrics.database import get_host_projects, get_host_projects_map
+from wikimetrics.database import get_connection_stats
+from wikimetrics.project_catalog import (
+    get_host_projects, get_host_projects_map, ProjectCatalog,
+)
 
 
 class DatabaseSetupTest(TestCase):
@@ -19,6 +25,46 @@ class DatabaseSetupTest(TestCase):
         assert_true('arwiki' in project_host_map)
         assert_true('commonswiki' in project_host_map)
     
+    def test_mw_engines_shared_by_host(self):
+        db.config['MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE'] = 'mysql://test@{0}/'
+        try:
+            assert_equals(db.get_mw_engine_key('enwiki'), db.project_host_map['enwiki'])
+        finally:
+            db.config['MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE'] = None
+        assert_equals(db.get_mw_engine_key('enwiki'), 'enwiki')
+    
+    def test_mw_pool_options(self):
+        db.config['MEDIAWIKI_POOL_OPTIONS'] = {'s1': {'pool_size': 20}}
+        try:
+            options = db.get_mw_pool_options('s1', 'mysql://test@s1/')
+            assert_equals(options['pool_size'], 20)
+            options = db.get_mw_pool_options('s2', 'mysql://test@s2/')
+            assert_equals(options['pool_size'], db.config['MEDIAWIKI_POOL_SIZE'])
+            assert_equals(db.get_mw_pool_options('s1', 'sqlite:///s1.db'), {})
+        finally:
+            db.config['MEDIAWIKI_POOL_OPTIONS'] = {}
+    
+    def test_evict_idle_mw_engines(self):
+        db.get_mw_engine('evictwiki')
+        assert_true('evictwiki' in db.mediawiki_engines)
+        
+        db.mediawiki_engines_last_used['evictwiki'] = 0
+        db.evict_idle_mw_engines()
+        assert_true('evictwiki' not in db.mediawiki_engines)
+    
+    def test_fresh_connections_are_not_pinged(self):
+        before = get_connection_stats()
+        session = db.get_session()
+        session.execute('SELECT 1')
+        session.close()
+        after = get_connection_stats()
+        assert_true(after['checkouts'] > before['checkouts'])
+        assert_equals(after['pings'], before['pings'])
+    
+    def test_migrate_when_up_to_date(self):
+        db.migrate()
+        assert_equals(db.migrate(), [])
+    
     #def test_get_fresh_project_host_map(self):
         #project_host_map_cache_file = 'project_host_map.json'
         ## make sure any cached file is deleted
@@ -31,3 +77,73 @@ class DatabaseSetupTest(TestCase):
         #os.remove(project_host_map_cache_file)
         #db.get_project_host_map(usecache=False)
         #assert_true(os.path.exists(project_host_map_cache_file))
+
+
+class ProjectCatalogTest(TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write_dblist(1, ['enwiki'])
+        self.write_dblist(2, ['dewiki', 'frwiki'])
+        self.cache_path = os.path.join(self.directory, 'project_host_map.json')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def write_dblist(self, host_id, projects):
+        path = os.path.join(self.directory, 's{0}.dblist'.format(host_id))
+        with open(path, 'w') as dblist:
+            dblist.write('\n'.join(projects) + '\n')
+    
+    def make_catalog(self, ttl=60):
+        return ProjectCatalog(
+            url_template='file://' + os.path.join(self.directory, 's{0}.dblist'),
+            cache_path=self.cache_path,
+            ttl=ttl,
+            host_count=2,
+        )
+    
+    def test_loads_dblists(self):
+        index = self.make_catalog().get_index()
+        assert_equals(index['enwiki'], 's1')
+        assert_equals(index['frwiki'], 's2')
+        assert_equals(len(index), 3)
+        assert_true(os.path.exists(self.cache_path))
+    
+    def test_loads_from_cache(self):
+        self.make_catalog().get_index()
+        self.write_dblist(1, ['arwiki'])
+        
+        index = self.make_catalog().get_index()
+        assert_true('enwiki' in index)
+        assert_true('arwiki' not in index)
+    
+    def test_refreshes_stale_index_in_background(self):
+        catalog = self.make_catalog()
+        index = catalog.get_index()
+        self.write_dblist(1, ['arwiki'])
+        catalog.ttl = 0
+        time.sleep(0.01)
+        
+        # the stale index is still served while the new one is fetched
+        assert_true(catalog.get_index() is index)
+        for i in range(100):
+            if catalog.index is not index:
+                break
+            time.sleep(0.05)
+        assert_true('arwiki' in catalog.index)
+        assert_equals(catalog.index.version, index.version + 1)
+    
+    def test_stale_cache_is_refreshed_in_background(self):
+        self.make_catalog().get_index()
+        self.write_dblist(1, ['arwiki'])
+        
+        # a new process starts with the old cache, without waiting for a fetch
+        catalog = self.make_catalog(ttl=0)
+        index = catalog.get_index()
+        assert_true('enwiki' in index)
+        for i in range(100):
+            if catalog.index is not index:
+                break
+            time.sleep(0.05)
+        assert_true('arwiki' in catalog.index)
@@ -0,0 +1,82 @@
+from datetime import date
+from nose.tools import assert_equals, assert_true
+from tests.fixtures import DatabaseWithCohortTest
+from wikimetrics.models import UserDailyActivity, UserDailyActivityCoverage
+from wikimetrics.metrics.revision_activity import RevisionActivity
+from wikimetrics.metrics.daily_activity_store import (
+    DailyActivityStore, insert_ignore
+)
+
+
+class DailyActivityStoreTest(DatabaseWithCohortTest):
+
+    def make_metric(self, start_date, end_date):
+        return RevisionActivity(
+            namespaces=[0],
+            start_date=start_date,
+            end_date=end_date,
+        )
+    
+    def test_matches_revision_activity(self):
+        metric = self.make_metric('2013-06-01', '2013-08-01')
+        expected = metric(list(self.cohort), self.mwSession)
+        
+        store = DailyActivityStore('enwiki')
+        results = store.revision_activity(metric, list(self.cohort), self.mwSession)
+        assert_equals(results, expected)
+        assert_equals(results[self.dan_id]['net_sum'], 6)
+    
+    def test_reuses_stored_days(self):
+        store = DailyActivityStore('enwiki')
+        store.revision_activity(
+            self.make_metric('2013-06-01', '2013-07-01'),
+            list(self.cohort),
+            self.mwSession,
+        )
+        stored = self.session.query(UserDailyActivity).count()
+        assert_true(stored > 0)
+        
+        # the overlapping days are not stored twice
+        metric = self.make_metric('2013-05-01', '2013-08-01')
+        results = store.revision_activity(metric, list(self.cohort), self.mwSession)
+        assert_equals(results, metric(list(self.cohort), self.mwSession))
+        
+        coverage = self.session.query(UserDailyActivityCoverage)\
+            .filter(UserDailyActivityCoverage.user_id == self.dan_id)\
+            .one()
+        assert_equals(str(coverage.covered_from), '2013-05-01')
+        assert_equals(str(coverage.covered_until), '2013-08-01')
+    
+    def test_stores_days_once(self):
+        store = DailyActivityStore('enwiki')
+        store.materialize(
+            list(self.cohort), date(2013, 6, 1), date(2013, 7, 1), self.mwSession
+        )
+        stored = self.session.query(UserDailyActivity).all()
+        assert_true(len(stored) > 0)
+        
+        # another report, started before the first one committed, stores the same
+        rows = [
+            dict(
+                (c.name, getattr(activity, c.name))
+                for c in UserDailyActivity.__table__.columns if c.name != 'id'
+            )
+            for activity in stored
+        ]
+        self.session.execute(insert_ignore(UserDailyActivity, self.session), rows)
+        self.session.execute(
+            insert_ignore(UserDailyActivityCoverage, self.session),
+            [{
+                'project'       : 'enwiki',
+                'user_id'       : self.dan_id,
+                'covered_from'  : date(2013, 6, 1),
+                'covered_until' : date(2013, 7, 1),
+            }]
+        )
+        self.session.commit()
+        
+        assert_equals(self.session.query(UserDailyActivity).count(), len(stored))
+        coverage = self.session.query(UserDailyActivityCoverage)\
+            .filter(UserDailyActivityCoverage.user_id == self.dan_id)\
+            .all()
+        assert_equals(len(coverage), 1)
@@ -1,6 +1,7 @@
 from nose.tools import assert_true, assert_equal
 from tests.fixtures import DatabaseWithCohortTest, QueueDatabaseTest
 
+from wikimetrics.configurables import db
 from wikimetrics.metrics import NamespaceEdits
 from wikimetrics.models import Cohort, MetricReport
 
@@ -19,6 +20,24 @@ class NamespaceEditsDatabaseTest(DatabaseWithCohortTest):
         assert_equal(results[self.test_mediawiki_user_id]['edits'], 2)
         assert_equal(results[self.test_mediawiki_user_id_evan]['edits'], 3)
     
+    def test_finds_edits_in_batches(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2013-06-01',
+            end_date='2013-08-01',
+        )
+        batch_size = db.config.get('METRIC_BATCH_SIZE')
+        db.config['METRIC_BATCH_SIZE'] = 1
+        try:
+            results = metric(list(self.cohort), self.mwSession)
+        finally:
+            db.config['METRIC_BATCH_SIZE'] = batch_size
+        
+        assert_equal(len(results), 4)
+        assert_equal(results[self.test_mediawiki_user_id]['edits'], 2)
+        assert_equal(results[self.test_mediawiki_user_id_evan]['edits'], 3)
+        assert_equal(results[self.test_mediawiki_user_id_andrew]['edits'], 0)
+    
     def test_reports_zero_edits(self):
         metric = NamespaceEdits(
             namespaces=[0],
@@ -0,0 +1,105 @@
+from datetime import datetime
+from unittest import TestCase
+from nose.tools import assert_equal
+from tests.fixtures import DatabaseWithCohortTest
+from wikimetrics.metrics import RevertRate
+from wikimetrics.metrics.revert_detection import detect_reverts
+from wikimetrics.models import Page, Revision
+
+
+def reverts(sha1s, radius=15):
+    history = [(sha1, index) for index, sha1 in enumerate(sha1s)]
+    return list(detect_reverts(history, radius))
+
+
+class RevertDetectionTest(TestCase):
+    
+    def test_identity_revert(self):
+        assert_equal(reverts(['a', 'b', 'c', 'a']), [(3, [1, 2])])
+    
+    def test_no_change_is_not_a_revert(self):
+        assert_equal(reverts(['a', 'a', 'b']), [])
+    
+    def test_reverted_states_cannot_be_reverted_to(self):
+        assert_equal(reverts(['a', 'b', 'a', 'b']), [(2, [1])])
+    
+    def test_reverts_of_reverts(self):
+        assert_equal(reverts(['a', 'b', 'a', 'c', 'a']), [(2, [1]), (4, [3])])
+    
+    def test_radius(self):
+        assert_equal(reverts(['a', 'b', 'c', 'd', 'a'], radius=3), [])
+        assert_equal(reverts(['a', 'b', 'c', 'd', 'a'], radius=4), [(4, [1, 2, 3])])
+    
+    def test_missing_sha1(self):
+        assert_equal(reverts(['a', None, None, 'a']), [(3, [1, 2])])
+
+
+class RevertRateTest(DatabaseWithCohortTest):
+    
+    def setUp(self):
+        DatabaseWithCohortTest.setUp(self)
+        page = self.page('Revert_Test')
+        
+        def revision(user_id, sha1, timestamp, parent=None):
+            return self.revision(page, user_id, sha1, timestamp, parent)
+        
+        # before the report's dates, only there to be reverted to
+        before = revision(self.diederik_id, 'a', datetime(2013, 5, 30))
+        # Dan's edit is reverted by Diederik, Evan reverts his own first edit
+        dan = revision(self.dan_id, 'b', datetime(2013, 6, 2), before)
+        revert = revision(self.diederik_id, 'a', datetime(2013, 6, 3), dan)
+        evan = revision(self.evan_id, 'c', datetime(2013, 6, 4), revert)
+        evan = revision(self.evan_id, 'a', datetime(2013, 6, 5), evan)
+        revision(self.evan_id, 'd', datetime(2013, 6, 6), evan)
+    
+    def page(self, title):
+        page = Page(page_namespace=310, page_title=title)
+        self.mwSession.add(page)
+        self.mwSession.commit()
+        return page
+    
+    def revision(self, page, user_id, sha1, timestamp, parent=None):
+        r = Revision(
+            rev_page=page.page_id, rev_user=user_id, rev_sha1=sha1,
+            rev_timestamp=timestamp, rev_len=len(sha1),
+            rev_parent_id=parent.rev_id if parent else 0,
+        )
+        self.mwSession.add(r)
+        self.mwSession.commit()
+        return r
+    
+    def test_revert_to_before_the_revision_before_start_date(self):
+        page = self.page('Vandalized')
+        clean = self.revision(page, self.diederik_id, 'x', datetime(2013, 5, 20))
+        vandalism = self.revision(page, self.andrew_id, 'y', datetime(2013, 5, 31), clean)
+        dan = self.revision(page, self.dan_id, 'z', datetime(2013, 6, 7), vandalism)
+        # back to before the vandalism, two revisions before start_date
+        self.revision(page, self.diederik_id, 'x', datetime(2013, 6, 8), dan)
+        
+        metric = RevertRate(
+            namespaces=[310],
+            start_date='2013-06-01',
+            end_date='2013-06-10',
+        )
+        results = metric([self.dan_id, self.andrew_id], self.mwSession)
+        assert_equal(results[self.dan_id], {
+            'edits': 2, 'reverted': 2, 'revert_rate': 1.0,
+        })
+        # the vandalism was before start_date, so it isn't counted
+        assert_equal(results[self.andrew_id]['edits'], 0)
+    
+    def test_revert_rate(self):
+        metric = RevertRate(
+            namespaces=[310],
+            start_date='2013-06-01',
+            end_date='2013-06-10',
+        )
+        results = metric(list(self.cohort), self.mwSession)
+        
+        assert_equal(results[self.dan_id], {
+            'edits': 1, 'reverted': 1, 'revert_rate': 1.0,
+        })
+        assert_equal(results[self.evan_id], {
+            'edits': 3, 'reverted': 0, 'revert_rate': 0.0,
+        })
+        assert_equal(results[self.andrew_id]['revert_rate'], 0.0)
@@ -0,0 +1,80 @@
+from unittest import TestCase
+from nose.tools import assert_equal
+from tests.fixtures import DatabaseWithCohortTest
+from wikimetrics.metrics import NamespaceEdits, BytesAdded
+from wikimetrics.metrics.time_series import TimeSeries
+
+
+class TimeSeriesTest(TestCase):
+
+    def test_day_buckets(self):
+        series = TimeSeries('day', '2013-06-30', '2013-07-02')
+        assert_equal(series.buckets, ['2013-06-30', '2013-07-01', '2013-07-02'])
+    
+    def test_week_buckets_start_on_monday(self):
+        series = TimeSeries('week', '2013-06-05', '2013-06-17')
+        assert_equal(series.buckets, ['2013-06-03', '2013-06-10', '2013-06-17'])
+    
+    def test_month_buckets(self):
+        series = TimeSeries('month', '2013-11-15', '2014-01-01')
+        assert_equal(series.buckets, ['2013-11-01', '2013-12-01', '2014-01-01'])
+    
+    def test_empty(self):
+        series = TimeSeries('month', '2013-06-01', '2013-07-01')
+        assert_equal(series.empty(['edits'], None), {
+            'edits': {'2013-06-01': None, '2013-07-01': None},
+        })
+
+
+class TimeSeriesDatabaseTest(DatabaseWithCohortTest):
+
+    def test_edits_by_month(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2013-06-01',
+            end_date='2013-08-01',
+            time_series='month',
+        )
+        results = metric(list(self.cohort), self.mwSession)
+        
+        assert_equal(results[self.test_mediawiki_user_id]['edits'], {
+            '2013-06-01': 1, '2013-07-01': 1, '2013-08-01': 0,
+        })
+        assert_equal(results[self.test_mediawiki_user_id_evan]['edits'], {
+            '2013-06-01': 1, '2013-07-01': 2, '2013-08-01': 0,
+        })
+        assert_equal(results[self.test_mediawiki_user_id_andrew]['edits'], {
+            '2013-06-01': 0, '2013-07-01': 0, '2013-08-01': 0,
+        })
+    
+    def test_edits_by_week(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2013-06-01',
+            end_date='2013-07-07',
+            time_series='week',
+        )
+        results = metric(list(self.cohort), self.mwSession)
+        
+        edits = results[self.test_mediawiki_user_id_evan]['edits']
+        assert_equal(edits['2013-05-27'], 1)
+        assert_equal(edits['2013-07-01'], 1)
+        assert_equal(sum(edits.values()), 2)
+    
+    def test_bytes_added_by_month(self):
+        metric = BytesAdded(
+            namespaces=[0],
+            start_date='2013-05-01',
+            end_date='2013-07-31',
+            time_series='month',
+        )
+        results = metric(list(self.cohort), self.mwSession)
+        
+        net_sum = results[self.test_mediawiki_user_id]['net_sum']
+        assert_equal(net_sum['2013-06-01'], -4)
+        assert_equal(net_sum['2013-07-01'], 10)
+        # empty buckets are 0, whether or not the user did anything at all
+        assert_equal(net_sum['2013-05-01'], 0)
+        assert_equal(results[self.test_mediawiki_user_id_andrew]['net_sum'], {
+            '2013-05-01': 0, '2013-06-01': 0, '2013-07-01': 0,
+        })
@@ -102,6 +102,10 @@ class AggregateReportWithoutQueueTest(DatabaseTest):
             finished[ar.result_key][Aggregation.AVG]['other_sub_metric'],
             Decimal(1.425)
         )
+        assert_equals(
+            finished[ar.result_key][Aggregation.STD]['edits'],
+            1.299
+        )
     
     def test_repr(self):
         cohort = self.session.query(Cohort).get(self.test_cohort_id)
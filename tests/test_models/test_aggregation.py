@@ -0,0 +1,81 @@
+from decimal import Decimal
+from unittest import TestCase
+from nose.tools import assert_equals
+from wikimetrics.models import Aggregation, MetricResults
+from wikimetrics.models.report_nodes import aggregation
+from wikimetrics.models.report_nodes.aggregation import (
+    aggregate_columns, python_statistics, percentile,
+)
+
+
+class AggregationTest(TestCase):
+
+    def setUp(self):
+        self.results = [
+            MetricResults.from_dict({
+                1: {'edits': 2, 'net_sum': Decimal('2.5')},
+                2: {'edits': 3, 'net_sum': None},
+            }),
+            MetricResults.from_dict({
+                3: {'edits': 0, 'net_sum': Decimal('-1')},
+                4: {'edits': 0, 'net_sum': Decimal('0.5')},
+            }),
+        ]
+    
+    def test_aggregate_columns(self):
+        aggregated = aggregate_columns(self.results, Aggregation.ALL)
+        
+        assert_equals(aggregated[Aggregation.SUM], {'edits': 5, 'net_sum': 2})
+        assert_equals(aggregated[Aggregation.AVG], {'edits': 1.25, 'net_sum': 0.5})
+        assert_equals(aggregated[Aggregation.STD]['edits'], 1.299)
+        assert_equals(aggregated[Aggregation.MIN], {'edits': 0, 'net_sum': -1})
+        assert_equals(aggregated[Aggregation.MAX], {'edits': 3, 'net_sum': 2.5})
+        assert_equals(aggregated[Aggregation.MED], {'edits': 1, 'net_sum': 0.25})
+        assert_equals(aggregated[Aggregation.P25]['edits'], 0)
+        assert_equals(aggregated[Aggregation.P75]['edits'], 2.25)
+        assert_equals(aggregated[Aggregation.P90]['edits'], 2.7)
+        assert_equals(aggregated[Aggregation.P99]['edits'], 2.97)
+    
+    def test_only_asked_for_aggregates(self):
+        aggregated = aggregate_columns(self.results, [Aggregation.SUM])
+        assert_equals(aggregated, {Aggregation.SUM: {'edits': 5, 'net_sum': 2}})
+    
+    def test_without_numpy(self):
+        numpy = aggregation.numpy
+        aggregation.numpy = None
+        try:
+            aggregated = aggregate_columns(self.results, Aggregation.ALL)
+        finally:
+            aggregation.numpy = numpy
+        
+        assert_equals(aggregated[Aggregation.STD]['edits'], 1.299)
+        assert_equals(aggregated[Aggregation.MED]['net_sum'], 0.25)
+        assert_equals(aggregated[Aggregation.P99]['edits'], 2.97)
+    
+    def test_non_numeric_columns_are_skipped(self):
+        aggregated = aggregate_columns(
+            [MetricResults.from_dict({1: {'name': 'Dan', 'edits': 1}})],
+            [Aggregation.SUM],
+        )
+        assert_equals(aggregated[Aggregation.SUM], {'edits': 1})
+    
+    def test_time_series(self):
+        aggregated = aggregate_columns([MetricResults.from_dict({
+            1: {'edits': {'2013-06-01': 2, '2013-07-01': 0}},
+            2: {'edits': {'2013-06-01': 1, '2013-07-01': 3}},
+        })], [Aggregation.SUM, Aggregation.AVG])
+        
+        assert_equals(aggregated[Aggregation.SUM], {
+            'edits': {'2013-06-01': 3, '2013-07-01': 3},
+        })
+        assert_equals(aggregated[Aggregation.AVG], {
+            'edits': {'2013-06-01': 1.5, '2013-07-01': 1.5},
+        })
+    
+    def test_empty_column(self):
+        assert_equals(python_statistics([[]], Aggregation.ALL), {})
+    
+    def test_percentile(self):
+        assert_equals(percentile([1], 90), 1)
+        assert_equals(percentile([1, 2, 3, 4, 5], 50), 3)
+        assert_equals(percentile([1, 2, 3, 4], 50), 2.5)
@@ -0,0 +1,51 @@
+from nose.tools import assert_equals, assert_true
+from wikimetrics.metrics import metric_classes
+from wikimetrics.models import (
+    MetricReport, ReportNode, fuse_metric_reports,
+)
+from ..fixtures import DatabaseTest
+
+
+class MetricFusionTest(DatabaseTest):
+    
+    def make_metric(self, name, start_date='2013-06-01'):
+        return metric_classes[name](
+            name=name,
+            namespaces=[0, 1, 2],
+            start_date=start_date,
+            end_date='2013-09-01',
+        )
+    
+    def make_report(self, metric):
+        user_ids = [
+            self.test_mediawiki_user_id,
+            self.test_mediawiki_user_id_evan,
+            self.test_mediawiki_user_id_andrew,
+        ]
+        return MetricReport(metric, user_ids, 'enwiki')
+    
+    def test_fuses_compatible_metrics(self):
+        edits = self.make_report(self.make_metric('NamespaceEdits'))
+        bytes_added = self.make_report(self.make_metric('BytesAdded'))
+        other_dates = self.make_report(self.make_metric('PagesCreated', '2013-07-01'))
+        fuse_metric_reports(ReportNode(children=[edits, bytes_added, other_dates]))
+        
+        assert_true(edits.fused is not None)
+        assert_true(edits.fused is bytes_added.fused)
+        assert_true(other_dates.fused is None)
+    
+    def test_fused_results_match(self):
+        edits = self.make_report(self.make_metric('NamespaceEdits'))
+        bytes_added = self.make_report(self.make_metric('BytesAdded'))
+        expected_edits = edits.run()
+        expected_bytes_added = bytes_added.run()
+        
+        fuse_metric_reports(ReportNode(children=[edits, bytes_added]))
+        assert_equals(edits.run(), expected_edits)
+        assert_equals(bytes_added.run(), expected_bytes_added)
+    
+    def test_split_fused(self):
+        metric = self.make_metric('PagesCreated')
+        fused = {'edits': 3, 'pages_created': 1, 'net_sum': 10}
+        assert_equals(metric.split_fused(fused), {'pages_created': 1})
+        assert_equals(metric.split_fused(None), {'pages_created': 0})
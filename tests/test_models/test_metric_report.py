@@ -28,6 +28,28 @@ class MetricReportTest(DatabaseTest):
         result = mr.run()
         assert_equals(result[self.test_mediawiki_user_id]['edits'], 2)
     
+    def test_temporary_table_response(self):
+        metric = metric_classes['BytesAdded'](
+            name='BytesAdded',
+            namespaces=[0, 1, 2],
+            start_date='2013-06-01',
+            end_date='2013-09-01',
+        )
+        mr = MetricReport(
+            metric,
+            [
+                self.test_mediawiki_user_id,
+                self.test_mediawiki_user_id_evan,
+                self.test_mediawiki_user_id_andrew,
+            ],
+            'enwiki',
+            use_temporary_table=True,
+        )
+        
+        result = mr.run()
+        assert_equals(result[self.test_mediawiki_user_id]['net_sum'], 6)
+        assert_equals(result[self.test_mediawiki_user_id_andrew]['net_sum'], None)
+    
     def test_repr(self):
         metric = metric_classes['NamespaceEdits'](
             name='NamespaceEdits',
@@ -0,0 +1,76 @@
+import cPickle
+from decimal import Decimal
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+from wikimetrics.models import MetricResults
+
+
+class MetricResultsTest(TestCase):
+
+    def test_from_dict(self):
+        results = MetricResults.from_dict({
+            1: {'edits': 2, 'net_sum': Decimal('1.5')},
+            2: {'edits': 3, 'net_sum': None},
+        }, 'enwiki')
+        
+        assert_equals(len(results), 2)
+        assert_equals(results[1], {'edits': 2, 'net_sum': 1.5})
+        assert_equals(results[2]['net_sum'], None)
+        assert_equals(results.kinds['edits'], 'int')
+        assert_equals(results.kinds['net_sum'], 'float')
+        assert_equals(results.projects, [('enwiki', 2)])
+    
+    def test_odd_values(self):
+        results = MetricResults.from_dict({
+            None: {'survived': True, 'name': 'Dan'},
+            5: {'survived': False, 'name': None},
+        })
+        assert_equals(results.to_dict(), {
+            None: {'survived': True, 'name': 'Dan'},
+            5: {'survived': False, 'name': None},
+        })
+    
+    def test_concatenate(self):
+        results = MetricResults.concatenate([
+            MetricResults.from_dict({1: {'edits': 2}, 2: {'edits': 3}}, 'enwiki'),
+            MetricResults.from_dict({2: {'edits': 7}, 3: {'edits': 0}}, 'dewiki'),
+        ])
+        
+        # like updating a dictionary, the last result for a user_id wins
+        assert_equals(results.to_dict(), {
+            1: {'edits': 2},
+            2: {'edits': 7},
+            3: {'edits': 0},
+        })
+        assert_equals(results.projects, [('enwiki', 1), ('dewiki', 2)])
+    
+    def test_time_series(self):
+        time_series = {
+            1: {'edits': {'2013-06-01': 2, '2013-07-01': 0}},
+            2: {'edits': {'2013-06-01': 1, '2013-07-01': 3}},
+        }
+        results = MetricResults.from_dict(time_series)
+        
+        assert_equals(results.kinds.keys(), [
+            ('edits', '2013-06-01'), ('edits', '2013-07-01'),
+        ])
+        assert_equals(results.to_dict(), time_series)
+    
+    def test_pickle(self):
+        results = MetricResults.from_dict(
+            dict((i, {'edits': i, 'net_sum': i * 0.5}) for i in range(1000))
+        )
+        pickled = cPickle.dumps(results, cPickle.HIGHEST_PROTOCOL)
+        legacy = cPickle.dumps(results.to_dict(), cPickle.HIGHEST_PROTOCOL)
+        
+        assert_equals(cPickle.loads(pickled), results)
+        assert_true(len(pickled) < len(legacy) / 2)
+    
+    def test_pickle_nulls(self):
+        results = MetricResults.from_dict({
+            1: {'edits': None, 'survived': True, 'ratio': 0.1},
+            2: {'edits': 2 ** 40, 'survived': None, 'ratio': None},
+        })
+        unpickled = cPickle.loads(cPickle.dumps(results, cPickle.HIGHEST_PROTOCOL))
+        assert_equals(unpickled, results)
+        assert_equals(unpickled[1]['ratio'], 0.1)
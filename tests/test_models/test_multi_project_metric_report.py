@@ -1,7 +1,7 @@
 from nose.tools import assert_equals, assert_true
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
-    MultiProjectMetricReport, PersistentReport, Cohort,
+    MultiProjectMetricReport, MetricReport, PersistentReport, Cohort,
 )
 from ..fixtures import QueueDatabaseTest, DatabaseTest
 
@@ -52,6 +52,24 @@ class MultiProjectMetricReportWithoutQueueTest(DatabaseTest):
         assert_equals(finished[mr.result_key][1]['edits'], 2)
         assert_equals(finished[mr.result_key][2]['edits'], 3)
     
+    def test_run_children_in_parallel(self):
+        cohort = self.session.query(Cohort).get(self.test_cohort_id)
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-06-01',
+            end_date='2013-09-01',
+        )
+        mr = MultiProjectMetricReport(cohort, metric, 'enwiki')
+        mr.children = [
+            MetricReport(metric, [self.test_mediawiki_user_id], 'enwiki'),
+            MetricReport(metric, [self.test_mediawiki_user_id_evan], 'enwiki'),
+        ]
+        
+        result = mr.run()
+        assert_equals(result[mr.result_key][self.test_mediawiki_user_id]['edits'], 2)
+        assert_equals(result[mr.result_key][self.test_mediawiki_user_id_evan]['edits'], 3)
+    
     def test_repr(self):
         cohort = self.session.query(Cohort).get(self.test_cohort_id)
         metric = metric_classes['NamespaceEdits'](
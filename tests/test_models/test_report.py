@@ -1,10 +1,17 @@
 # 101-108, 114, 130-145, 153
+from celery.exceptions import SoftTimeLimitExceeded
 from nose.tools import assert_equals, assert_true
-from wikimetrics.metrics import metric_classes
+from wikimetrics.metrics import metric_classes, Metric
 from wikimetrics.models import (
-    Report, ReportNode, ReportLeaf, PersistentReport, MetricReport,
+    Report, ReportNode, ReportLeaf, PersistentReport, MetricReport, ReportWriter,
 )
 from wikimetrics.models import queue_task
+from wikimetrics.models.report_nodes.report import (
+    run_report, checkpoint_key, delete_checkpoints,
+)
+from wikimetrics.models.report_nodes.metric_report import batch_checkpoint_key
+from wikimetrics.configurables import db
+from wikimetrics.result_store import load_result
 from ..fixtures import QueueDatabaseTest, DatabaseTest
 
 
@@ -74,6 +81,162 @@ class QueueTaskTest(QueueDatabaseTest):
         assert_equals(pr_working.queue_result_key, '1')
 
 
+class ReportWriterTest(DatabaseTest):
+    
+    def test_inserts_tree_together(self):
+        with ReportWriter():
+            child = FakeReport()
+            parent = ReportNode(children=[child])
+            assert_equals(child.persistent_id, None)
+        
+        assert_true(child.persistent_id is not None)
+        assert_true(parent.persistent_id is not None)
+        assert_true(child.writer is parent.writer)
+    
+    def test_inserted_rows(self):
+        with ReportWriter():
+            first = FakeReport(name='first')
+            second = FakeReport(name='second')
+        
+        pr_first = self.session.query(PersistentReport).get(first.persistent_id)
+        pr_second = self.session.query(PersistentReport).get(second.persistent_id)
+        assert_equals(pr_first.name, 'first')
+        assert_equals(pr_second.name, 'second')
+        # the tags used to find the rows again are gone
+        assert_equals(pr_first.queue_result_key, None)
+        assert_true(pr_first.created is not None)
+    
+    def test_buffers_updates(self):
+        with ReportWriter() as writer:
+            first = FakeReport()
+            second = FakeReport()
+        
+        first.set_status('STARTED', task_id=1)
+        second.set_status('SUCCESS')
+        pr_first = self.session.query(PersistentReport).get(first.persistent_id)
+        assert_equals(pr_first.status, 'PENDING')
+        self.session.commit()
+        
+        writer.flush()
+        pr_first = self.session.query(PersistentReport).get(first.persistent_id)
+        pr_second = self.session.query(PersistentReport).get(second.persistent_id)
+        assert_equals(pr_first.status, 'STARTED')
+        assert_equals(pr_first.queue_result_key, '1')
+        assert_equals(pr_second.status, 'SUCCESS')
+
+
+class CheckpointTest(DatabaseTest):
+    
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.max_resumes = db.config.get('REPORT_MAX_RESUMES')
+        self.batch_size = db.config.get('METRIC_BATCH_SIZE')
+        db.config['REPORT_MAX_RESUMES'] = 5
+    
+    def tearDown(self):
+        db.config['REPORT_MAX_RESUMES'] = self.max_resumes
+        db.config['METRIC_BATCH_SIZE'] = self.batch_size
+        DatabaseTest.tearDown(self)
+    
+    def test_checkpointed_reports_run_once(self):
+        report = CountingReport()
+        assert_equals(run_report(report), 1)
+        # like a resumed run would, gets the checkpoint
+        assert_equals(run_report(report), 1)
+        assert_equals(report.runs, 1)
+    
+    def test_delete_checkpoints(self):
+        child = CountingReport()
+        parent = ReportNode(children=[child])
+        run_report(child)
+        assert_equals(load_result(checkpoint_key(child)), 1)
+        
+        delete_checkpoints(parent)
+        assert_equals(load_result(checkpoint_key(child)), None)
+    
+    def test_no_checkpoints_without_resumes(self):
+        db.config['REPORT_MAX_RESUMES'] = 0
+        report = CountingReport()
+        run_report(report)
+        assert_equals(load_result(checkpoint_key(report)), None)
+    
+    def test_node_checkpoints_result_keys(self):
+        child = CountingReport()
+        parent = ReportNode(children=[child])
+        parent.finish = lambda results: parent.report_result(results)
+        result = run_report(parent)
+        
+        # the result is saved once, under its result_key
+        assert_equals(load_result(checkpoint_key(parent)), {
+            'result_keys': [parent.result_key],
+        })
+        assert_equals(parent.load_checkpoint(), result)
+    
+    def test_resumes_after_soft_time_limit(self):
+        finished = CountingReport()
+        interrupted = InterruptedReport()
+        report = ReportNode(children=[finished, interrupted])
+        queue_task.apply(args=[report])
+        
+        # the retry picked up the checkpoint of the child that was done
+        assert_equals(finished.runs, 1)
+        assert_equals(interrupted.runs, 2)
+        assert_equals(report.status, 'SUCCESS')
+        assert_equals(load_result(checkpoint_key(finished)), None)
+    
+    def test_resumes_metric_from_batches(self):
+        db.config['METRIC_BATCH_SIZE'] = 1
+        metric = InterruptedMetric()
+        report = MetricReport(metric, [1, 2, 3], 'enwiki')
+        queue_task.apply(args=[report])
+        
+        # the batches done before the soft time limit were not calculated again
+        assert_equals(metric.calculated, [1, 2, 3])
+        assert_equals(load_result(batch_checkpoint_key(report, 0)), None)
+
+
+class CountingReport(Report):
+    """
+    Counts how many times it ran
+    """
+    runs = 0
+    
+    def run(self):
+        self.runs += 1
+        return self.runs
+
+
+class InterruptedReport(Report):
+    """
+    Runs past the soft time limit the first time it runs
+    """
+    runs = 0
+    
+    def run(self):
+        self.runs += 1
+        if self.runs == 1:
+            raise SoftTimeLimitExceeded()
+        return self.runs
+
+
+class InterruptedMetric(Metric):
+    """
+    Runs past the soft time limit the first time it gets to user 3
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(InterruptedMetric, self).__init__(*args, **kwargs)
+        self.calculated = []
+        self.interrupted = False
+    
+    def calculate(self, user_ids, session):
+        if 3 in user_ids and not self.interrupted:
+            self.interrupted = True
+            raise SoftTimeLimitExceeded()
+        self.calculated.extend(user_ids)
+        return dict((user_id, {'edits': user_id}) for user_id in user_ids)
+
+
 class FakeReport(Report):
     """
     This just helps with some of the tests above
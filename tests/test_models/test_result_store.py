@@ -0,0 +1,42 @@
+from nose.tools import assert_equals, assert_true
+from wikimetrics.configurables import db
+from wikimetrics.models import ReportResultChunk
+from wikimetrics.result_store import save_result, load_result, delete_results
+from ..fixtures import DatabaseTest
+
+
+class ResultStoreTest(DatabaseTest):
+    
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.chunk_size = db.config.get('RESULT_STORE_CHUNK_SIZE')
+    
+    def tearDown(self):
+        db.config['RESULT_STORE_CHUNK_SIZE'] = self.chunk_size
+        DatabaseTest.tearDown(self)
+    
+    def test_save_and_load(self):
+        result = {'a': {1: 2.5, 2: None}, 'b': range(100)}
+        save_result('test-result', result)
+        assert_equals(load_result('test-result'), result)
+    
+    def test_save_in_chunks(self):
+        db.config['RESULT_STORE_CHUNK_SIZE'] = 16
+        result = {str(i): i for i in range(1000)}
+        save_result('test-chunked-result', result)
+        
+        chunks = self.session.query(ReportResultChunk)\
+            .filter(ReportResultChunk.result_key == 'test-chunked-result')\
+            .count()
+        assert_true(chunks > 1)
+        assert_equals(load_result('test-chunked-result'), result)
+    
+    def test_load_missing(self):
+        assert_equals(load_result('not-a-result'), None)
+    
+    def test_delete_results(self):
+        save_result('test-deleted', [1, 2])
+        save_result('test-kept', [3])
+        delete_results(['test-deleted', 'not-a-result'])
+        assert_equals(load_result('test-deleted'), None)
+        assert_equals(load_result('test-kept'), [3])
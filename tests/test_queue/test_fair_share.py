@@ -0,0 +1,150 @@
+import socket
+from unittest import TestCase
+from nose.tools import assert_equals
+from wikimetrics.configurables import db, queue
+from wikimetrics.report_status import get_redis
+from wikimetrics.fair_share import (
+    next_user,
+    dispatch_order,
+    submit_report,
+    report_finished,
+    queue_positions,
+    WAITING,
+    REPORTS,
+    USERS,
+    RUNNING,
+    RUNNING_REPORTS,
+)
+
+
+class FairShareTest(TestCase):
+    
+    def setUp(self):
+        self.weights = db.config.get('FAIR_SHARE_WEIGHTS')
+    
+    def tearDown(self):
+        db.config['FAIR_SHARE_WEIGHTS'] = self.weights
+    
+    def test_least_running_goes_first(self):
+        assert_equals(next_user(['1', '2'], {'1': 3, '2': 1}), '2')
+    
+    def test_takes_turns_on_a_tie(self):
+        assert_equals(next_user(['2', '1'], {}), '2')
+    
+    def test_one_user_does_not_hold_up_the_others(self):
+        order = dispatch_order(
+            {'1': ['10', '11', '12'], '2': ['20']},
+            ['1', '2'],
+            {},
+        )
+        assert_equals(order, [('1', '10'), ('2', '20'), ('1', '11'), ('1', '12')])
+    
+    def test_running_reports_count(self):
+        order = dispatch_order({'1': ['10'], '2': ['20']}, ['1', '2'], {'1': 1})
+        assert_equals(order, [('2', '20'), ('1', '10')])
+    
+    def test_weights(self):
+        db.config['FAIR_SHARE_WEIGHTS'] = {1: 2}
+        # with twice the weight, a user can have twice as many reports running
+        order = dispatch_order(
+            {'1': ['10', '11'], '2': ['20']},
+            ['2', '1'],
+            {'1': 1, '2': 1},
+        )
+        assert_equals(order, [('1', '10'), ('2', '20'), ('1', '11')])
+
+
+class RecordingTask(object):
+    """
+    Stands in for queue_task, remembering which reports were sent to celery
+    """
+    
+    def __init__(self):
+        self.sent = []
+        self.down = False
+    
+    def delay(self, report):
+        if self.down:
+            raise socket.error('celery is down')
+        self.sent.append(report.persistent_id)
+        return queue.AsyncResult(task_id(report.persistent_id))
+
+
+def task_id(report_id):
+    return 'fair-share-test-{0}'.format(report_id)
+
+
+class QueuedReport(object):
+    
+    task = RecordingTask()
+    
+    def __init__(self, persistent_id, user_id):
+        self.persistent_id = persistent_id
+        self.user_id = user_id
+
+
+class FairShareQueueTest(TestCase):
+    
+    def setUp(self):
+        self.client = get_redis()
+        self.clear()
+        self.config = dict(db.config)
+        db.config['FAIR_SHARE_SLOTS'] = 1
+        QueuedReport.task = RecordingTask()
+    
+    def tearDown(self):
+        self.clear()
+        db.config.clear()
+        db.config.update(self.config)
+    
+    def clear(self):
+        self.client.delete(
+            WAITING.format(1), WAITING.format(2), REPORTS, USERS, RUNNING, RUNNING_REPORTS
+        )
+    
+    def test_submit_dispatch_finish(self):
+        reports = [QueuedReport(1, 1), QueuedReport(2, 1), QueuedReport(3, 1)]
+        other = QueuedReport(4, 2)
+        for report in reports + [other]:
+            submit_report(report)
+        assert_equals(QueuedReport.task.sent, [1])
+        assert_equals([r['id'] for r in queue_positions()['waiting']], [4, 2, 3])
+        
+        report_finished(reports[0])
+        assert_equals(QueuedReport.task.sent, [1, 2])
+        # the other user doesn't wait for all of the first user's reports
+        report_finished(reports[1])
+        assert_equals(QueuedReport.task.sent, [1, 2, 4])
+        report_finished(other)
+        assert_equals(QueuedReport.task.sent, [1, 2, 4, 3])
+        report_finished(reports[2])
+        assert_equals(self.client.hgetall(RUNNING), {})
+        assert_equals(self.client.hgetall(RUNNING_REPORTS), {})
+    
+    def test_slot_freed_after_crash(self):
+        submit_report(QueuedReport(1, 1))
+        submit_report(QueuedReport(2, 1))
+        assert_equals(QueuedReport.task.sent, [1])
+        
+        # killed at the hard time limit, so it never calls report_finished
+        queue.backend.mark_as_failure(task_id(1), Exception('time limit exceeded'))
+        submit_report(QueuedReport(3, 2))
+        assert_equals(QueuedReport.task.sent, [1, 2])
+    
+    def test_slot_freed_after_ttl(self):
+        submit_report(QueuedReport(1, 1))
+        db.config['FAIR_SHARE_RUNNING_TTL'] = -1
+        submit_report(QueuedReport(2, 1))
+        assert_equals(QueuedReport.task.sent, [1, 2])
+    
+    def test_waits_while_celery_is_down(self):
+        QueuedReport.task.down = True
+        submit_report(QueuedReport(1, 1))
+        assert_equals(QueuedReport.task.sent, [])
+        assert_equals([r['id'] for r in queue_positions()['waiting']], [1])
+        
+        # it keeps its place, and is only sent once
+        QueuedReport.task.down = False
+        submit_report(QueuedReport(2, 2))
+        assert_equals(QueuedReport.task.sent, [1])
+        assert_equals([r['id'] for r in queue_positions()['waiting']], [2])
@@ -0,0 +1,38 @@
+from nose.tools import assert_equals
+from tests.fixtures import DatabaseTest
+from wikimetrics.metrics import RandomMetric
+from wikimetrics.models import MetricReport, ReportNode
+from wikimetrics.task_routing import ShardRouter, report_projects
+
+
+class ShardRouterTest(DatabaseTest):
+    
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.router = ShardRouter(
+            shards=['s1'],
+            host_map={'enwiki': 's1', 'simplewiki': 's3', 'dewiki': 's5'},
+        )
+    
+    def route(self, *projects):
+        report = ReportNode(children=[
+            MetricReport(RandomMetric(), [1], project) for project in projects
+        ])
+        return self.router.route_for_task('queue_task', args=[report])
+    
+    def test_routes_to_the_host_queue(self):
+        assert_equals(self.route('enwiki'), {'queue': 'wikimetrics.s1'})
+    
+    def test_hosts_without_a_queue_use_the_default(self):
+        assert_equals(self.route('dewiki'), None)
+    
+    def test_more_than_one_host_uses_the_default(self):
+        assert_equals(self.route('enwiki', 'simplewiki'), None)
+    
+    def test_no_shards(self):
+        self.router.shards = []
+        assert_equals(self.route('enwiki'), None)
+    
+    def test_report_projects(self):
+        report = MetricReport(RandomMetric(), [1], 'enwiki')
+        assert_equals(report_projects(report), set(['enwiki']))
@@ -0,0 +1,54 @@
+from time import sleep
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true, assert_not_equals
+from wikimetrics.cache import MemoryCache, metric_cache_key
+from wikimetrics.metrics import NamespaceEdits, BytesAdded
+
+
+class MemoryCacheTest(TestCase):
+    
+    def test_get_and_set(self):
+        cache = MemoryCache(10, 60)
+        cache.set('key', {1: {'edits': 2}})
+        assert_equals(cache.get('key'), {1: {'edits': 2}})
+        assert_true(cache.get('missing') is None)
+    
+    def test_evicts_least_recently_used(self):
+        cache = MemoryCache(2, 60)
+        cache.set('first', 1)
+        cache.set('second', 2)
+        cache.get('first')
+        cache.set('third', 3)
+        assert_equals(cache.get('first'), 1)
+        assert_true(cache.get('second') is None)
+        assert_equals(cache.get('third'), 3)
+    
+    def test_expires(self):
+        cache = MemoryCache(10, 0.01)
+        cache.set('key', 1)
+        sleep(0.02)
+        assert_true(cache.get('key') is None)
+
+
+class MetricCacheKeyTest(TestCase):
+    
+    def test_same_computation_same_key(self):
+        metric = NamespaceEdits(namespaces=[0], start_date='2013-06-01')
+        other = NamespaceEdits(namespaces=[0], start_date='2013-06-01')
+        other.fake_csrf()
+        assert_equals(
+            metric_cache_key('enwiki', metric, [1, 2, 3]),
+            metric_cache_key('enwiki', other, [3, 2, 1]),
+        )
+    
+    def test_different_computation_different_key(self):
+        metric = NamespaceEdits(namespaces=[0], start_date='2013-06-01')
+        key = metric_cache_key('enwiki', metric, [1, 2, 3])
+        assert_not_equals(key, metric_cache_key('dewiki', metric, [1, 2, 3]))
+        assert_not_equals(key, metric_cache_key('enwiki', metric, [1, 2]))
+        
+        other_dates = NamespaceEdits(namespaces=[0], start_date='2013-07-01')
+        assert_not_equals(key, metric_cache_key('enwiki', other_dates, [1, 2, 3]))
+        
+        other_metric = BytesAdded(namespaces=[0], start_date='2013-06-01')
+        assert_not_equals(key, metric_cache_key('enwiki', other_metric, [1, 2, 3]))
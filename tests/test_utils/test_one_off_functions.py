@@ -1,9 +1,10 @@
+import json
 import datetime
 import decimal
-from nose.tools import assert_true, assert_equals
+from nose.tools import assert_true, assert_equals, raises
 from unittest import TestCase
 from wikimetrics.utils import (
-    stringify, mediawiki_date,
+    stringify, mediawiki_date, parallel_map, chunk, stream_json,
 )
 from wikimetrics.metrics import NamespaceEdits
 
@@ -22,7 +23,29 @@ class UtilsTest(TestCase):
         string = stringify(normal='hello world')
         assert_true(string.find('"normal"') >= 0)
     
+    def test_stream_json(self):
+        data = {'when': datetime.date(2013, 06, 01), 'values': range(5)}
+        string = ''.join(stream_json(data))
+        assert_true(string.find(' ') < 0)
+        assert_equals(json.loads(string), json.loads(stringify(data)))
+    
     def test_mediawiki_date(self):
         edits = NamespaceEdits(start_date='2013-06-01')
         mw_date = mediawiki_date(edits.start_date)
         assert_equals(mw_date, '20130601000000')
+    
+    def test_parallel_map(self):
+        results = parallel_map(lambda x: x * 2, [1, 2, 3, 4], 3)
+        assert_equals(results, [2, 4, 6, 8])
+    
+    def test_parallel_map_one_thread(self):
+        results = parallel_map(lambda x: x * 2, [1, 2], 1)
+        assert_equals(results, [2, 4])
+    
+    @raises(ZeroDivisionError)
+    def test_parallel_map_raises(self):
+        parallel_map(lambda x: 1 / x, [1, 0, 2], 3)
+    
+    def test_chunk(self):
+        chunks = list(chunk([1, 2, 3, 4, 5], 2))
+        assert_equals(chunks, [[1, 2], [3, 4], [5]])
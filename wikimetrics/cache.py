@@ -0,0 +1,136 @@
+"""
+This module caches metric results, so that running the same report again does not
+hit the mediawiki databases again.  Results are keyed by project, metric class,
+metric parameters, and the set of user ids (see metric_cache_key).
+It has two backends, configured with METRIC_CACHE_BACKEND in the db config:
+
+    memory  : an LRU cache in each process, bounded by METRIC_CACHE_SIZE entries
+    redis   : shared by all processes, in METRIC_CACHE_REDIS_URL or by default
+              the redis that Celery uses.  Size is bounded by redis' own maxmemory
+              policy, so configure one if you use this.
+
+Either way, entries expire after METRIC_CACHE_TTL seconds.
+"""
+import cPickle
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from time import time
+from wikimetrics.configurables import db, queue
+from wikimetrics.utils import stringify
+
+
+__all__ = [
+    'MemoryCache',
+    'RedisCache',
+    'get_metric_cache',
+    'metric_cache_key',
+]
+
+
+class MemoryCache(object):
+    """
+    A thread-safe least recently used cache with expiring entries.
+    """
+    
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+    
+    def get(self, key):
+        """
+        Returns the value cached under key, or None if it's missing or expired
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            
+            expires, value = entry
+            if expires < time():
+                return None
+            
+            # put it back at the most recently used end
+            self.entries[key] = entry
+            return value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time() + self.ttl, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class RedisCache(object):
+    """
+    A cache shared by all processes, which pickles values into redis.
+    """
+    
+    def __init__(self, url, ttl):
+        # only needed if this backend is configured
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+    
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return cPickle.loads(value)
+    
+    def set(self, key, value):
+        pipeline = self.client.pipeline()
+        pipeline.set(key, cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+
+metric_cache = None
+metric_cache_lock = Lock()
+
+
+def get_metric_cache():
+    """
+    On the first run, creates the cache configured by METRIC_CACHE_BACKEND.
+    
+    Returns:
+        the configured cache, or None if caching is turned off
+    """
+    global metric_cache
+    with metric_cache_lock:
+        if metric_cache is None:
+            backend = db.config.get('METRIC_CACHE_BACKEND')
+            ttl = db.config.get('METRIC_CACHE_TTL', 3600)
+            if backend == 'memory':
+                metric_cache = MemoryCache(db.config.get('METRIC_CACHE_SIZE', 100), ttl)
+            elif backend == 'redis':
+                url = db.config.get('METRIC_CACHE_REDIS_URL')
+                if not url:
+                    url = queue.conf['CELERY_RESULT_BACKEND']
+                metric_cache = RedisCache(url, ttl)
+        
+        return metric_cache
+
+
+def metric_cache_key(project, metric, user_ids):
+    """
+    Parameters:
+        project     : the mediawiki project the metric runs on
+        metric      : the metric instance, whose class and parameters go in the key
+        user_ids    : the mediawiki user ids the metric runs on, in any order
+    
+    Returns:
+        a string that identifies this computation
+    """
+    # the csrf token changes every time, but doesn't change the results
+    parameters = {k: v for k, v in metric.data.items() if k != 'csrf_token'}
+    users = ','.join(sorted(set(str(user_id) for user_id in user_ids)))
+    return 'wikimetrics:metric:{0}:{1}:{2}:{3}'.format(
+        project,
+        type(metric).__name__,
+        sha1(stringify(parameters)).hexdigest(),
+        sha1(users).hexdigest(),
+    )
@@ -3,7 +3,14 @@ import csv
 from flask import url_for, flash, render_template, redirect, request
 from flask.ext.login import current_user
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
-from ..utils import json_response, json_error, json_redirect, deduplicate_by_key
+from ..utils import (
+    json_response,
+    json_error,
+    json_redirect,
+    deduplicate,
+    deduplicate_by_key,
+    chunk,
+)
 from ..configurables import app, db
 from ..models import (
     Cohort, CohortUser, CohortUserRole,
@@ -11,6 +18,12 @@ from ..models import (
 )
 
 
+# how many user names or ids go in each IN clause, see normalize_users
+VALIDATE_BATCH_SIZE = 1000
+# how many rows go in each bulk insert, see create_cohort
+COHORT_INSERT_BATCH_SIZE = 5000
+
+
 @app.route('/cohorts/')
 def cohorts_index():
     """
@@ -221,24 +234,30 @@ def create_cohort(name, description, project, valid_users):
     )
     db_session.add(cohort_owner)
     
-    wikiusers = []
-    for valid_user in valid_users:
-        wikiuser = WikiUser(
-            mediawiki_userid=valid_user['user_id'],
-            mediawiki_username=valid_user['username'],
-        )
-        wikiusers.append(wikiuser)
-    db_session.add_all(wikiusers)
-    db_session.commit()
+    # wiki_user and cohort_wiki_user rows go in with bulk inserts, the ORM is
+    # too slow for big cohorts.  validating_cohort marks the new wiki_user rows,
+    # so their ids can be read back to build the cohort_wiki_user rows
+    wikiuser_table = WikiUser.__table__
+    for batch in chunk(valid_users, COHORT_INSERT_BATCH_SIZE):
+        db_session.execute(wikiuser_table.insert(), [
+            {
+                'mediawiki_userid'  : valid_user['user_id'],
+                'mediawiki_username': valid_user['username'],
+                'project'           : valid_user.get('project'),
+                'validating_cohort' : cohort.id,
+            }
+            for valid_user in batch
+        ])
     
-    cohort_wikiusers = []
-    for wikiuser in wikiusers:
-        cohort_wikiuser = CohortWikiUser(
-            cohort_id=cohort.id,
-            wiki_user_id=wikiuser.id,
-        )
-        cohort_wikiusers.append(cohort_wikiuser)
-    db_session.add_all(cohort_wikiusers)
+    wikiuser_ids = db_session.query(WikiUser.id)\
+        .filter(WikiUser.validating_cohort == cohort.id)\
+        .all()
+    cohort_wikiuser_table = CohortWikiUser.__table__
+    for batch in chunk(wikiuser_ids, COHORT_INSERT_BATCH_SIZE):
+        db_session.execute(cohort_wikiuser_table.insert(), [
+            {'cohort_id': cohort.id, 'wiki_user_id': wikiuser_id}
+            for (wikiuser_id,) in batch
+        ])
     db_session.commit()
     
     db_session.close()
@@ -376,19 +395,102 @@ def link_to_user_page(username, project):
     return 'https://{0}.wikipedia.org/wiki/User:{1}'.format(project, username)
 
 
+def utf8(value):
+    """
+    Encodes unicode values as utf8 strings, like the ones parse_username returns
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+
+def normalize_users(user_strs, project):
+    """
+    Looks up many users at once, the same way normalize_user does for one:
+    by user_name first, and then by user_id for the ones that look like ids.
+    
+    Parameters:
+        user_strs   : user names or user ids, as returned by parse_username
+        project     : the normalized mediawiki project to look the users up in
+    
+    Returns:
+        dictionary from each user_str found to a tuple of (user_id, user_name)
+    """
+    user_strs = deduplicate(user_strs)
+    by_name = {}
+    by_id = {}
+    db_session = db.get_mw_session(project)
+    try:
+        for batch in chunk(user_strs, VALIDATE_BATCH_SIZE):
+            users = db_session.query(MediawikiUser.user_id, MediawikiUser.user_name)\
+                .filter(MediawikiUser.user_name.in_(batch))\
+                .all()
+            for user_id, user_name in users:
+                key = utf8(user_name)
+                # like normalize_user, a name matching more than one user is invalid
+                by_name[key] = None if key in by_name else (user_id, user_name)
+        
+        ids = [s for s in user_strs if s not in by_name and s.isdigit()]
+        for batch in chunk(ids, VALIDATE_BATCH_SIZE):
+            users = db_session.query(MediawikiUser.user_id, MediawikiUser.user_name)\
+                .filter(MediawikiUser.user_id.in_(batch))\
+                .all()
+            for user_id, user_name in users:
+                by_id[str(user_id)] = (user_id, user_name)
+    finally:
+        db_session.close()
+    
+    normalized = {}
+    for user_str in user_strs:
+        if user_str in by_name:
+            if by_name[user_str] is not None:
+                normalized[user_str] = by_name[user_str]
+        elif user_str in by_id:
+            normalized[user_str] = by_id[user_str]
+    return normalized
+
+
 def validate_records(records):
+    """
+    Splits parsed cohort records into valid and invalid ones.  Records are
+    grouped by project, and each project's users are looked up with a few
+    batched queries (see normalize_users) instead of one or two per record.
+    
+    Parameters:
+        records : list of dictionaries, as returned by parse_records
+    
+    Returns:
+        a tuple of (valid, invalid) records, with the normalized project,
+        user_id and username set on the valid ones and reason_invalid on the rest
+    """
     valid = []
     invalid = []
+    
+    user_strs_by_project = {}
     for record in records:
         normalized_project = normalize_project(record['project'])
         link_project = normalized_project or record['project'] or 'invalid'
         record['user_str'] = record['username']
         record['link'] = link_to_user_page(record['username'], link_project)
+        record['normalized_project'] = normalized_project
+        if normalized_project is not None:
+            user_strs_by_project.setdefault(normalized_project, [])\
+                .append(record['raw_username'])
+    
+    normalized_by_project = {
+        project: normalize_users(user_strs, project)
+        for project, user_strs in user_strs_by_project.iteritems()
+    }
+    
+    for record in records:
+        normalized_project = record.pop('normalized_project')
         if normalized_project is None:
             record['reason_invalid'] = 'invalid project: %s' % record['project']
             invalid.append(record)
             continue
-        normalized_user = normalize_user(record['raw_username'], normalized_project)
+        normalized_user = normalized_by_project[normalized_project].get(
+            record['raw_username']
+        )
         # make a link to the potential user page even if user doesn't exist
         # this gives a chance to see any misspelling etc.
         if normalized_user is None:
@@ -2,9 +2,20 @@ from sqlalchemy.orm.exc import NoResultFound
 from flask import render_template, request, url_for, Response
 from flask.ext.login import current_user
 from ..configurables import app, db
-from ..models import Report, RunReport, PersistentReport
-from ..models.report_nodes import Aggregation
-from ..utils import json_response, json_error, json_redirect, thirty_days_ago
+from ..models import Report, RunReport, PersistentReport, UserRole
+from ..models.report_nodes import Aggregation, MetricResults
+from ..models.report_nodes.metric_results import flatten, column_label
+from ..report_status import wait_for_report_status
+from ..fair_share import submit_report, queue_positions
+from ..result_store import load_result
+from ..utils import (
+    json_response,
+    json_stream_response,
+    json_error,
+    json_redirect,
+    thirty_days_ago,
+    BetterEncoder,
+)
 import json
 from StringIO import StringIO
 from csv import DictWriter
@@ -30,7 +41,8 @@ def reports_request():
     else:
         desired_responses = json.loads(request.form['responses'])
         jr = RunReport(desired_responses, user_id=current_user.id)
-        jr.task.delay(jr)
+        # waits its turn behind other users' reports, see wikimetrics.fair_share
+        submit_report(jr)
         
         return json_redirect(url_for('reports_index'))
 
@@ -44,12 +56,12 @@ def reports_list():
         .filter(PersistentReport.show_in_ui)\
         .all()
     # TODO: update status for all reports at all times (not just show_in_ui ones)
-    # update status for each report
-    for report in reports:
-        report.update_status()
+    # update status for all the reports in one go
+    PersistentReport.update_statuses(reports, db_session)
     
     # TODO fix json_response to deal with PersistentReport objects
     reports_json = json_response(reports=[report._asdict() for report in reports])
+    db_session.commit()
     db_session.close()
     return reports_json
 
@@ -87,72 +99,146 @@ def get_celery_task_result(celery_task, db_report):
         return celery_task.get()[db_report.result_key]
 
 
+def get_report_result(celery_task, db_report):
+    """
+    Gets the result of a report from the result store, where each report node
+    saves its own result, or from celery for reports that ran before the store.
+    
+    Returns
+        the result of the report, or None if it is not ready
+    """
+    task_result = load_result(db_report.result_key)
+    if task_result is None and celery_task.ready():
+        task_result = get_celery_task_result(celery_task, db_report)
+    return task_result
+
+
+def legacy_result(task_result):
+    """
+    Report nodes pass individual results around as MetricResults, this turns
+    them back into the {user_id: {column: value}} dictionaries the API returns.
+    """
+    if isinstance(task_result, MetricResults):
+        return task_result.to_dict()
+    if not task_result or Aggregation.IND not in task_result:
+        return task_result
+    
+    legacy = dict(task_result)
+    legacy[Aggregation.IND] = [
+        MetricResults.from_dict(individual_results).to_dict()
+        for individual_results in task_result[Aggregation.IND]
+    ]
+    return legacy
+
+
 @app.route('/reports/status/<result_key>')
 def report_status(result_key):
     celery_task, pj = get_celery_task(result_key)
     return json_response(status=celery_task.status)
 
 
+@app.route('/reports/queue/')
+def reports_queue():
+    """
+    Lists the reports waiting to run and their position in line.  Admins see
+    everyone's reports, other users only their own.
+    """
+    user_id = current_user.id
+    if current_user.role == UserRole.ADMIN:
+        user_id = None
+    positions = queue_positions(user_id)
+    if positions is None:
+        return json_error('reports are not queued, they all run right away')
+    return json_response(**positions)
+
+
+@app.route('/reports/status/updates')
+def report_status_updates():
+    """
+    Long poll for changes in the status of the current user's reports.
+    Pass the version from the last response, see wikimetrics.report_status
+    """
+    # an empty version is a client that hasn't seen one yet
+    version = request.args.get('version') or None
+    return json_response(**wait_for_report_status(current_user.id, version))
+
+
 @app.route('/reports/result/<result_key>.csv')
 def report_result_csv(result_key):
     celery_task, pj = get_celery_task(result_key)
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
     
-    if celery_task.ready():
-        task_result = get_celery_task_result(celery_task, pj)
-        
-        csv_io = StringIO()
-        if task_result:
-            columns = []
-            
-            if Aggregation.IND in task_result:
-                columns = task_result[Aggregation.IND][0].values()[0].keys()
-            elif Aggregation.SUM in task_result:
-                columns = task_result[Aggregation.SUM].keys()
-            elif Aggregation.AVG in task_result:
-                columns = task_result[Aggregation.AVG].keys()
-            elif Aggregation.STD in task_result:
-                columns = task_result[Aggregation.STD].keys()
-            
-            # if task_result is not empty find header in first row
-            fieldnames = ['user_id'] + columns
-        else:
-            fieldnames = ['user_id']
-        writer = DictWriter(csv_io, fieldnames)
-        
-        # collect rows to output in CSV
-        task_rows = []
-        
-        # Individual Results
-        if Aggregation.IND in task_result:
+    task_result = get_report_result(celery_task, pj)
+    if task_result is None:
+        return json_response(status=celery_task.status)
+    
+    return Response(stream_csv(task_result), mimetype='text/csv')
+
+
+def csv_row(values):
+    """
+    Returns:
+        values with a column for each bucket of time series values, like
+        'edits 2013-06-01', since a csv can't nest them
+    """
+    return dict((column_label(n), v) for n, v in flatten(values).items())
+
+
+def csv_rows(task_result):
+    """
+    Yields the rows of a report result as dictionaries, the individual results
+    first and then the aggregates, with the user id or aggregate in user_id
+    """
+    # Individual Results
+    if Aggregation.IND in task_result:
+        for user_id, row in task_result[Aggregation.IND][0].iteritems():
             # fold user_id into dict so we can use DictWriter to escape things
-            for user_id, row in task_result[Aggregation.IND][0].iteritems():
-                task_row = row.copy()
-                task_row['user_id'] = user_id
-                task_rows.append(task_row)
-        
-        # Aggregate Results
-        if Aggregation.SUM in task_result:
-            task_row = task_result[Aggregation.SUM].copy()
-            task_row['user_id'] = Aggregation.SUM
-            task_rows.append(task_row)
-        
-        if Aggregation.AVG in task_result:
-            task_row = task_result[Aggregation.AVG].copy()
-            task_row['user_id'] = Aggregation.AVG
-            task_rows.append(task_row)
-        
-        if Aggregation.STD in task_result:
-            task_row = task_result[Aggregation.STD].copy()
-            task_row['user_id'] = Aggregation.STD
-            task_rows.append(task_row)
-        
-        writer.writeheader()
-        writer.writerows(task_rows)
-        return Response(csv_io.getvalue(), mimetype='text/csv')
+            task_row = csv_row(row)
+            task_row['user_id'] = user_id
+            yield task_row
+    
+    # Aggregate Results
+    for aggregate in Aggregation.ALL:
+        if aggregate in task_result:
+            task_row = csv_row(task_result[aggregate])
+            task_row['user_id'] = aggregate
+            yield task_row
+
+
+def stream_csv(task_result):
+    """
+    Yields a report result as CSV, one line at a time, so that big results
+    are streamed to the client instead of being written out in memory first.
+    
+    Parameters:
+        task_result : the result of a report, as returned by get_celery_task_result
+    """
+    task_result = task_result or {}
+    columns = []
+    if Aggregation.IND in task_result:
+        individual_results = task_result[Aggregation.IND][0]
+        if isinstance(individual_results, MetricResults):
+            columns = map(column_label, individual_results.kinds.keys())
+        else:
+            columns = csv_row(individual_results.values()[0]).keys()
     else:
-        return json_response(status=celery_task.status)
+        for aggregate in Aggregation.ALL:
+            if aggregate in task_result:
+                columns = csv_row(task_result[aggregate]).keys()
+                break
+    
+    # DictWriter writes into this buffer, which is emptied after every line
+    csv_io = StringIO()
+    writer = DictWriter(csv_io, ['user_id'] + columns)
+    writer.writeheader()
+    yield csv_io.getvalue()
+    
+    for task_row in csv_rows(task_result):
+        csv_io.seek(0)
+        csv_io.truncate()
+        writer.writerow(task_row)
+        yield csv_io.getvalue()
 
 
 @app.route('/reports/result/<result_key>.json')
@@ -161,15 +247,44 @@ def report_result_json(result_key):
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
     
-    if celery_task.ready():
-        task_result = get_celery_task_result(celery_task, pj)
-        
-        return json_response(
-            result=task_result,
-            parameters=json.loads(pj.parameters),
-        )
-    else:
+    task_result = get_report_result(celery_task, pj)
+    if task_result is None:
+        return json_response(status=celery_task.status)
+    
+    return json_stream_response(
+        result=legacy_result(task_result),
+        parameters=json.loads(pj.parameters),
+    )
+
+
+@app.route('/reports/result/<result_key>.ndjson')
+def report_result_ndjson(result_key):
+    """
+    Streams the individual results of a report as newline delimited json,
+    one object per user, with the user's id folded in as user_id.
+    """
+    celery_task, pj = get_celery_task(result_key)
+    if not celery_task:
+        return json_error('no task exists with id: {0}'.format(result_key))
+    
+    task_result = get_report_result(celery_task, pj)
+    if task_result is None:
         return json_response(status=celery_task.status)
+    if not task_result or Aggregation.IND not in task_result:
+        return json_error('report {0} has no individual results'.format(result_key))
+    
+    return Response(stream_ndjson(task_result), mimetype='application/x-ndjson')
+
+
+def stream_ndjson(task_result):
+    """
+    Yields the individual results in task_result as lines of compact json
+    """
+    encoder = BetterEncoder(separators=(',', ':'))
+    for user_id, row in task_result[Aggregation.IND][0].iteritems():
+        task_row = row.copy()
+        task_row['user_id'] = user_id
+        yield encoder.encode(task_row) + '\n'
 
 
 #@app.route('/reports/kill/<result_key>')
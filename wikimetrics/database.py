@@ -4,20 +4,22 @@ It exposes methods and variables according to SQLAlchemy best practices (hopeful
 It has the ability to connect to multiple mediawiki databases.
 It uses Flask's handy config module to configure itself.
 """
-import json
-import os
-from os.path import exists
-from urllib2 import urlopen
+from threading import BoundedSemaphore, Lock, RLock
+from time import time
 #from multiprocessing import Pool
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import exc
 from sqlalchemy import event
-from sqlalchemy.pool import Pool
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from wikimetrics.project_catalog import ProjectCatalog, DBLIST_URL_TEMPLATE
 
 __all__ = [
     'Database',
+    'get_connection_stats',
 ]
 
 
@@ -32,27 +34,6 @@ class SerializableBase(object):
         return {c.name : getattr(self, c.name) for c in self.__table__.columns}
 
 
-def get_host_projects(host_id):
-    cluster_url_fmt = 'https://noc.wikimedia.org/conf/s{0}.dblist'
-    url = cluster_url_fmt.format(host_id)
-    projects = urlopen(url).read().splitlines()
-    return (host_id, projects)
-
-
-def get_host_projects_map():
-    # TODO: these numbers are hardcoded, is that ok?
-    num_hosts = 7
-    host_projects = map(get_host_projects, range(1, num_hosts + 1))
-    project_host_map = {}
-    host_fmt = 's{0}'
-    for host_id, projects in host_projects:
-        host = host_fmt.format(host_id)
-        for project in projects:
-            project_host_map[project] = host
-    
-    return project_host_map
-
-
 class Database(object):
     """
     Basically a collection of all database related objects and methods.
@@ -76,34 +57,99 @@ class Database(object):
         self.wikimetrics_engine = None
         self.wikimetrics_sessionmaker = None
         
+        # keyed by host (s1..s7) if MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE is set,
+        # and by project otherwise, see get_mw_engine_key
         self.mediawiki_engines = {}
+        self.mediawiki_engines_last_used = {}
+        self.mediawiki_engines_lock = RLock()
         self.mediawiki_sessionmakers = {}
-        self.project_host_map = self.get_project_host_map(usecache=True)
+        self.mediawiki_host_slots = {}
+        self.mediawiki_host_slots_lock = Lock()
+        # loaded on first use, see project_host_map
+        self.project_catalog = None
+        self.project_catalog_lock = Lock()
     
     def get_session(self):
         """
-        On the first run, instantiates the Wikimetrics session maker
-        and create wikimetrics tables if they don't exist.
+        On the first run, instantiates the Wikimetrics session maker.
         On subsequent runs, it does not re-define the session maker or engine.
+        Tables are not checked or created here, that's done once by
+        `wikimetrics --mode migrate` (see migrate), unless SCHEMA_AUTO_CREATE is set.
         
         Returns:
             new sqlalchemy session open to the wikimetrics database
         """
+        if not self.wikimetrics_sessionmaker:
+            engine = self.get_wikimetrics_engine()
+            if self.config.get('SCHEMA_AUTO_CREATE'):
+                self.create_schema()
+            self.wikimetrics_sessionmaker = sessionmaker(engine)
+        
+        return self.wikimetrics_sessionmaker()
+    
+    def get_wikimetrics_engine(self):
         if not self.wikimetrics_engine:
+            url = self.config['WIKIMETRICS_ENGINE_URL']
+            pool_options = {}
+            if not make_url(url).drivername.startswith('sqlite'):
+                pool_options['pool_recycle'] = self.config.get(
+                    'WIKIMETRICS_POOL_RECYCLE', 3600
+                )
             self.wikimetrics_engine = create_engine(
-                self.config['WIKIMETRICS_ENGINE_URL'],
+                url,
                 echo=self.config['SQL_ECHO'],
+                **pool_options
             )
-            # This import is necessary here so that
-            # WikimetricsBase knows about all its children.
-            import wikimetrics.models
-            self.WikimetricsBase.metadata.create_all(
-                self.wikimetrics_engine,
-                checkfirst=True
-            )
-            self.wikimetrics_sessionmaker = sessionmaker(self.wikimetrics_engine)
+            watch_liveness(self.wikimetrics_engine, self.get_ping_idle_seconds())
         
-        return self.wikimetrics_sessionmaker()
+        return self.wikimetrics_engine
+    
+    def create_schema(self):
+        """
+        Creates the wikimetrics tables that don't exist yet
+        """
+        # This import is necessary here so that
+        # WikimetricsBase knows about all its children.
+        import wikimetrics.models
+        self.WikimetricsBase.metadata.create_all(
+            self.get_wikimetrics_engine(),
+            checkfirst=True
+        )
+    
+    def migrate(self):
+        """
+        Brings the wikimetrics database up to date with the models: creates the
+        missing tables, and adds the missing columns to existing tables.
+        Run this once per deployment with `wikimetrics --mode migrate`.
+        
+        Returns:
+            list of the DDL statements that were run to add columns
+        """
+        self.create_schema()
+        
+        engine = self.get_wikimetrics_engine()
+        inspector = inspect(engine)
+        statements = []
+        for table in self.WikimetricsBase.metadata.sorted_tables:
+            existing = set(c['name'] for c in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                statements.append('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                    table.name,
+                    CreateColumn(column).compile(dialect=engine.dialect),
+                ))
+        
+        for statement in statements:
+            engine.execute(statement)
+        return statements
+    
+    def get_ping_idle_seconds(self):
+        """
+        Connections unused for longer than this are pinged on checkout,
+        see watch_liveness
+        """
+        return self.config.get('CONNECTION_PING_IDLE_SECONDS', 30)
     
     def get_mw_session(self, project):
         """
@@ -115,30 +161,65 @@ class Database(object):
         Returns:
             new sqlalchemy session connected to the appropriate database.  This method
             caches sqlalchemy session makers and creates sessions from those.
+            When engines are shared by host, the session selects the project's
+            database on the connection it gets.
         """
-        if project in self.mediawiki_sessionmakers:
-            return self.mediawiki_sessionmakers[project]()
-        else:
+        with self.mediawiki_engines_lock:
+            self.evict_idle_mw_engines()
+            self.mediawiki_engines_last_used[self.get_mw_engine_key(project)] = time()
+            if project in self.mediawiki_sessionmakers:
+                return self.mediawiki_sessionmakers[project]()
+            
             import wikimetrics.models.mediawiki
             engine = self.get_mw_engine(project)
-            if self.config['DEBUG']:
-                self.MediawikiBase.metadata.create_all(
-                    engine,
-                    checkfirst=True
-                )
-
+            database = None
+            if self.config.get('MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE'):
+                database = self.get_mw_database_name(project)
+            
             # Assuming that we're not using the real mediawiki databases in debug mode,
             # we have to create the tables
-            #if self.config['DEBUG']:
-                #self.MediawikiBase.metadata.create_all(engine, checkfirst=True)
+            if self.config['DEBUG']:
+                connection = engine.connect()
+                try:
+                    if database:
+                        use_database(connection, database)
+                    self.MediawikiBase.metadata.create_all(
+                        connection,
+                        checkfirst=True
+                    )
+                finally:
+                    connection.close()
             
             project_sessionmaker = sessionmaker(engine)
+            if database:
+                event.listen(
+                    project_sessionmaker,
+                    'after_begin',
+                    database_selector(database),
+                )
             self.mediawiki_sessionmakers[project] = project_sessionmaker
             return project_sessionmaker()
     
+    def get_mw_engine_key(self, project):
+        """
+        Returns:
+            the host (s1..s7) that serves project if engines are shared by
+            host (MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE is set), otherwise project
+        """
+        if self.config.get('MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE'):
+            return self.project_host_map.get(project, project)
+        return project
+    
+    def get_mw_database_name(self, project):
+        template = self.config.get('MEDIAWIKI_DATABASE_NAME_TEMPLATE') or '{0}'
+        return template.format(project)
+    
     def get_mw_engine(self, project):
         """
         Based on the mediawiki project passed in, create a sqlalchemy engine.
+        If MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE is set, all the projects on the
+        same host share one engine, so the number of connection pools is bounded
+        by the number of hosts instead of the number of projects.
         
         Parameters:
             project : string name of the mediawiki project (for example: enwiki, arwiki)
@@ -146,56 +227,218 @@ class Database(object):
         Returns:
             new or cached sqlalchemy engine connected to the appropriate database.
         """
-        if project in self.mediawiki_engines:
-            return self.mediawiki_engines[project]
-        else:
+        key = self.get_mw_engine_key(project)
+        with self.mediawiki_engines_lock:
+            if key in self.mediawiki_engines:
+                return self.mediawiki_engines[key]
+            
+            host_url_template = self.config.get('MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE')
+            if host_url_template:
+                url = host_url_template.format(key)
+            else:
+                url = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE'].format(project)
             engine = create_engine(
-                self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE'].format(project),
+                url,
                 echo=self.config['SQL_ECHO'],
+                **self.get_mw_pool_options(key, url)
             )
-            self.mediawiki_engines[project] = engine
+            watch_liveness(engine, self.get_ping_idle_seconds())
+            self.mediawiki_engines[key] = engine
+            self.mediawiki_engines_last_used[key] = time()
             return engine
     
+    def get_mw_pool_options(self, key, url):
+        """
+        Parameters:
+            key : the host or project the engine is for, see get_mw_engine_key
+            url : the engine's url
+        
+        Returns:
+            the pool_size, max_overflow and pool_recycle to create the engine with,
+            from MEDIAWIKI_POOL_SIZE, MEDIAWIKI_POOL_MAX_OVERFLOW, MEDIAWIKI_POOL_RECYCLE,
+            overridden for key by MEDIAWIKI_POOL_OPTIONS
+        """
+        if make_url(url).drivername.startswith('sqlite'):
+            # sqlite engines pick their own pool class, which takes none of these
+            return {}
+        
+        options = {
+            'pool_size'     : self.config.get('MEDIAWIKI_POOL_SIZE', 5),
+            'max_overflow'  : self.config.get('MEDIAWIKI_POOL_MAX_OVERFLOW', 10),
+            'pool_recycle'  : self.config.get('MEDIAWIKI_POOL_RECYCLE', 3600),
+        }
+        overrides = self.config.get('MEDIAWIKI_POOL_OPTIONS') or {}
+        options.update(overrides.get(key) or {})
+        return options
+    
+    def evict_idle_mw_engines(self):
+        """
+        Disposes of the engines that haven't been used for more than
+        MEDIAWIKI_ENGINE_IDLE_TIMEOUT seconds, closing their pooled connections.
+        Connections still checked out are closed when they are returned.
+        """
+        timeout = self.config.get('MEDIAWIKI_ENGINE_IDLE_TIMEOUT')
+        if not timeout:
+            return
+        
+        now = time()
+        with self.mediawiki_engines_lock:
+            for key, last_used in self.mediawiki_engines_last_used.items():
+                if now - last_used <= timeout:
+                    continue
+                
+                del self.mediawiki_engines_last_used[key]
+                engine = self.mediawiki_engines.pop(key, None)
+                if engine is None:
+                    continue
+                for project in self.mediawiki_sessionmakers.keys():
+                    if self.get_mw_engine_key(project) == key:
+                        del self.mediawiki_sessionmakers[project]
+                engine.dispose()
+    
+    def get_mw_host_slot(self, project):
+        """
+        Report children can run in parallel threads, so this limits how many of
+        them can be talking to the same mediawiki database host at once.
+        Projects on the same host (s1..s7) share their limit.
+        
+        Parameters:
+            project : string name of the mediawiki project (for example: enwiki, arwiki)
+        
+        Returns:
+            a semaphore to hold while querying the host that serves this project,
+            limited to MEDIAWIKI_HOST_CONCURRENCY concurrent holders
+        """
+        host = self.project_host_map.get(project, project)
+        with self.mediawiki_host_slots_lock:
+            if host not in self.mediawiki_host_slots:
+                self.mediawiki_host_slots[host] = BoundedSemaphore(
+                    self.config.get('MEDIAWIKI_HOST_CONCURRENCY', 4)
+                )
+            return self.mediawiki_host_slots[host]
+    
+    @property
+    def project_host_map(self):
+        """
+        The mediawiki projects and the hosts (s1..s7) that serve them,
+        as a read-only ProjectIndex.  See wikimetrics.project_catalog
+        """
+        return self.get_project_catalog().get_index()
+    
+    def get_project_catalog(self):
+        """
+        On the first run, creates the project catalog from the config:
+        PROJECT_DBLIST_URL_TEMPLATE, PROJECT_CATALOG_CACHE, and PROJECT_CATALOG_TTL
+        """
+        with self.project_catalog_lock:
+            if self.project_catalog is None:
+                self.project_catalog = ProjectCatalog(
+                    url_template=(
+                        self.config.get('PROJECT_DBLIST_URL_TEMPLATE')
+                        or DBLIST_URL_TEMPLATE
+                    ),
+                    cache_path=self.config.get(
+                        'PROJECT_CATALOG_CACHE', 'project_host_map.json'
+                    ),
+                    ttl=self.config.get('PROJECT_CATALOG_TTL', 24 * 60 * 60),
+                )
+            return self.project_catalog
+    
     def get_project_host_map(self, usecache=True):
         """
         Retrieves the list of mediawiki projects from noc.wikimedia.org.
         
         Parameters:
-            usecache    : defaults to True and uses a local cache if available
+            usecache    : defaults to True and uses the cached catalog if available
         """
-        cache_name = 'project_host_map.json'
-        if not exists(cache_name) or not usecache:
-            
-            project_host_map = get_host_projects_map()
-            if usecache and os.access(cache_name, os.W_OK):
-                try:
-                    json.dump(project_host_map, open(cache_name, 'w'))
-                except:
-                    pass  # no rights to write the file, it's OK
-        elif os.access(cache_name, os.R_OK):
-            project_host_map = json.load(open(cache_name))
-        else:
-            raise Exception('Project host map could not be fetched or read')
-        
-        return project_host_map
+        if not usecache:
+            return self.get_project_catalog().refresh()
+        return self.project_host_map
+
+
+def use_database(connection, database):
+    """
+    Switches connection to database, unless it's already using it
+    """
+    if connection.info.get('mediawiki_database') != database:
+        connection.execute('USE `{0}`'.format(database))
+        connection.info['mediawiki_database'] = database
+
+
+def database_selector(database):
+    """
+    Returns:
+        a Session after_begin listener that makes sessions on an engine shared
+        by many databases use database
+    """
+    def select_database(session, transaction, connection):
+        use_database(connection, database)
+    return select_database
+
+
+# how often connections are checked out, pinged, and found dead, see watch_liveness
+connection_stats = {
+    'checkouts' : 0,
+    'pings'     : 0,
+    'reconnects': 0,
+}
+connection_stats_lock = Lock()
 
 
-@event.listens_for(Pool, "checkout")
-def ping_connection(dbapi_connection, connection_record, connection_proxy):
+def count_connection_event(name):
+    with connection_stats_lock:
+        connection_stats[name] += 1
+
+
+def get_connection_stats():
+    """
+    Returns:
+        a copy of the connection counters of this process
     """
-    Pings the connection on checkout, making sure that it hasn't gone stale.
-    This prevents error (OperationalError) (2006, 'MySQL server has gone away').
-    This fix can be tested with tests/manual/connection_survives_server_restart.py
+    with connection_stats_lock:
+        return dict(connection_stats)
+
+
+def watch_liveness(engine, idle_seconds):
     """
-    cursor = dbapi_connection.cursor()
-    try:
-        cursor.execute("SELECT 1")
-    except:
-        # optional - dispose the whole pool
-        # instead of invalidating one at a time
-        # connection_proxy._pool.dispose()
-
-        # raise DisconnectionError - pool will try
-        # connecting again up to three times before raising.
-        raise exc.DisconnectionError()
-    cursor.close()
+    Makes sure connections checked out of engine's pool haven't gone stale, which
+    prevents error (OperationalError) (2006, 'MySQL server has gone away').
+    Only connections that sat unused in the pool for more than idle_seconds are
+    pinged, so the many short sessions opened one after the other don't each pay
+    for a round trip.  pool_recycle takes care of connections that get too old.
+    This can be tested with tests/manual/connection_survives_server_restart.py
+    
+    Parameters:
+        engine          : the engine whose pool to watch
+        idle_seconds    : ping connections unused for longer than this, 0 pings always
+    """
+    def mark_used(dbapi_connection, connection_record):
+        connection_record.info['last_used'] = time()
+    
+    def ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        count_connection_event('checkouts')
+        last_used = connection_record.info.get('last_used')
+        if last_used is not None and time() - last_used < idle_seconds:
+            return
+        
+        count_connection_event('pings')
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except:
+            count_connection_event('reconnects')
+            # raise DisconnectionError - pool will try
+            # connecting again up to three times before raising.
+            raise exc.DisconnectionError()
+        finally:
+            cursor.close()
+        connection_record.info['last_used'] = time()
+    
+    def mark_checked_in(dbapi_connection, connection_record):
+        # checked in connections can be invalidated ones, without a record
+        if dbapi_connection is not None and connection_record is not None:
+            mark_used(dbapi_connection, connection_record)
+    
+    event.listen(engine, 'connect', mark_used)
+    event.listen(engine, 'checkout', ping_if_idle)
+    event.listen(engine, 'checkin', mark_checked_in)
@@ -0,0 +1,298 @@
+"""
+This module keeps one user's reports from holding up everyone else's.  Reports
+are submitted with submit_report instead of going straight to queue_task.  They
+wait in redis, in a list for each user, and are sent to celery when there's
+room: no more than FAIR_SHARE_SLOTS reports run at once.  Whenever a slot is
+free, the next report comes from the user with the least reports running for
+their weight (FAIR_SHARE_WEIGHTS, 1 by default), taking turns between users
+on a tie.  So if one user submits twenty reports at once, the reports other
+users submit after that still start as soon as a slot frees up.
+
+queue_task calls report_finished when a report is done, which frees its slot.
+Reports that never get there, because their worker was killed or crashed, are
+found when reports are dispatched: the slot of a report is freed once its
+celery task is done, or once it has held the slot for FAIR_SHARE_RUNNING_TTL
+seconds without celery knowing the task is still running.
+The redis used is the same as for report statuses, see report_status.get_redis.
+Without redis, reports go straight to celery.
+"""
+import cPickle
+import json
+import socket
+from time import time
+from celery import states
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db, queue
+from wikimetrics.report_status import get_redis
+
+
+__all__ = [
+    'submit_report',
+    'report_finished',
+    'queue_positions',
+]
+
+
+task_logger = get_task_logger(__name__)
+
+# list of the ids of the reports each user has waiting, oldest first
+WAITING = 'wikimetrics:fair-share:waiting:{0}'
+# hash of report id to the pickled report, for the reports that are waiting
+REPORTS = 'wikimetrics:fair-share:reports'
+# list of the users with reports waiting, in the order they take turns
+USERS = 'wikimetrics:fair-share:users'
+# hash of user id to how many of their reports are running
+RUNNING = 'wikimetrics:fair-share:running'
+# hash of report id to the json [user id, celery task id, time it was sent],
+# for the reports that are running
+RUNNING_REPORTS = 'wikimetrics:fair-share:running-reports'
+# held while changing any of the above
+LOCK = 'wikimetrics:fair-share:lock'
+LOCK_TIMEOUT = 10
+
+
+def slots():
+    """
+    Returns:
+        how many reports can run at once, FAIR_SHARE_SLOTS or CELERYD_CONCURRENCY
+    """
+    return (
+        db.config.get('FAIR_SHARE_SLOTS')
+        or queue.conf.get('CELERYD_CONCURRENCY', 16)
+    )
+
+
+def running_ttl():
+    return db.config.get('FAIR_SHARE_RUNNING_TTL', 3600)
+
+
+def weight(user_id):
+    weights = db.config.get('FAIR_SHARE_WEIGHTS') or {}
+    weights = dict((str(user), w) for user, w in weights.items())
+    return weights.get(str(user_id), 1)
+
+
+def next_user(users, running):
+    """
+    Parameters:
+        users   : the users with reports waiting, in the order they take turns
+        running : dictionary of user id to how many of their reports are running
+    
+    Returns:
+        the user whose report should run next: the one with the least reports
+        running for their weight, or the first in turn of those
+    """
+    return min(users, key=lambda user: float(running.get(user, 0)) / weight(user))
+
+
+def dispatch_order(waiting, users, running):
+    """
+    Works out the order the waiting reports will run in, if nothing else is
+    submitted in the meantime.
+    
+    Parameters:
+        waiting : dictionary of user id to the ids of their waiting reports
+        users   : the users with reports waiting, in the order they take turns
+        running : dictionary of user id to how many of their reports are running
+    
+    Returns:
+        list of (user id, report id), in the order the reports will run
+    """
+    waiting = dict((user, list(ids)) for user, ids in waiting.items() if ids)
+    users = [user for user in users if user in waiting]
+    running = dict(running)
+    order = []
+    while users:
+        user = next_user(users, running)
+        order.append((user, waiting[user].pop(0)))
+        running[user] = running.get(user, 0) + 1
+        # back to the end of the line
+        users.remove(user)
+        if waiting[user]:
+            users.append(user)
+    return order
+
+
+def submit_report(report):
+    """
+    Puts report in line behind the other reports of its user, and sends
+    reports to celery if there are free slots.
+    
+    Parameters:
+        report  : the top level report to run, usually a RunReport
+    """
+    client = get_redis()
+    if client is None:
+        report.task.delay(report)
+        return
+    
+    import redis
+    waiting = False
+    try:
+        with client.lock(LOCK, timeout=LOCK_TIMEOUT):
+            user_id = str(report.user_id)
+            client.hset(
+                REPORTS,
+                report.persistent_id,
+                cPickle.dumps(report, cPickle.HIGHEST_PROTOCOL),
+            )
+            client.rpush(WAITING.format(user_id), report.persistent_id)
+            waiting = True
+            if user_id not in client.lrange(USERS, 0, -1):
+                client.rpush(USERS, user_id)
+            dispatch(client)
+    except (redis.RedisError, socket.error):
+        if waiting:
+            # dispatch may have sent it already, otherwise the next one will
+            task_logger.exception('could not dispatch reports after {0}'.format(
+                report.persistent_id
+            ))
+            return
+        task_logger.exception('could not queue report {0}, running it now'.format(
+            report.persistent_id
+        ))
+        report.task.delay(report)
+
+
+def report_finished(report):
+    """
+    Frees the slot a report submitted with submit_report ran in, and sends the
+    next reports in line to celery.  Reports that were not submitted that way
+    are ignored.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    
+    import redis
+    try:
+        # most reports in tests and scripts don't go through here, skip the lock
+        if client.hget(RUNNING_REPORTS, report.persistent_id) is None:
+            return
+        with client.lock(LOCK, timeout=LOCK_TIMEOUT):
+            running = client.hget(RUNNING_REPORTS, report.persistent_id)
+            if running is None:
+                return
+            user_id, task_id, sent = json.loads(running)
+            free_slot(client, report.persistent_id, user_id)
+            dispatch(client)
+    except (redis.RedisError, socket.error):
+        task_logger.exception('could not free the slot of report {0}'.format(
+            report.persistent_id
+        ))
+
+
+def free_slot(client, report_id, user_id):
+    """
+    Forgets that report_id is running.  Must be called holding LOCK.
+    """
+    client.hdel(RUNNING_REPORTS, report_id)
+    if client.hincrby(RUNNING, user_id, -1) <= 0:
+        client.hdel(RUNNING, user_id)
+
+
+def free_lost_slots(client):
+    """
+    Frees the slots of reports that will never call report_finished: their
+    task is done, or celery hasn't known it to be running for too long.  That
+    happens when a worker is killed at the hard time limit or crashes, or when
+    the task's result expired.  Must be called holding LOCK.
+    """
+    for report_id, running in client.hgetall(RUNNING_REPORTS).items():
+        user_id, task_id, sent = json.loads(running)
+        state = queue.AsyncResult(task_id).state
+        if state in states.READY_STATES or time() - sent > running_ttl():
+            task_logger.warning('freeing the slot of report {0}, task {1} is {2}'.format(
+                report_id, task_id, state
+            ))
+            free_slot(client, report_id, user_id)
+
+
+def dispatch(client):
+    """
+    Sends waiting reports to celery, in fair share order, until there are no
+    free slots or no reports waiting.  Must be called holding LOCK.
+    """
+    free_lost_slots(client)
+    running = dict(
+        (user, int(count)) for user, count in client.hgetall(RUNNING).items()
+    )
+    users = client.lrange(USERS, 0, -1)
+    free = slots() - sum(running.values())
+    while free > 0 and users:
+        user_id = next_user(users, running)
+        report_id = client.lpop(WAITING.format(user_id))
+        
+        # back to the end of the line, if there are more reports waiting
+        users.remove(user_id)
+        client.lrem(USERS, 0, user_id)
+        if client.llen(WAITING.format(user_id)):
+            users.append(user_id)
+            client.rpush(USERS, user_id)
+        
+        pickled = report_id and client.hget(REPORTS, report_id)
+        if not pickled:
+            continue
+        report = cPickle.loads(pickled)
+        try:
+            result = report.task.delay(report)
+        except Exception:
+            # the report keeps its place, first in line, until the next dispatch
+            task_logger.exception('could not send report {0} to celery'.format(
+                report_id
+            ))
+            client.lpush(WAITING.format(user_id), report_id)
+            client.lrem(USERS, 0, user_id)
+            client.lpush(USERS, user_id)
+            return
+        
+        running[user_id] = running.get(user_id, 0) + 1
+        pipeline = client.pipeline()
+        pipeline.hdel(REPORTS, report_id)
+        pipeline.hincrby(RUNNING, user_id, 1)
+        pipeline.hset(RUNNING_REPORTS, report_id, json.dumps([
+            user_id, result.id, time()
+        ]))
+        pipeline.execute()
+        free -= 1
+
+
+def queue_positions(user_id=None):
+    """
+    Parameters:
+        user_id : only list the waiting reports of this user, all of them if None
+    
+    Returns:
+        dictionary with:
+            slots   : how many reports can run at once
+            running : dictionary of user id to how many of their reports run
+            waiting : list of dictionaries with the id, user_id, and position
+                      in line of each waiting report, first in line first
+        or None if reports are not queued through redis
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    
+    users = client.lrange(USERS, 0, -1)
+    waiting = dict(
+        (user, client.lrange(WAITING.format(user), 0, -1)) for user in users
+    )
+    running = dict(
+        (user, int(count)) for user, count in client.hgetall(RUNNING).items()
+    )
+    
+    positions = []
+    order = dispatch_order(waiting, users, running)
+    for position, (user, report_id) in enumerate(order, 1):
+        if user_id is None or user == str(user_id):
+            positions.append({
+                'id'        : int(report_id),
+                'user_id'   : user,
+                'position'  : position,
+            })
+    return {
+        'slots'     : slots(),
+        'running'   : running,
+        'waiting'   : positions,
+    }
@@ -58,6 +58,7 @@ class BytesAdded(Metric):
       GROUP BY anon_1.rev_user
     """
     show_in_ui  = True
+    fusable     = True
     id          = 'bytes-added'
     label       = 'Bytes Added'
     description = 'Compute different aggregations of the bytes\
@@ -76,7 +77,7 @@ class BytesAdded(Metric):
     absolute_sum        = BetterBooleanField(default=True)
     net_sum             = BetterBooleanField(default=True)
     
-    def __call__(self, user_ids, session):
+    def calculate(self, user_ids, session):
         """
         Parameters:
             user_ids    : list of mediawiki user ids to find bytes added for
@@ -88,6 +89,7 @@ class BytesAdded(Metric):
                 * absolute_sum      : bytes added plus bytes removed
                 * positive_only_sum : bytes added
                 * negative_only_sum : bytes removed
+            each split into buckets if time_series is set
         """
         # get the dates to act properly in any environment
         start_date = self.start_date.data
@@ -97,7 +99,7 @@ class BytesAdded(Metric):
             end_date = mediawiki_date(self.end_date)
         
         PreviousRevision = session.query(Revision.rev_len, Revision.rev_id).subquery()
-        BC = session.query(
+        columns = [
             Revision.rev_user,
             label(
                 'byte_change',
@@ -105,14 +107,21 @@ class BytesAdded(Metric):
                 -
                 cast(func.coalesce(PreviousRevision.c.rev_len, 0), Integer)
             ),
-        )\
+        ]
+        # a time series also groups by bucket
+        time_series = self.get_time_series()
+        if time_series:
+            columns.append(time_series.column(Revision.rev_timestamp, session))
+        
+        BC = session.query(*columns)\
             .join(Page)\
             .outerjoin(
                 PreviousRevision,
                 Revision.rev_parent_id == PreviousRevision.c.rev_id
             )\
-            .filter(Page.page_namespace.in_(self.namespaces.data))\
-            .filter(Revision.rev_user.in_(user_ids))\
+            .filter(Page.page_namespace.in_(self.namespaces.data))
+        BC = self.filter_users(BC, Revision.rev_user, user_ids)
+        BC = BC\
             .filter(Revision.rev_timestamp >= start_date)\
             .filter(Revision.rev_timestamp <= end_date)\
             .subquery()
@@ -121,8 +130,11 @@ class BytesAdded(Metric):
             #    Revision.rev_timestamp, self.start_date.data, self.end_date.data
             #))\
         
-        bytes_added_by_user = session.query(
-            BC.c.rev_user,
+        group = [BC.c.rev_user]
+        if time_series:
+            group.append(BC.c.bucket)
+        
+        sums = [
             func.sum(BC.c.byte_change).label('net_sum'),
             func.sum(func.abs(BC.c.byte_change)).label('absolute_sum'),
             func.sum(case(
@@ -131,10 +143,23 @@ class BytesAdded(Metric):
             func.sum(case(
                 [(BC.c.byte_change < 0, BC.c.byte_change)], else_=0
             )).label('negative_only_sum'),
-        )\
-            .group_by(BC.c.rev_user)\
+        ]
+        bytes_added_by_user = session.query(*(group + sums))\
+            .group_by(*group)\
             .all()
         
+        if time_series:
+            names = ['net_sum', 'absolute_sum', 'positive_only_sum', 'negative_only_sum']
+            sums_by_user = time_series.collect(bytes_added_by_user, names, session)
+            result_dict = dict(
+                (user_id, self.split_fused(sums))
+                for user_id, sums in sums_by_user.items()
+            )
+            return {
+                user_id: result_dict.get(user_id, self.make_default())
+                for user_id in user_ids
+            }
+        
         result_dict = {}
         for user_id, net, absolute, positive, negative in bytes_added_by_user:
             
@@ -148,21 +173,38 @@ class BytesAdded(Metric):
             if self.negative_only_sum.data:
                 result_dict[user_id]['negative_only_sum'] = negative
         
-        session.close()
         return {
             user_id: result_dict.get(user_id, self.make_default())
             for user_id in user_ids
         }
     
+    def split_fused(self, fused):
+        if fused is None:
+            return self.make_default()
+        
+        result = dict()
+        if self.net_sum.data:
+            result['net_sum'] = fused['net_sum']
+        if self.absolute_sum.data:
+            result['absolute_sum'] = fused['absolute_sum']
+        if self.positive_only_sum.data:
+            result['positive_only_sum'] = fused['positive_only_sum']
+        if self.negative_only_sum.data:
+            result['negative_only_sum'] = fused['negative_only_sum']
+        
+        return result
+    
     def make_default(self):
-        default = dict()
+        names = []
         if self.net_sum.data:
-            default['net_sum'] = None
+            names.append('net_sum')
         if self.absolute_sum.data:
-            default['absolute_sum'] = None
+            names.append('absolute_sum')
         if self.positive_only_sum.data:
-            default['positive_only_sum'] = None
+            names.append('positive_only_sum')
         if self.negative_only_sum.data:
-            default['negative_only_sum'] = None
+            names.append('negative_only_sum')
         
-        return default
+        # the empty buckets of a time series are 0, like those of active users
+        default = 0 if self.get_time_series() else None
+        return self.empty_results(names, default)
@@ -0,0 +1,257 @@
+from datetime import datetime
+from sqlalchemy import func
+from wikimetrics.configurables import db
+from wikimetrics.models.user_daily_activity import (
+    UserDailyActivity, UserDailyActivityCoverage
+)
+from wikimetrics.utils import chunk, deduplicate, parse_date
+from daily_revision_activity import DailyRevisionActivity
+from revision_activity import RevisionActivity
+
+
+__all__ = ['DailyActivityStore']
+
+
+# how many user ids go in each IN clause and each insert
+STORE_BATCH_SIZE = 1000
+
+
+class DailyActivityStore(object):
+    """
+    Materializes revision activity per user, day, and namespace in the
+    wikimetrics database, so that RevisionActivity only has to scan the
+    mediawiki revisions it has never seen.  Each run looks up which days are
+    already stored for each user, computes just the missing days with
+    DailyRevisionActivity, and sums the stored rows.  Only days before today
+    (UTC) are stored, since those can't change anymore; anything after that is
+    computed live every time.
+    
+    Stored days run from midnight to midnight, so the one thing that differs from
+    RevisionActivity is that revisions made exactly at midnight on the end date
+    are not counted when the end date is in the past.
+    Turn this on with DAILY_ACTIVITY_STORE in the db config.
+    """
+    
+    def __init__(self, project):
+        self.project = project
+    
+    @staticmethod
+    def enabled():
+        return bool(db.config.get('DAILY_ACTIVITY_STORE', False))
+    
+    def revision_activity(self, metric, user_ids, session):
+        """
+        Parameters:
+            metric      : a RevisionActivity instance
+            user_ids    : list of mediawiki user ids, or a TemporaryUserTable
+            session     : sqlalchemy session open on the project's mediawiki database
+        
+        Returns:
+            the same dictionary that metric(user_ids, session) returns
+        """
+        start = parse_date(metric.start_date.data)
+        end = parse_date(metric.end_date.data)
+        stored_until = min(end, datetime.utcnow().date())
+        
+        results = {}
+        if start < stored_until:
+            self.materialize(user_ids, start, stored_until, session)
+            results = self.totals(user_ids, start, stored_until, metric.namespaces.data)
+        
+        if stored_until < end:
+            live = RevisionActivity(
+                start_date=str(max(start, stored_until)),
+                end_date=metric.end_date.data,
+                namespaces=list(metric.namespaces.data),
+            )
+            add_activity(results, live(user_ids, session))
+        
+        return {user_id: results.get(user_id) for user_id in user_ids}
+    
+    def materialize(self, user_ids, start, until, session):
+        """
+        Makes sure every user has UserDailyActivity rows for all the days from start
+        up to but not including until.  A user's coverage is only ever extended, so
+        it always stays one contiguous span of days.  Reports materializing the same
+        users at once don't store anything twice: rows another report stored in
+        the meantime are skipped, see insert_ignore.
+        
+        Parameters:
+            user_ids    : list of mediawiki user ids, or a TemporaryUserTable
+            start       : the first day to store, a date
+            until       : the day after the last day to store, a date
+            session     : sqlalchemy session open on the project's mediawiki database
+        """
+        unique_ids = deduplicate(user_ids)
+        wikimetrics_session = db.get_session()
+        try:
+            coverage = {}
+            for batch in chunk(unique_ids, STORE_BATCH_SIZE):
+                coverage.update(
+                    (c.user_id, c)
+                    for c in wikimetrics_session.query(UserDailyActivityCoverage)
+                    .filter(UserDailyActivityCoverage.project == self.project)
+                    .filter(UserDailyActivityCoverage.user_id.in_(batch))
+                    .all()
+                )
+            
+            # users missing the same days are computed together
+            missing = {}
+            for user_id in unique_ids:
+                ranges = missing_ranges(coverage.get(user_id), start, until)
+                if ranges:
+                    missing.setdefault(ranges, []).append(user_id)
+            
+            for ranges, group in missing.items():
+                # a TemporaryUserTable is only useful if nobody has been stored yet
+                group_ids = user_ids if len(group) == len(unique_ids) else group
+                for range_start, range_end in ranges:
+                    self.store_range(
+                        wikimetrics_session, group_ids, range_start, range_end, session
+                    )
+                
+                new_coverage = []
+                for user_id in group:
+                    user_coverage = coverage.get(user_id)
+                    if user_coverage is None:
+                        new_coverage.append({
+                            'project'       : self.project,
+                            'user_id'       : user_id,
+                            'covered_from'  : start,
+                            'covered_until' : until,
+                        })
+                    else:
+                        user_coverage.covered_from = min(
+                            user_coverage.covered_from, start
+                        )
+                        user_coverage.covered_until = max(
+                            user_coverage.covered_until, until
+                        )
+                # if another report covered these users in the meantime, its
+                # coverage is kept.  Either one only spans days that are stored.
+                insert = insert_ignore(UserDailyActivityCoverage, wikimetrics_session)
+                for batch in chunk(new_coverage, STORE_BATCH_SIZE):
+                    wikimetrics_session.execute(insert, batch)
+                wikimetrics_session.commit()
+        finally:
+            wikimetrics_session.close()
+    
+    def store_range(self, wikimetrics_session, user_ids, start, until, session):
+        """
+        Computes and replaces the UserDailyActivity rows of user_ids for the days
+        from start up to but not including until.  Doesn't commit.
+        """
+        daily = DailyRevisionActivity(start_date=str(start), end_date=str(until))
+        activity = daily(user_ids, session)
+        
+        for batch in chunk(activity.keys(), STORE_BATCH_SIZE):
+            # another report may have stored some of these days in the meantime
+            wikimetrics_session.query(UserDailyActivity)\
+                .filter(UserDailyActivity.project == self.project)\
+                .filter(UserDailyActivity.user_id.in_(batch))\
+                .filter(UserDailyActivity.day >= start)\
+                .filter(UserDailyActivity.day < until)\
+                .delete(synchronize_session=False)
+        
+        rows = [
+            dict(day_activity, project=self.project, user_id=user_id)
+            for user_id, days in activity.items()
+            for day_activity in days
+        ]
+        insert = insert_ignore(UserDailyActivity, wikimetrics_session)
+        for batch in chunk(rows, STORE_BATCH_SIZE):
+            wikimetrics_session.execute(insert, batch)
+    
+    def totals(self, user_ids, start, until, namespaces):
+        """
+        Sums the stored activity from start up to but not including until
+        
+        Returns:
+            dictionary from user ids to the same dictionaries RevisionActivity
+            returns, with no entry for users who have no activity
+        """
+        unique_ids = deduplicate(user_ids)
+        wikimetrics_session = db.get_session()
+        results = {}
+        try:
+            for batch in chunk(unique_ids, STORE_BATCH_SIZE):
+                rows = wikimetrics_session.query(
+                    UserDailyActivity.user_id,
+                    func.sum(UserDailyActivity.edits),
+                    func.sum(UserDailyActivity.pages_created),
+                    func.sum(UserDailyActivity.bytes_added),
+                    func.sum(UserDailyActivity.bytes_removed),
+                )\
+                    .filter(UserDailyActivity.project == self.project)\
+                    .filter(UserDailyActivity.user_id.in_(batch))\
+                    .filter(UserDailyActivity.day >= start)\
+                    .filter(UserDailyActivity.day < until)\
+                    .filter(UserDailyActivity.namespace.in_(namespaces))\
+                    .group_by(UserDailyActivity.user_id)\
+                    .all()
+                
+                for user_id, edits, pages_created, added, removed in rows:
+                    added, removed = int(added or 0), int(removed or 0)
+                    results[user_id] = {
+                        'edits'             : int(edits or 0),
+                        'pages_created'     : int(pages_created or 0),
+                        'net_sum'           : added + removed,
+                        'absolute_sum'      : added - removed,
+                        'positive_only_sum' : added,
+                        'negative_only_sum' : removed,
+                    }
+        finally:
+            wikimetrics_session.close()
+        
+        return results
+
+
+def insert_ignore(model, session):
+    """
+    Parameters:
+        model   : UserDailyActivity or UserDailyActivityCoverage
+        session : sqlalchemy session open on the wikimetrics database
+    
+    Returns:
+        an insert into the model's table that skips the rows its unique index
+        already has.  Those were stored by another report running at the same
+        time, from the same revisions.
+    """
+    insert = model.__table__.insert()
+    dialect = session.connection().dialect.name
+    if dialect == 'mysql':
+        return insert.prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return insert.prefix_with('OR IGNORE')
+    return insert
+
+
+def missing_ranges(coverage, start, until):
+    """
+    Returns:
+        a tuple of the (start, until) spans of days that are not in coverage,
+        extended to touch coverage so that filling them keeps it contiguous
+    """
+    if coverage is None:
+        return ((start, until),)
+    
+    ranges = []
+    if start < coverage.covered_from:
+        ranges.append((start, coverage.covered_from))
+    if coverage.covered_until < until:
+        ranges.append((coverage.covered_until, until))
+    return tuple(ranges)
+
+
+def add_activity(results, activity):
+    """
+    Adds the RevisionActivity results in activity to the ones in results
+    """
+    for user_id, user_activity in activity.items():
+        if user_activity is None:
+            continue
+        if results.get(user_id) is None:
+            results[user_id] = dict(user_activity)
+            continue
+        for column, value in user_activity.items():
+            results[user_id][column] = (results[user_id][column] or 0) + (value or 0)
@@ -0,0 +1,121 @@
+from datetime import datetime
+from ..models import Revision, Page
+from metric import Metric
+from wtforms import DateField
+from sqlalchemy import func, case, cast, Integer
+from sqlalchemy.sql.expression import label
+from ..utils import mediawiki_date
+
+
+__all__ = ['DailyRevisionActivity']
+
+
+class DailyRevisionActivity(Metric):
+    """
+    This class is not meant to be requested directly.  It computes, for each user,
+    day, and namespace, the edits, pages created, and bytes added and removed.
+    The DailyActivityStore uses it to fill in the days it has not stored yet.
+    Unlike the other metrics, end_date is not included: revisions from
+    start_date up to but not including end_date are counted.
+    
+    This is the sql query that sqlalchemy generates, roughly:
+    
+     SELECT anon_1.rev_user, anon_1.day, anon_1.page_namespace,
+            count(anon_1.rev_id) AS edits,
+            sum(CASE WHEN (anon_1.rev_parent_id = 0) THEN 1 ELSE 0 END
+               ) AS pages_created,
+            sum(CASE WHEN (anon_1.byte_change > 0) THEN anon_1.byte_change ELSE 0 END
+               ) AS bytes_added,
+            sum(CASE WHEN (anon_1.byte_change < 0) THEN anon_1.byte_change ELSE 0 END
+               ) AS bytes_removed
+       FROM (SELECT revision.rev_user, substr(revision.rev_timestamp, 1, 8) AS day,
+                    page.page_namespace, revision.rev_id, revision.rev_parent_id,
+                    ... byte_change as in BytesAdded ...
+              WHERE revision.rev_user IN (...)
+                AND revision.rev_timestamp >= [start]
+                AND revision.rev_timestamp < [end]
+            ) AS anon_1
+      GROUP BY anon_1.rev_user, anon_1.day, anon_1.page_namespace
+    """
+    
+    show_in_ui  = False
+    id          = 'daily-revision-activity'
+    label       = 'Daily Revision Activity'
+    description = 'Revision activity by day and namespace'
+    
+    start_date  = DateField()
+    end_date    = DateField()
+    
+    def calculate(self, user_ids, session):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to find daily activity for
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            dictionary from user ids to a list of dictionaries with the keys:
+                day, namespace, edits, pages_created, bytes_added, bytes_removed
+            users without revisions get an empty list
+        """
+        start_date = self.start_date.data
+        end_date = self.end_date.data
+        # mediawiki timestamps look like 20130601120000, sqlite's 2013-06-01 12:00:00
+        day_length, day_format = 10, '%Y-%m-%d'
+        if session.bind.name == 'mysql':
+            start_date = mediawiki_date(self.start_date)
+            end_date = mediawiki_date(self.end_date)
+            day_length, day_format = 8, '%Y%m%d'
+        
+        PreviousRevision = session.query(Revision.rev_len, Revision.rev_id).subquery()
+        changes = session.query(
+            Revision.rev_user,
+            label('day', func.substr(Revision.rev_timestamp, 1, day_length)),
+            Page.page_namespace,
+            Revision.rev_id,
+            Revision.rev_parent_id,
+            label(
+                'byte_change',
+                cast(Revision.rev_len, Integer)
+                -
+                cast(func.coalesce(PreviousRevision.c.rev_len, 0), Integer)
+            ),
+        )\
+            .join(Page)\
+            .outerjoin(
+                PreviousRevision,
+                Revision.rev_parent_id == PreviousRevision.c.rev_id
+            )
+        changes = self.filter_users(changes, Revision.rev_user, user_ids)
+        changes = changes\
+            .filter(Revision.rev_timestamp >= start_date)\
+            .filter(Revision.rev_timestamp < end_date)\
+            .subquery()
+        
+        daily_activity = session.query(
+            changes.c.rev_user,
+            changes.c.day,
+            changes.c.page_namespace,
+            func.count(changes.c.rev_id),
+            func.sum(case([(changes.c.rev_parent_id == 0, 1)], else_=0)),
+            func.sum(case(
+                [(changes.c.byte_change > 0, changes.c.byte_change)], else_=0
+            )),
+            func.sum(case(
+                [(changes.c.byte_change < 0, changes.c.byte_change)], else_=0
+            )),
+        )\
+            .group_by(changes.c.rev_user, changes.c.day, changes.c.page_namespace)\
+            .all()
+        
+        results = {user_id: [] for user_id in user_ids}
+        for user_id, day, namespace, edits, created, added, removed in daily_activity:
+            results[user_id].append({
+                'day'           : datetime.strptime(day, day_format).date(),
+                'namespace'     : namespace,
+                'edits'         : edits,
+                'pages_created' : int(created or 0),
+                'bytes_added'   : int(added or 0),
+                'bytes_removed' : int(removed or 0),
+            })
+        
+        return results
@@ -20,7 +20,7 @@ class RandomMetric(Metric):
     
     test_field = IntegerField(default=1000)
     
-    def __call__(self, user_ids, session):
+    def calculate(self, user_ids, session):
         """
         Parameters:
             user_ids    : list of user ids to return random numbers for
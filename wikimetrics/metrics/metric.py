@@ -1,5 +1,10 @@
+from sqlalchemy.orm import sessionmaker
+from wtforms import SelectField
 from wtforms.ext.csrf.session import SessionSecureForm
-from wikimetrics.configurables import app
+from wikimetrics.configurables import app, db
+from wikimetrics.utils import chunk, parallel_map
+from temporary_user_table import TemporaryUserTable
+from time_series import TimeSeries, NO_TIME_SERIES, TIME_SERIES_CHOICES
 
 
 __all__ = ['Metric']
@@ -8,10 +13,14 @@ __all__ = ['Metric']
 class Metric(SessionSecureForm):
     """
     This class is the parent of all Metric implementations.
-    Child implementations should be callable and should take in users
-    and return the metric computation results for each user.
+    Instances are callable and take in users and return the metric
+    computation results for each user.  Child implementations should
+    implement calculate, which Metric.__call__ runs on batches of users.
     In addition, Metric inherits from wtforms Form and therefore child implementations
     can provide WTForms field definitions of their parametrization.
+    Every metric has a time_series field.  Metrics with a start_date and end_date
+    that support it split each user's results by day, week, or month when it's
+    set, see get_time_series.
     To enable user interaction with child implementations, Metric also defines some
     class level properties that can be introspected by an interface.
     """
@@ -21,10 +30,82 @@ class Metric(SessionSecureForm):
     label       = None  # this will be displayed as the title of the metric-specific
                         # tab in the request form
     description = None  # basic description of what the metric does
+    fusable     = False  # whether RevisionActivity can compute this metric
+                         # along with others in one query, see split_fused
+    fused_columns = []  # the RevisionActivity columns a fusable metric returns
     
-    def __call__(self, user_ids, session):
+    time_series = SelectField(
+        choices=TIME_SERIES_CHOICES,
+        default=NO_TIME_SERIES,
+        description='split the results by day, week or month',
+    )
+    
+    def __call__(self, user_ids, session, checkpoint=None):
+        """
+        Splits user_ids into batches of at most METRIC_BATCH_SIZE, calculates
+        the metric for each batch, and merges the results.  This keeps the
+        IN clauses that metrics build over user_ids to a reasonable size.
+        If METRIC_BATCH_THREADS is more than 1, the batches are calculated
+        in parallel, each with its own session bound to the same database.
+        
+        Parameters:
+            user_ids    : list of mediawiki user ids to calculate the metric on,
+                          or a TemporaryUserTable holding them
+            session     : sqlalchemy session open on a mediawiki database
+            checkpoint  : if given, the results of each batch are saved with
+                          checkpoint.save(batch index, results), and batches that
+                          checkpoint.load(batch index) returns are not calculated
+                          again.  A report that is resumed uses this to pick up
+                          where it left off, see MetricReport.
+        
+        Returns:
+            dictionary from user ids to the metric results.
+        """
+        # a temporary table is already joined to in one query, no need to batch
+        if isinstance(user_ids, TemporaryUserTable):
+            return self.calculate(user_ids, session)
+        
+        user_ids = list(user_ids)
+        batch_size = db.config.get('METRIC_BATCH_SIZE')
+        if not batch_size or len(user_ids) <= batch_size:
+            return self.calculate(user_ids, session)
+        
+        def calculate_batch(index, batch, batch_session):
+            if checkpoint is None:
+                return self.calculate(batch, batch_session)
+            results = checkpoint.load(index)
+            if results is None:
+                results = self.calculate(batch, batch_session)
+                checkpoint.save(index, results)
+            return results
+        
+        batches = list(enumerate(chunk(user_ids, batch_size)))
+        threads = db.config.get('METRIC_BATCH_THREADS', 1)
+        if threads > 1:
+            batch_sessionmaker = sessionmaker(session.bind)
+            
+            def calculate_in_thread(indexed_batch):
+                index, batch = indexed_batch
+                batch_session = batch_sessionmaker()
+                try:
+                    return calculate_batch(index, batch, batch_session)
+                finally:
+                    batch_session.close()
+            
+            batch_results = parallel_map(calculate_in_thread, batches, threads)
+        else:
+            batch_results = [
+                calculate_batch(index, batch, session) for index, batch in batches
+            ]
+        
+        results = {}
+        for batch_result in batch_results:
+            results.update(batch_result)
+        return results
+    
+    def calculate(self, user_ids, session):
         """
-        This is the __call__ signature any child implementations should follow.
+        This is the calculate signature any child implementations should follow.
         
         Parameters:
             user_ids    : list of mediawiki user ids to calculate the metric on
@@ -35,6 +116,61 @@ class Metric(SessionSecureForm):
         """
         return {user: None for user in user_ids}
     
+    def split_fused(self, fused):
+        """
+        Picks the fused_columns out of what RevisionActivity computed for one
+        user.  Fusable child implementations whose columns depend on their
+        parameters override this.
+        
+        Parameters:
+            fused   : dictionary of RevisionActivity columns, or None if
+                      the user had no revisions
+        
+        Returns:
+            the same results calculate would give for this user
+        """
+        if fused is None:
+            return self.empty_results(self.fused_columns)
+        return dict((name, fused[name]) for name in self.fused_columns)
+    
+    def get_time_series(self):
+        """
+        Returns:
+            the TimeSeries to split the results into, or None if they are not split
+        """
+        unit = self.time_series.data
+        if not unit or unit == NO_TIME_SERIES or not hasattr(self, 'start_date'):
+            return None
+        return TimeSeries(unit, self.start_date.data, self.end_date.data)
+    
+    def empty_results(self, names, default=0):
+        """
+        Returns:
+            the results of a user with no activity: default for each of names,
+            or for each bucket of each of names in a time series
+        """
+        time_series = self.get_time_series()
+        if time_series is None:
+            return dict.fromkeys(names, default)
+        return time_series.empty(names, default)
+    
+    def filter_users(self, query, column, user_ids):
+        """
+        Child implementations should use this to restrict their queries to the
+        users passed in, so they work with both lists and temporary tables.
+        
+        Parameters:
+            query       : sqlalchemy query to restrict
+            column      : the user id column to restrict, like Revision.rev_user
+            user_ids    : list of mediawiki user ids, or a TemporaryUserTable
+        
+        Returns:
+            the query, filtered with an IN clause or joined to the temporary table
+        """
+        if isinstance(user_ids, TemporaryUserTable):
+            return user_ids.filter(query, column)
+        return query.filter(column.in_(user_ids))
+    
     def __init__(self, *args, **kwargs):
         """
         Initialize the things required by SessionSecureForm to do its duty
@@ -31,6 +31,8 @@ class NamespaceEdits(Metric):
     """
     
     show_in_ui  = True
+    fusable     = True
+    fused_columns = ['edits']
     id          = 'edits'
     label       = 'Edits'
     description = (
@@ -47,14 +49,15 @@ class NamespaceEdits(Metric):
         description='0, 2, 4, etc.',
     )
     
-    def __call__(self, user_ids, session):
+    def calculate(self, user_ids, session):
         """
         Parameters:
             user_ids    : list of mediawiki user ids to find edit for
             session     : sqlalchemy session open on a mediawiki database
         
         Returns:
-            dictionary from user ids to the number of edit found.
+            dictionary from user ids to the number of edit found, or to the
+            number in each bucket if time_series is set
         """
         # get the dates to act properly in any environment
         start_date = self.start_date.data
@@ -63,18 +66,32 @@ class NamespaceEdits(Metric):
             start_date = mediawiki_date(self.start_date)
             end_date = mediawiki_date(self.end_date)
         
-        # directly construct dict from query results
-        revisions_by_user = dict(
-            session
-            .query(Revision.rev_user, func.count(Revision.rev_id))
-            .join(Page)
+        # a time series also groups by bucket
+        time_series = self.get_time_series()
+        group = [Revision.rev_user]
+        if time_series:
+            group.append(time_series.column(Revision.rev_timestamp, session))
+        
+        revisions = session\
+            .query(*(group + [func.count(Revision.rev_id)]))\
+            .join(Page)\
             .filter(Page.page_namespace.in_(self.namespaces.data))
-            .filter(Revision.rev_user.in_(user_ids))
-            .filter(Revision.rev_timestamp >= start_date)
-            .filter(Revision.rev_timestamp <= end_date)
-            .group_by(Revision.rev_user)
+        revisions = self.filter_users(revisions, Revision.rev_user, user_ids)
+        revisions = revisions\
+            .filter(Revision.rev_timestamp >= start_date)\
+            .filter(Revision.rev_timestamp <= end_date)\
+            .group_by(*group)\
             .all()
-        )
+        
+        if time_series:
+            edits_by_user = time_series.collect(revisions, ['edits'], session)
+            return {
+                user_id: edits_by_user.get(user_id) or self.empty_results(['edits'])
+                for user_id in user_ids
+            }
+        
+        # directly construct dict from query results
+        revisions_by_user = dict(revisions)
         return {
             user_id: {'edits': revisions_by_user.get(user_id, 0)}
             for user_id in user_ids
@@ -28,6 +28,8 @@ class PagesCreated(Metric):
     """
     
     show_in_ui  = True
+    fusable     = True
+    fused_columns = ['pages_created']
     id          = 'pages_created'
     label       = 'Pages Created'
     description = (
@@ -45,14 +47,15 @@ class PagesCreated(Metric):
         description='0, 2, 4, etc.',
     )
     
-    def __call__(self, user_ids, session):
+    def calculate(self, user_ids, session):
         """
         Parameters:
             user_ids    : list of mediawiki user ids to find edit for
             session     : sqlalchemy session open on a mediawiki database
         
         Returns:
-            dictionary from user ids to the number of edit found.
+            dictionary from user ids to the number of pages created, or to the
+            number in each bucket if time_series is set
         """
         # TODO: (low-priority) take into account cases where rev_deleted = 1
         start_date = self.start_date.data
@@ -60,17 +63,33 @@ class PagesCreated(Metric):
         if session.bind.name == 'mysql':
             start_date = mediawiki_date(self.start_date)
             end_date = mediawiki_date(self.end_date)
-        p = dict(session
-                 .query(Revision.rev_user, func.count(Page.page_id))
-                 .join(Page)
-                 .filter(Page.page_namespace.in_(self.namespaces.data))
-                 .filter(Revision.rev_parent_id == 0)
-                 .filter(Revision.rev_user.in_(user_ids))
-                 .filter(Revision.rev_timestamp >= start_date)
-                 .filter(Revision.rev_timestamp <= end_date)
-                 .all()
-                 )
+        # a time series also groups by bucket
+        time_series = self.get_time_series()
+        group = [Revision.rev_user]
+        if time_series:
+            group.append(time_series.column(Revision.rev_timestamp, session))
         
+        pages = session\
+            .query(*(group + [func.count(Page.page_id)]))\
+            .join(Page)\
+            .filter(Page.page_namespace.in_(self.namespaces.data))\
+            .filter(Revision.rev_parent_id == 0)
+        pages = self.filter_users(pages, Revision.rev_user, user_ids)
+        pages = pages\
+            .filter(Revision.rev_timestamp >= start_date)\
+            .filter(Revision.rev_timestamp <= end_date)\
+            .group_by(*group)\
+            .all()
+        
+        if time_series:
+            names = ['pages_created']
+            pages_by_user = time_series.collect(pages, names, session)
+            return {
+                user_id: pages_by_user.get(user_id) or self.empty_results(names)
+                for user_id in user_ids
+            }
+        
+        p = dict(pages)
         return {
             user_id: {'pages_created': p.get(user_id, 0)}
             for user_id in user_ids
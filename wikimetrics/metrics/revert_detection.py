@@ -0,0 +1,47 @@
+__all__ = ['detect_reverts']
+
+
+# how many revisions back a revert can reach, the same as mwreverts
+DEFAULT_RADIUS = 15
+
+
+def detect_reverts(history, radius=DEFAULT_RADIUS):
+    """
+    Finds the identity reverts in the history of one page, in a single pass.
+    A revision is an identity revert if its content has the same sha1 as one of
+    the radius revisions before it, other than the one right before it.  It
+    puts the page back in that state, reverting every revision in between.
+    The last position of each sha1 is kept in a dictionary, so each revision is
+    looked up once instead of being compared to the whole window.
+    As in mwreverts, reverted revisions are taken out of the history, so the
+    states they created can't be reverted to later.
+    
+    Parameters:
+        history : (sha1, revision) pairs of one page, oldest first.  Revisions
+                  with no sha1, for example deleted ones, are never reverts.
+        radius  : how many revisions back a revert can reach
+    
+    Yields:
+        (reverting, reverted) for each revert, where reverted is the list of
+        revisions it undid, oldest first
+    """
+    # the revisions that have not been reverted, and where each sha1 is in it
+    kept = []
+    positions = {}
+    for sha1, revision in history:
+        if sha1 in positions:
+            reverted_to = positions[sha1][-1]
+            if len(kept) - radius <= reverted_to < len(kept) - 1:
+                reverted = kept[reverted_to + 1:]
+                del kept[reverted_to + 1:]
+                for reverted_sha1, _ in reversed(reverted):
+                    if reverted_sha1:
+                        stack = positions[reverted_sha1]
+                        stack.pop()
+                        if not stack:
+                            del positions[reverted_sha1]
+                yield (revision, [r for _, r in reverted])
+        
+        if sha1:
+            positions.setdefault(sha1, []).append(len(kept))
+        kept.append((sha1, revision))
@@ -1,6 +1,13 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from sqlalchemy import and_, case
+from sqlalchemy.sql.expression import label
 from metric import Metric
-from ..utils import thirty_days_ago, today
+from ..models import Page, Revision
+from ..utils import thirty_days_ago, today, parse_date
 from form_fields import CommaSeparatedIntegerListField
+from revert_detection import detect_reverts, DEFAULT_RADIUS
 from wtforms import DateField
 from wtforms.validators import Required
 
@@ -9,32 +16,53 @@ __all__ = [
 ]
 
 
+# edits made near end_date can still be reverted up to this many days after it
+REVERT_LOOKAHEAD_DAYS = 2
+# the histories of this many pages are read before looking up the revisions
+# that came before them
+PAGE_BATCH_SIZE = 1000
+
+
 class RevertRate(Metric):
     """
     This class implements revert rate logic.
     An instance of the class is callable and will compute the number of reverted
     edits for each user in a passed-in list.
     
-    This sql query was used as a starting point for the sqlalchemy query:
-    
-     select r.rev_user, r.count(*)
-       from revision r
-      where r.rev_timestamp between [start] and [end]
-        and r.rev_user in ([cohort's user list or maybe a join to a temp])
-        and exists (
-             select *
-               from revision r1
-                        inner join
-                    revision r2     on r2.rev_sha1 = r1.rev_sha1
-              where r1.rev_page = r.rev_page
-                and r2.rev_page = r.rev_page
-                and r1.rev_timestamp between [start] and r.rev_timestamp
-                and r2.rev_timestamp between r.rev_timestamp and [end]
-            )
-      group by rev_user
+    Instead of checking every revision for a matching rev_sha1 before and after
+    it, which is quadratic in the length of each page's history, this reads the
+    history of each page the users edited once, in order, and finds the identity
+    reverts in a single pass with detect_reverts.  The history starts at
+    start_date, with the radius revisions before it in front so edits can be
+    reverted to any of those states, and goes on for REVERT_LOOKAHEAD_DAYS past
+    end_date so late edits can be reverted too.
+    
+    An edit counts as reverted if someone else reverted it, self reverts don't
+    count.  revert_rate is reverted / edits, or 0 for users with no edits.
+    In a time series, reverted edits are counted in the bucket they were made in.
+    
+    This is the sql query that sqlalchemy generates, roughly:
+    
+     SELECT revision.rev_page, revision.rev_id, revision.rev_parent_id,
+            revision.rev_user, revision.rev_sha1,
+            CASE WHEN (revision.rev_timestamp BETWEEN [start] AND [end])
+                 THEN 1 ELSE 0 END AS in_range
+       FROM revision
+                INNER JOIN
+            (SELECT DISTINCT revision.rev_page
+               FROM revision
+                        INNER JOIN
+                    page        ON page.page_id = revision.rev_page
+              WHERE page.page_namespace IN (...)
+                AND revision.rev_user IN (...)
+                AND revision.rev_timestamp BETWEEN [start] AND [end]
+            ) AS anon_1 ON anon_1.rev_page = revision.rev_page
+      WHERE revision.rev_timestamp >= [start]
+        AND revision.rev_timestamp < [end + REVERT_LOOKAHEAD_DAYS]
+      ORDER BY revision.rev_page, revision.rev_timestamp, revision.rev_id
     """
     
-    show_in_ui  = False
+    show_in_ui  = True
     id          = 'revert-rate'
     label       = 'Revert Rate'
     description = 'Compute the number of reverted edits in a mediawiki project'
@@ -47,14 +75,178 @@ class RevertRate(Metric):
         default='0',
         description='0, 2, 4, etc.',
     )
+    # how many revisions back a revert can reach
+    radius      = DEFAULT_RADIUS
+    
+    def calculate(self, user_ids, session):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to find edit reverts for
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            dictionary from user ids to the number of edits, the number of them
+            that were reverted, and the ratio of the two, each split into
+            buckets if time_series is set
+        """
+        start_date = parse_date(self.start_date.data)
+        end_date = parse_date(self.end_date.data)
+        lookahead_date = end_date + timedelta(days=REVERT_LOOKAHEAD_DAYS)
+        bounds = [start_date, end_date, lookahead_date]
+        if session.bind.name == 'mysql':
+            bounds = [date.strftime('%Y%m%d%H%M%S') for date in bounds]
+        start, end, lookahead = bounds
+        
+        touched = session.query(Revision.rev_page)\
+            .join(Page)\
+            .filter(Page.page_namespace.in_(self.namespaces.data))\
+            .filter(Revision.rev_timestamp >= start)\
+            .filter(Revision.rev_timestamp <= end)
+        touched = self.filter_users(touched, Revision.rev_user, user_ids)
+        touched = touched.distinct().subquery()
+        
+        columns = [
+            Revision.rev_page,
+            Revision.rev_id,
+            Revision.rev_parent_id,
+            Revision.rev_user,
+            Revision.rev_sha1,
+            label('in_range', case([(and_(
+                Revision.rev_timestamp >= start,
+                Revision.rev_timestamp <= end,
+            ), 1)], else_=0)),
+        ]
+        time_series = self.get_time_series()
+        if time_series:
+            columns.append(time_series.column(Revision.rev_timestamp, session))
+        
+        def counted_under(revision):
+            # edits are counted by user, and by bucket in a time series
+            if time_series:
+                return (revision.rev_user, time_series.bucket(revision.bucket, session))
+            return revision.rev_user
+        
+        history = session.query(*columns)\
+            .join(touched, touched.c.rev_page == Revision.rev_page)\
+            .filter(Revision.rev_timestamp >= start)\
+            .filter(Revision.rev_timestamp < lookahead)\
+            .order_by(Revision.rev_page, Revision.rev_timestamp, Revision.rev_id)
+        
+        cohort = set(user_ids)
+        edits = defaultdict(int)
+        reverted = defaultdict(int)
+        for page_history in self.page_histories(history, session):
+            for sha1, revision in page_history:
+                if revision and revision.in_range and revision.rev_user in cohort:
+                    edits[counted_under(revision)] += 1
+            
+            page_reverts = detect_reverts(page_history, self.radius)
+            for reverting, reverted_revisions in page_reverts:
+                for revision in reverted_revisions:
+                    if revision is None:
+                        # before start_date
+                        continue
+                    user_id = revision.rev_user
+                    if revision.in_range and user_id in cohort\
+                            and user_id != reverting.rev_user:
+                        reverted[counted_under(revision)] += 1
+        
+        if time_series:
+            return self.time_series_results(user_ids, edits, reverted)
+        
+        return {
+            user_id: {
+                'edits'         : edits[user_id],
+                'reverted'      : reverted[user_id],
+                'revert_rate'   : revert_rate(edits[user_id], reverted[user_id]),
+            }
+            for user_id in user_ids
+        }
+    
+    def time_series_results(self, user_ids, edits, reverted):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids
+            edits       : dictionary from (user_id, bucket) to the number of edits
+            reverted    : dictionary from (user_id, bucket) to the number reverted
+        
+        Returns:
+            dictionary from user ids to their results, split into buckets
+        """
+        results = {}
+        for user_id in user_ids:
+            results[user_id] = self.empty_results(['edits', 'reverted'])
+            results[user_id].update(self.empty_results(['revert_rate'], 0.0))
+        
+        for (user_id, bucket), count in edits.items():
+            user_results = results[user_id]
+            user_results['edits'][bucket] = count
+            user_results['reverted'][bucket] = reverted[(user_id, bucket)]
+            user_results['revert_rate'][bucket] = revert_rate(
+                count, reverted[(user_id, bucket)]
+            )
+        return results
+    
+    def page_histories(self, history, session):
+        """
+        Groups the rows of the history query by page, and puts the revisions
+        that came before each page's history in front of it, looking those up for
+        PAGE_BATCH_SIZE pages at a time.
+        
+        Yields:
+            the (sha1, revision) pairs of each page, as detect_reverts takes them.
+            The revisions before the history are only there to be reverted to, so
+            they show up with None instead of a revision.
+        """
+        pages = []
+        for page_id, revisions in groupby(history, key=lambda r: r.rev_page):
+            pages.append(list(revisions))
+            if len(pages) >= PAGE_BATCH_SIZE:
+                for page_history in self.with_previous_revisions(pages, session):
+                    yield page_history
+                pages = []
+        
+        for page_history in self.with_previous_revisions(pages, session):
+            yield page_history
     
-    #def __call__(self, user_ids, session):
-        #"""
-        #Parameters:
-            #user_ids    : list of mediawiki user ids to find edit reverts for
-            #session     : sqlalchemy session open on a mediawiki database
+    def with_previous_revisions(self, pages, session):
+        """
+        Follows rev_parent_id back from the start of each page's history, up to
+        radius revisions, one step for all the pages at a time.  Each step is one
+        query by primary key.
+        """
+        # the sha1s before each page's history, newest first
+        previous = [[] for revisions in pages]
+        # the next revision to look up, and which page it is for
+        parents = dict(
+            (revisions[0].rev_parent_id, index)
+            for index, revisions in enumerate(pages)
+            if revisions[0].rev_parent_id
+        )
+        for step in range(self.radius):
+            if not parents:
+                break
+            rows = session.query(
+                Revision.rev_id, Revision.rev_parent_id, Revision.rev_sha1
+            )\
+                .filter(Revision.rev_id.in_(parents.keys()))\
+                .all()
+            
+            next_parents = {}
+            for rev_id, parent_id, sha1 in rows:
+                index = parents[rev_id]
+                previous[index].append(sha1)
+                if parent_id:
+                    next_parents[parent_id] = index
+            parents = next_parents
         
-        #Returns:
-            #dictionary from user ids to the number of edit reverts found.
-        #"""
-        #return {user: None for user in user_ids}
+        for revisions, sha1s in zip(pages, previous):
+            page_history = [(sha1, None) for sha1 in reversed(sha1s)]
+            page_history.extend((r.rev_sha1, r) for r in revisions)
+            yield page_history
+
+
+def revert_rate(edits, reverted):
+    if not edits:
+        return 0.0
+    return reverted / float(edits)
@@ -0,0 +1,173 @@
+from ..utils import mediawiki_date
+from ..models import Revision, Page
+from metric import Metric
+from form_fields import CommaSeparatedIntegerListField
+from wtforms import DateField
+from sqlalchemy import func, case, cast, Integer
+from sqlalchemy.sql.expression import label
+
+
+__all__ = ['RevisionActivity']
+
+
+class RevisionActivity(Metric):
+    """
+    This class is not meant to be requested directly.  It computes, in one pass
+    over revision_userindex, the columns of every metric that sets fusable:
+    
+        * edits             : as in NamespaceEdits
+        * pages_created     : as in PagesCreated
+        * net_sum, absolute_sum, positive_only_sum, negative_only_sum
+                            : as in BytesAdded
+    
+    When a report asks for several of those metrics over the same users,
+    dates, and namespaces, this runs once and each metric picks out its own
+    columns with split_fused.  See wikimetrics.models.report_nodes.metric_fusion
+    
+    This is the sql query that sqlalchemy generates, roughly:
+    
+     SELECT anon_1.rev_user,
+            count(anon_1.rev_id) AS edits,
+            sum(CASE WHEN (anon_1.rev_parent_id = 0) THEN 1 ELSE 0 END
+               ) AS pages_created,
+            sum(anon_1.byte_change) AS net_sum,
+            ... the rest of the BytesAdded sums ...
+       FROM (SELECT revision.rev_user, revision.rev_id, revision.rev_parent_id,
+                    (   cast(revision.rev_len as signed)
+                        - cast(coalesce(anon_2.rev_len, 0) as signed)
+                    ) AS byte_change
+               FROM revision
+                        INNER JOIN
+                    page        ON page.page_id = revision.rev_page
+                        LEFT OUTER JOIN
+                    (SELECT rev_id, rev_len FROM revision
+                    ) AS anon_2 ON revision.rev_parent_id = anon_2.rev_id
+              WHERE page.page_namespace IN (...)
+                AND revision.rev_user IN (...)
+                AND revision.rev_timestamp BETWEEN [start] AND [end]
+            ) AS anon_1
+      GROUP BY anon_1.rev_user
+    """
+    
+    show_in_ui  = False
+    id          = 'revision-activity'
+    label       = 'Revision Activity'
+    description = 'Combined computation of the revision based metrics'
+    
+    start_date  = DateField()
+    end_date    = DateField()
+    namespaces  = CommaSeparatedIntegerListField(None)
+    
+    @classmethod
+    def fusion_key(cls, metric):
+        """
+        Metrics with the same fusion key can be computed together by one instance
+        """
+        return (
+            str(metric.start_date.data),
+            str(metric.end_date.data),
+            tuple(sorted(metric.namespaces.data)),
+            metric.time_series.data,
+        )
+    
+    @classmethod
+    def for_metric(cls, metric):
+        """
+        Returns a RevisionActivity with the same parameters as the metric passed in
+        """
+        return cls(
+            start_date=metric.start_date.data,
+            end_date=metric.end_date.data,
+            namespaces=list(metric.namespaces.data),
+            time_series=metric.time_series.data,
+        )
+    
+    def calculate(self, user_ids, session):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to find revision activity for
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            dictionary from user ids to a dictionary of all the columns listed
+            above, or to None if the user has no revisions.  The columns are
+            split into buckets if time_series is set
+        """
+        start_date = self.start_date.data
+        end_date = self.end_date.data
+        if session.bind.name == 'mysql':
+            start_date = mediawiki_date(self.start_date)
+            end_date = mediawiki_date(self.end_date)
+        
+        PreviousRevision = session.query(Revision.rev_len, Revision.rev_id).subquery()
+        columns = [
+            Revision.rev_user,
+            Revision.rev_id,
+            Revision.rev_parent_id,
+            label(
+                'byte_change',
+                cast(Revision.rev_len, Integer)
+                -
+                cast(func.coalesce(PreviousRevision.c.rev_len, 0), Integer)
+            ),
+        ]
+        # a time series also groups by bucket
+        time_series = self.get_time_series()
+        if time_series:
+            columns.append(time_series.column(Revision.rev_timestamp, session))
+        
+        changes = session.query(*columns)\
+            .join(Page)\
+            .outerjoin(
+                PreviousRevision,
+                Revision.rev_parent_id == PreviousRevision.c.rev_id
+            )\
+            .filter(Page.page_namespace.in_(self.namespaces.data))
+        changes = self.filter_users(changes, Revision.rev_user, user_ids)
+        changes = changes\
+            .filter(Revision.rev_timestamp >= start_date)\
+            .filter(Revision.rev_timestamp <= end_date)\
+            .subquery()
+        
+        group = [changes.c.rev_user]
+        if time_series:
+            group.append(changes.c.bucket)
+        
+        activity = [
+            func.count(changes.c.rev_id).label('edits'),
+            func.sum(case(
+                [(changes.c.rev_parent_id == 0, 1)], else_=0
+            )).label('pages_created'),
+            func.sum(changes.c.byte_change).label('net_sum'),
+            func.sum(func.abs(changes.c.byte_change)).label('absolute_sum'),
+            func.sum(case(
+                [(changes.c.byte_change > 0, changes.c.byte_change)], else_=0
+            )).label('positive_only_sum'),
+            func.sum(case(
+                [(changes.c.byte_change < 0, changes.c.byte_change)], else_=0
+            )).label('negative_only_sum'),
+        ]
+        activity_by_user = session.query(*(group + activity))\
+            .group_by(*group)\
+            .all()
+        
+        if time_series:
+            names = [
+                'edits', 'pages_created', 'net_sum', 'absolute_sum',
+                'positive_only_sum', 'negative_only_sum',
+            ]
+            result_dict = time_series.collect(activity_by_user, names, session)
+            return {user_id: result_dict.get(user_id) for user_id in user_ids}
+        
+        result_dict = {}
+        for row in activity_by_user:
+            result_dict[row.rev_user] = {
+                'edits'             : row.edits,
+                'pages_created'     : int(row.pages_created or 0),
+                'net_sum'           : row.net_sum,
+                'absolute_sum'      : row.absolute_sum,
+                'positive_only_sum' : row.positive_only_sum,
+                'negative_only_sum' : row.negative_only_sum,
+            }
+        
+        return {user_id: result_dict.get(user_id) for user_id in user_ids}
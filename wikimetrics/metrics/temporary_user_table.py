@@ -0,0 +1,71 @@
+from uuid import uuid4
+from sqlalchemy import MetaData, Table, Column, Integer
+from wikimetrics.utils import chunk, deduplicate
+
+
+__all__ = ['TemporaryUserTable']
+
+
+class TemporaryUserTable(object):
+    """
+    Loads a list of mediawiki user ids into a temporary table on the connection
+    held by a mediawiki session.  Metrics can then join revision_userindex to this
+    table instead of building enormous IN clauses, which lets MySQL use the
+    rev_user / rev_timestamp index properly for huge cohorts.
+    
+    Temporary tables only exist on the connection that created them, so the
+    session must not be committed or closed between create() and drop().
+    
+    Instances iterate over the user ids like the list they replace,
+    so metrics can still build per-user results from them.
+    """
+    
+    insert_batch_size = 1000
+    
+    def __init__(self, session, user_ids):
+        self.session = session
+        self.user_ids = list(user_ids)
+        self.table = Table(
+            'wikimetrics_user_{0}'.format(uuid4().hex),
+            MetaData(),
+            Column('user_id', Integer, primary_key=True),
+            prefixes=['TEMPORARY'],
+        )
+    
+    def __iter__(self):
+        return iter(self.user_ids)
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    def create(self):
+        """
+        Creates the temporary table and fills it with the user ids
+        """
+        connection = self.session.connection()
+        self.table.create(connection)
+        unique_user_ids = deduplicate(self.user_ids)
+        for batch in chunk(unique_user_ids, self.insert_batch_size):
+            connection.execute(
+                self.table.insert(),
+                [{'user_id': user_id} for user_id in batch]
+            )
+    
+    def drop(self):
+        """
+        Drops the temporary table.  MySQL needs the TEMPORARY keyword here,
+        otherwise it would commit the open transaction and check DROP privileges.
+        """
+        connection = self.session.connection()
+        if connection.dialect.name == 'mysql':
+            connection.execute(
+                'DROP TEMPORARY TABLE IF EXISTS {0}'.format(self.table.name)
+            )
+        else:
+            self.table.drop(connection)
+    
+    def filter(self, query, column):
+        """
+        Restricts query to rows where column is one of the user ids, by joining
+        """
+        return query.join(self.table, self.table.c.user_id == column)
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.sql.expression import label
+from ..utils import parse_date
+
+
+__all__ = [
+    'TimeSeries',
+    'NO_TIME_SERIES',
+    'TIME_SERIES_CHOICES',
+]
+
+
+NO_TIME_SERIES = 'none'
+TIME_SERIES_CHOICES = [
+    (NO_TIME_SERIES, 'none'),
+    ('day', 'day'),
+    ('week', 'week'),
+    ('month', 'month'),
+]
+
+
+class TimeSeries(object):
+    """
+    Splits the start_date..end_date of a metric into buckets of a day, a week
+    (starting on Monday) or a month.  Each bucket is labeled with the day it
+    starts on, like '2013-06-03'.  Metrics add column() to their select and
+    group by, and collect() turns the rows into the results of each user, with
+    one value per bucket:
+    
+        {user_id: {'edits': {'2013-06-03': 2, '2013-06-10': 0, ...}}}
+    
+    The databases don't agree on how to truncate a timestamp to its week, so
+    weeks are grouped by day in sql and the days are added up in python.
+    
+    Parameters:
+        unit        : day, week or month
+        start_date  : the metric's start_date.data
+        end_date    : the metric's end_date.data
+    """
+    
+    def __init__(self, unit, start_date, end_date):
+        self.unit = unit
+        self.buckets = []
+        day = self.bucket_start(parse_date(start_date))
+        end = parse_date(end_date)
+        while day <= end:
+            self.buckets.append(str(day))
+            day = self.next_bucket(day)
+    
+    def bucket_start(self, day):
+        if self.unit == 'week':
+            return day - timedelta(days=day.weekday())
+        if self.unit == 'month':
+            return day.replace(day=1)
+        return day
+    
+    def next_bucket(self, day):
+        if self.unit == 'week':
+            return day + timedelta(days=7)
+        if self.unit == 'month':
+            return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return day + timedelta(days=1)
+    
+    def formats(self, session):
+        """
+        Returns:
+            how many characters of a timestamp to group by, and how to parse them.
+            mediawiki timestamps look like 20130601120000, sqlite's 2013-06-01 12:00:00
+        """
+        if session.bind.name == 'mysql':
+            if self.unit == 'month':
+                return 6, '%Y%m'
+            return 8, '%Y%m%d'
+        if self.unit == 'month':
+            return 7, '%Y-%m'
+        return 10, '%Y-%m-%d'
+    
+    def column(self, timestamp, session):
+        """
+        Parameters:
+            timestamp   : a timestamp column, like Revision.rev_timestamp
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            a sql expression labeled bucket, to add to the select and the group by
+        """
+        length, date_format = self.formats(session)
+        return label('bucket', func.substr(timestamp, 1, length))
+    
+    def bucket(self, value, session):
+        """
+        Returns:
+            the label of the bucket a value of column() falls in
+        """
+        length, date_format = self.formats(session)
+        return str(self.bucket_start(datetime.strptime(value, date_format).date()))
+    
+    def empty(self, names, default=0):
+        """
+        Returns:
+            the results of a user with nothing in any bucket
+        """
+        return dict((name, dict.fromkeys(self.buckets, default)) for name in names)
+    
+    def collect(self, rows, names, session):
+        """
+        Adds up query results by user and bucket
+        
+        Parameters:
+            rows    : (user_id, bucket, value, value, ...) rows of a query that
+                      grouped by column()
+            names   : the names of the values in each row
+            session : the session the query ran in
+        
+        Returns:
+            dictionary from user ids to their results, with all the buckets
+            filled in, only for the users in rows
+        """
+        results = {}
+        for row in rows:
+            user_id, bucket, values = row[0], self.bucket(row[1], session), row[2:]
+            if user_id not in results:
+                results[user_id] = self.empty(names)
+            for name, value in zip(names, values):
+                by_bucket = results[user_id][name]
+                by_bucket[bucket] = by_bucket.get(bucket, 0) + (value or 0)
+        return results
@@ -5,7 +5,9 @@ from cohort import *
 from cohort_user import *
 from cohort_wikiuser import *
 from persistent_report import *
+from report_result_chunk import *
 from user import *
+from user_daily_activity import *
 from wikiuser import *
 
 # ignore flake8 because of F403 violation
@@ -1,6 +1,7 @@
 import celery
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, func
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, case
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from wikimetrics.configurables import db
 
 
@@ -38,5 +39,76 @@ class PersistentReport(db.WikimetricsBase):
                 existing_session.add(self)
             existing_session.commit()
     
+    @classmethod
+    def update_statuses(cls, reports, session):
+        """
+        Like update_status, for many reports at once: the states of all the
+        unfinished tasks are fetched from the result backend in one round trip,
+        and the statuses that changed are written with a single UPDATE.
+        The reports' status attributes are updated without being marked as
+        changed, and nothing is committed, the caller has to commit session.
+        
+        Parameters:
+            reports : PersistentReport instances loaded in session
+            session : the sqlalchemy session to issue the UPDATE with
+        """
+        pending = [
+            report for report in reports
+            if report.queue_result_key
+            and report.status not in celery.states.READY_STATES
+        ]
+        if not pending:
+            return
+        
+        # TODO: inline import.  Can't import up above because of circular reference
+        from wikimetrics.models.report_nodes import Report
+        statuses = get_task_statuses(
+            Report.task,
+            [report.queue_result_key for report in pending]
+        )
+        
+        changed = {}
+        for report in pending:
+            status = statuses[report.queue_result_key]
+            if status != report.status:
+                changed[report.id] = status
+                set_committed_value(report, 'status', status)
+        if not changed:
+            return
+        
+        session.execute(
+            cls.__table__.update()
+            .where(cls.id.in_(changed.keys()))
+            .values(status=case(changed.items(), value=cls.id))
+        )
+    
     def __repr__(self):
         return '<PersistentReport("{0}")>'.format(self.id)
+
+
+def get_task_statuses(task, task_ids):
+    """
+    Parameters:
+        task        : the celery task whose results to look up
+        task_ids    : the ids of the task runs to get the state of
+    
+    Returns:
+        dictionary from each task id to its celery state.  With key/value
+        backends like redis, all of them are fetched with a single MGET.
+    """
+    backend = task.backend
+    if not hasattr(backend, 'mget') or not hasattr(backend, 'get_key_for_task'):
+        return {
+            task_id: task.AsyncResult(task_id).status
+            for task_id in task_ids
+        }
+    
+    values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    statuses = {}
+    for task_id, value in zip(task_ids, values):
+        if value:
+            statuses[task_id] = backend.decode(value)['status']
+        else:
+            # same as AsyncResult, tasks that the backend doesn't know about yet
+            statuses[task_id] = celery.states.PENDING
+    return statuses
@@ -1,7 +1,11 @@
 from aggregate_report import *
+from aggregation import *
+from metric_fusion import *
 from metric_report import *
+from metric_results import *
 from multi_project_metric_report import *
 from report import *
+from report_writer import *
 from run_report import *
 
 # ignore flake8 because of F403 violation
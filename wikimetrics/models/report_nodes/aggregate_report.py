@@ -1,22 +1,16 @@
-from decimal import Decimal
 from wikimetrics.utils import stringify
 from report import ReportNode
 from multi_project_metric_report import MultiProjectMetricReport
+from metric_results import MetricResults
+from aggregation import Aggregation, aggregate_columns
 from celery.utils.log import get_task_logger
 
 
-__all__ = ['AggregateReport', 'Aggregation']
+__all__ = ['AggregateReport']
 
 task_logger = get_task_logger(__name__)
 
 
-class Aggregation(object):
-    IND = 'Individual Results'
-    SUM = 'Sum'
-    AVG = 'Average'
-    STD = 'Standard Deviation'
-
-
 class AggregateReport(ReportNode):
     """
     Represents the output-shaping node that looks at a
@@ -26,8 +20,12 @@ class AggregateReport(ReportNode):
         * a sum of the individual results
         * an average over the individual results
         * the standard deviation over the individual results
+        * the minimum and maximum of the individual results
+        * the median of the individual results
+        * the 25th, 75th, 90th and 99th percentiles of the individual results
     
     Whether or not to return these is controlled by parameters passed to the constructor.
+    All the aggregates are computed together, see aggregate_columns.
     """
     
     show_in_ui = True
@@ -41,6 +39,9 @@ class AggregateReport(ReportNode):
         aggregate_sum=True,
         aggregate_average=False,
         aggregate_std_deviation=False,
+        aggregate_min_max=False,
+        aggregate_median=False,
+        aggregate_percentiles=False,
         *args,
         **kwargs
     ):
@@ -55,6 +56,9 @@ class AggregateReport(ReportNode):
         self.aggregate_sum = aggregate_sum
         self.aggregate_average = aggregate_average
         self.aggregate_std_deviation = aggregate_std_deviation
+        self.aggregate_min_max = aggregate_min_max
+        self.aggregate_median = aggregate_median
+        self.aggregate_percentiles = aggregate_percentiles
         
         self.children = [MultiProjectMetricReport(
             cohort,
@@ -65,24 +69,13 @@ class AggregateReport(ReportNode):
     def finish(self, result_dicts):
         aggregated_results = dict()
         result_values = [r.values() for r in result_dicts]
-        child_results = [result for sublist in result_values for result in sublist]
+        child_results = [
+            MetricResults.from_dict(result)
+            for sublist in result_values for result in sublist
+        ]
         
         if self.aggregate:
-            if self.aggregate_sum:
-                aggregated_results[Aggregation.SUM] = self.calculate(
-                    child_results,
-                    Aggregation.SUM
-                )
-            if self.aggregate_average:
-                aggregated_results[Aggregation.AVG] = self.calculate(
-                    child_results,
-                    Aggregation.AVG
-                )
-            if self.aggregate_std_deviation:
-                aggregated_results[Aggregation.STD] = self.calculate(
-                    child_results,
-                    Aggregation.STD
-                )
+            aggregated_results.update(aggregate_columns(child_results, self.aggregates()))
         
         if self.individual:
             aggregated_results[Aggregation.IND] = child_results
@@ -90,41 +83,27 @@ class AggregateReport(ReportNode):
         result = self.report_result(aggregated_results, child_results=result_dicts)
         return result
     
-    def calculate(self, list_of_results, type_of_aggregate):
-        # TODO: terrible redo this
-        aggregation = dict()
-        helper = dict()
-        for results_by_user in list_of_results:
-            for user_id in results_by_user.keys():
-                for key in results_by_user[user_id]:
-                    if not key in aggregation:
-                        aggregation[key] = 0
-                        helper[key] = dict()
-                        helper[key]['sum'] = Decimal(0.0)
-                        helper[key]['count'] = 0
-                    
-                    value = results_by_user[user_id][key]
-                    if not value:
-                        value = Decimal(0)
-                    
-                    helper[key]['sum'] += Decimal(value)
-                    helper[key]['count'] += 1
-                    
-                    if type_of_aggregate == Aggregation.SUM:
-                        aggregation[key] = round(
-                            helper[key]['sum'],
-                            4
-                        )
-                    elif type_of_aggregate == Aggregation.AVG:
-                        aggregation[key] = round(
-                            helper[key]['sum'] / helper[key]['count'],
-                            4
-                        )
-                    elif type_of_aggregate == Aggregation.STD:
-                        aggregation[key] = 'Not Implemented'
-                        pass
-        
-        return aggregation
+    def aggregates(self):
+        """
+        Returns:
+            the Aggregation constants this report was asked to compute
+        """
+        aggregates = []
+        if self.aggregate_sum:
+            aggregates.append(Aggregation.SUM)
+        if self.aggregate_average:
+            aggregates.append(Aggregation.AVG)
+        if self.aggregate_std_deviation:
+            aggregates.append(Aggregation.STD)
+        if self.aggregate_min_max:
+            aggregates.extend([Aggregation.MIN, Aggregation.MAX])
+        if self.aggregate_median:
+            aggregates.append(Aggregation.MED)
+        if self.aggregate_percentiles:
+            aggregates.extend([
+                Aggregation.P25, Aggregation.P75, Aggregation.P90, Aggregation.P99,
+            ])
+        return aggregates
     
     def __repr__(self):
         return '<AggregateReport("{0}")>'.format(self.persistent_id)
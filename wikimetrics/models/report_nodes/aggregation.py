@@ -0,0 +1,192 @@
+import math
+from array import array
+from collections import OrderedDict
+from itertools import chain
+
+try:
+    import numpy
+except ImportError:
+    # aggregates are computed in plain python then, just slower
+    numpy = None
+
+
+__all__ = ['Aggregation', 'aggregate_columns']
+
+
+class Aggregation(object):
+    IND = 'Individual Results'
+    SUM = 'Sum'
+    AVG = 'Average'
+    STD = 'Standard Deviation'
+    MIN = 'Minimum'
+    MAX = 'Maximum'
+    MED = 'Median'
+    P25 = '25th Percentile'
+    P75 = '75th Percentile'
+    P90 = '90th Percentile'
+    P99 = '99th Percentile'
+    
+    # all the aggregates, in the order they are shown
+    ALL = [SUM, AVG, STD, MIN, MAX, MED, P25, P75, P90, P99]
+    PERCENTILES = OrderedDict([(MED, 50), (P25, 25), (P75, 75), (P90, 90), (P99, 99)])
+
+
+def numeric_values(results, name):
+    """
+    Returns:
+        the values in column name of a MetricResults, as a typed array or a list
+        of floats with 0 for None (which is how reports have always counted
+        missing values), or None if the column is not numeric
+    """
+    if results.kinds[name] != 'object':
+        return results.columns[name]
+    
+    values = []
+    for value in results.columns[name]:
+        try:
+            values.append(float(value or 0))
+        except (TypeError, ValueError):
+            return None
+    return values
+
+
+def aggregate_columns(list_of_results, aggregates):
+    """
+    Computes the aggregates of every numeric column in list_of_results at once.
+    With numpy, each column is aggregated by numpy straight from the arrays
+    MetricResults keeps it in.  Without numpy, each column is walked in a single
+    loop that keeps all the running aggregates, and sorted once if a median or
+    percentile is needed.  Standard deviation is over the whole cohort, that is
+    the population standard deviation.
+    
+    Parameters:
+        list_of_results : list of MetricResults, a column can be in more than one
+        aggregates      : list of Aggregation constants to compute
+    
+    Returns:
+        dictionary of each aggregate to a dictionary of column name to the
+        aggregate's value, rounded to 4 decimal places.  Time series columns are
+        aggregated per bucket, into {column: {bucket: value}}
+    """
+    columns = OrderedDict()
+    for results in list_of_results:
+        for name in results.kinds:
+            values = numeric_values(results, name)
+            if values is not None:
+                columns.setdefault(name, []).append(values)
+    
+    if numpy is not None:
+        column_statistics = numpy_statistics
+    else:
+        column_statistics = python_statistics
+    
+    aggregated = dict((aggregate, {}) for aggregate in aggregates)
+    for name, parts in columns.items():
+        for aggregate, value in column_statistics(parts, aggregates).items():
+            if isinstance(name, tuple):
+                column, bucket = name
+                aggregated[aggregate].setdefault(column, {})[bucket] = round(value, 4)
+            else:
+                aggregated[aggregate][name] = round(value, 4)
+    return aggregated
+
+
+def numpy_statistics(parts, aggregates):
+    """
+    Parameters:
+        parts       : the values of one column, as a list of arrays or lists
+        aggregates  : list of Aggregation constants to compute
+    
+    Returns:
+        dictionary of aggregate to value, empty if there are no values
+    """
+    arrays = [as_numpy(part) for part in parts if len(part)]
+    if not arrays:
+        return {}
+    values = numpy.concatenate(arrays).astype('float64')
+    
+    statistics = {}
+    if Aggregation.SUM in aggregates:
+        statistics[Aggregation.SUM] = values.sum()
+    if Aggregation.AVG in aggregates:
+        statistics[Aggregation.AVG] = values.mean()
+    if Aggregation.STD in aggregates:
+        statistics[Aggregation.STD] = values.std()
+    if Aggregation.MIN in aggregates:
+        statistics[Aggregation.MIN] = values.min()
+    if Aggregation.MAX in aggregates:
+        statistics[Aggregation.MAX] = values.max()
+    
+    percentiles = [a for a in Aggregation.PERCENTILES if a in aggregates]
+    if percentiles:
+        # one sort for all the percentiles
+        computed = numpy.percentile(
+            values, [Aggregation.PERCENTILES[a] for a in percentiles]
+        )
+        statistics.update(zip(percentiles, computed))
+    
+    return dict((a, float(value)) for a, value in statistics.items())
+
+
+def as_numpy(part):
+    if isinstance(part, array):
+        # array typecodes are numpy type codes too, so this doesn't copy anything
+        return numpy.frombuffer(part, dtype=part.typecode)
+    return numpy.array(part, dtype='float64')
+
+
+def python_statistics(parts, aggregates):
+    """
+    Same as numpy_statistics, for when numpy is not installed
+    """
+    count = 0
+    total = 0
+    mean = 0.0
+    # sum of the squared differences from the mean, see Welford's algorithm
+    squares = 0.0
+    minimum = None
+    maximum = None
+    for value in chain(*parts):
+        count += 1
+        total += value
+        delta = value - mean
+        mean += delta / count
+        squares += delta * (value - mean)
+        if minimum is None or value < minimum:
+            minimum = value
+        if maximum is None or value > maximum:
+            maximum = value
+    
+    if not count:
+        return {}
+    
+    statistics = {
+        Aggregation.SUM : total,
+        Aggregation.AVG : total / float(count),
+        Aggregation.STD : math.sqrt(squares / count),
+        Aggregation.MIN : minimum,
+        Aggregation.MAX : maximum,
+    }
+    percentiles = [a for a in Aggregation.PERCENTILES if a in aggregates]
+    if percentiles:
+        ordered = sorted(chain(*parts))
+        for aggregate in percentiles:
+            statistics[aggregate] = percentile(
+                ordered, Aggregation.PERCENTILES[aggregate]
+            )
+    
+    return dict((a, float(statistics[a])) for a in aggregates if a in statistics)
+
+
+def percentile(ordered, percent):
+    """
+    Interpolates between the two closest values, like numpy.percentile does
+    
+    Parameters:
+        ordered : a sorted list of values
+        percent : between 0 and 100
+    """
+    position = (len(ordered) - 1) * percent / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
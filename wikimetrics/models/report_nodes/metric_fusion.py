@@ -0,0 +1,91 @@
+from threading import Lock
+from wikimetrics.metrics.revision_activity import RevisionActivity
+from wikimetrics.metrics.daily_activity_store import DailyActivityStore
+from metric_report import MetricReport
+
+
+__all__ = ['FusedMetric', 'fuse_metric_reports']
+
+
+class FusedMetric(object):
+    """
+    Shared by MetricReports whose metrics RevisionActivity can compute together,
+    because they run on the same users, project, dates, and namespaces.
+    The first of those reports to run computes the results for all of them,
+    and each report then picks out its own results with Metric.split_fused.
+    """
+    
+    def __init__(self, metric):
+        self.metric = metric
+        self.results = None
+        self.lock = Lock()
+    
+    def __getstate__(self):
+        # reports are pickled to be sent through celery, and locks can't be pickled
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+    
+    def run(self, report):
+        """
+        Parameters:
+            report  : one of the MetricReports sharing this FusedMetric
+        
+        Returns:
+            the results of report.metric, as if it had been run by itself
+        """
+        with self.lock:
+            if self.results is None:
+                self.results = report.calculate(self.metric)
+        
+        return {
+            user_id: report.metric.split_fused(self.results.get(user_id))
+            for user_id in report.user_ids
+        }
+
+
+def find_metric_reports(report):
+    """
+    Yields all the MetricReports in the tree under report
+    """
+    if isinstance(report, MetricReport):
+        yield report
+    for child in report.children:
+        for metric_report in find_metric_reports(child):
+            yield metric_report
+
+
+def fuse_metric_reports(report):
+    """
+    Plans the tree under report so that compatible metrics are computed in a
+    single query.  MetricReports are compatible if their metrics are fusable and
+    they run on the same project, users, dates, and namespaces.  Each group of
+    two or more compatible MetricReports gets one FusedMetric to share.
+    When the DailyActivityStore is on, single reports get one too, so that
+    they read from the store.
+    
+    Parameters:
+        report  : the root of a tree of reports, usually a RunReport
+    """
+    groups = {}
+    for metric_report in find_metric_reports(report):
+        if not metric_report.metric.fusable:
+            continue
+        key = (
+            metric_report.project,
+            tuple(sorted(set(metric_report.user_ids))),
+            RevisionActivity.fusion_key(metric_report.metric),
+        )
+        groups.setdefault(key, []).append(metric_report)
+    
+    store_enabled = DailyActivityStore.enabled()
+    for metric_reports in groups.values():
+        if len(metric_reports) < 2 and not store_enabled:
+            continue
+        fused = FusedMetric(RevisionActivity.for_metric(metric_reports[0].metric))
+        for metric_report in metric_reports:
+            metric_report.fused = fused
@@ -1,26 +1,166 @@
+from sqlalchemy.exc import SQLAlchemyError
+from celery.utils.log import get_task_logger
 from wikimetrics.configurables import db
-from report import ReportLeaf
+from wikimetrics.cache import get_metric_cache, metric_cache_key
+from wikimetrics.metrics.temporary_user_table import TemporaryUserTable
+from wikimetrics.metrics.revision_activity import RevisionActivity
+from wikimetrics.metrics.daily_activity_store import DailyActivityStore
+from wikimetrics.result_store import save_result, load_result, delete_results
+from report import ReportLeaf, checkpoint_key
+from metric_results import MetricResults
 
 
 __all__ = ['MetricReport']
 
+task_logger = get_task_logger(__name__)
+
 
 class MetricReport(ReportLeaf):
     """
     Report type responsbile for running a single metric on a project-
     homogenous list of user_ids.  Like all reports, the database session
     is constructed within MetricReport.run()
+    
+    For big cohorts, the user_ids are loaded into a temporary table that the
+    metric joins to, instead of being sent in IN clauses.  By default this
+    happens for more than TEMPORARY_TABLE_THRESHOLD users, and it can be forced
+    either way with use_temporary_table.
+    
+    RevisionActivity metrics read from the DailyActivityStore when
+    DAILY_ACTIVITY_STORE is turned on, unless they are split into a time series.
+    
+    The results are returned as MetricResults, to keep them small on their way
+    up the report tree.
+    
+    When reports can be resumed (see REPORT_MAX_RESUMES), each batch of users the
+    metric is calculated on is checkpointed, so a resumed report only calculates
+    the batches it didn't get to.  Users in a temporary table are all queried at
+    once, so there is nothing to checkpoint until the whole report is done.
     """
     
-    def __init__(self, metric, user_ids, project):
+    def __init__(self, metric, user_ids, project, use_temporary_table=None):
         super(MetricReport, self).__init__()
         self.metric = metric
         self.user_ids = list(user_ids)
         self.project = project
+        self.use_temporary_table = use_temporary_table
+        # set when this report shares its computation, see metric_fusion
+        self.fused = None
+    
+    def wants_temporary_table(self):
+        if self.use_temporary_table is not None:
+            return self.use_temporary_table
+        
+        threshold = db.config.get('TEMPORARY_TABLE_THRESHOLD')
+        return bool(threshold) and len(self.user_ids) > threshold
     
     def run(self):
-        session = db.get_mw_session(self.project)
-        return self.metric(self.user_ids, session)
+        if self.fused:
+            results = self.fused.run(self)
+        else:
+            results = self.calculate(self.metric)
+        return MetricResults.from_dict(results, self.project)
+    
+    def calculate(self, metric):
+        """
+        Runs the metric passed in on this report's user_ids and project,
+        unless the same computation is in the metric cache.
+        
+        Parameters:
+            metric  : usually self.metric, but fused reports pass a metric
+                      that computes their results together
+        
+        Returns:
+            the metric's results
+        """
+        cache = get_metric_cache()
+        if cache is None:
+            return self.query(metric)
+        
+        key = metric_cache_key(self.project, metric, self.user_ids)
+        results = cache.get(key)
+        if results is None:
+            results = self.query(metric)
+            cache.set(key, results)
+        return results
+    
+    def query(self, metric):
+        """
+        Runs the metric passed in on the mediawiki database for this report's
+        project, joining to a temporary table of user_ids if needed.
+        """
+        with db.get_mw_host_slot(self.project):
+            session = db.get_mw_session(self.project)
+            user_ids = self.user_ids
+            user_table = None
+            if self.wants_temporary_table():
+                try:
+                    user_table = TemporaryUserTable(session, self.user_ids)
+                    user_table.create()
+                    user_ids = user_table
+                except SQLAlchemyError:
+                    # for example, not allowed to create temporary tables
+                    task_logger.exception('falling back to IN clauses for {0}'.format(
+                        self.project
+                    ))
+                    session.rollback()
+                    user_table = None
+            
+            try:
+                if (isinstance(metric, RevisionActivity)
+                        and DailyActivityStore.enabled()
+                        and not metric.get_time_series()):
+                    store = DailyActivityStore(self.project)
+                    return store.revision_activity(metric, user_ids, session)
+                checkpoint = None
+                if db.config.get('REPORT_MAX_RESUMES', 0):
+                    checkpoint = BatchCheckpoint(self)
+                return metric(user_ids, session, checkpoint=checkpoint)
+            finally:
+                if user_table is not None:
+                    user_table.drop()
+                session.close()
+    
+    def save_checkpoint(self, result):
+        super(MetricReport, self).save_checkpoint(result)
+        # the whole result is checkpointed now, the batches aren't needed anymore
+        delete_results(self.batch_checkpoint_keys())
+    
+    def checkpoint_keys(self):
+        return super(MetricReport, self).checkpoint_keys() + self.batch_checkpoint_keys()
+    
+    def batch_checkpoint_keys(self):
+        batch_size = db.config.get('METRIC_BATCH_SIZE')
+        if not batch_size:
+            return []
+        batches = (len(self.user_ids) + batch_size - 1) // batch_size
+        return [batch_checkpoint_key(self, index) for index in range(batches)]
     
     def __repr__(self):
         return '<MetricReport("{0}")>'.format(self.persistent_id)
+
+
+def batch_checkpoint_key(report, index):
+    return '{0}-{1}'.format(checkpoint_key(report), index)
+
+
+class BatchCheckpoint(object):
+    """
+    Checkpoints the batches of users a MetricReport's metric is calculated on,
+    see Metric.__call__
+    """
+    
+    def __init__(self, report):
+        self.report = report
+    
+    def load(self, index):
+        return load_result(batch_checkpoint_key(self.report, index))
+    
+    def save(self, index, results):
+        try:
+            save_result(batch_checkpoint_key(self.report, index), results)
+        except SQLAlchemyError:
+            # a thread left over from the last slice could have saved it already
+            task_logger.exception('could not checkpoint batch {0} of {1}'.format(
+                index, self.report
+            ))
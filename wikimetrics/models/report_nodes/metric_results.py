@@ -0,0 +1,380 @@
+from array import array
+from collections import OrderedDict
+from decimal import Decimal
+
+
+__all__ = ['MetricResults']
+
+
+# what each kind of column is stored in, 'object' columns are plain lists
+TYPECODES = {
+    'bool'  : 'b',
+    'int'   : 'l',
+    'float' : 'd',
+}
+
+
+def value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, long)):
+        return 'int'
+    if isinstance(value, (float, Decimal)):
+        return 'float'
+    return 'object'
+
+
+def merge_kinds(first, second):
+    """
+    Returns:
+        the kind of column that can hold values of both kinds
+    """
+    if first is None or first == second:
+        return second
+    if second is None:
+        return first
+    kinds = set([first, second])
+    if kinds == set(['bool', 'int']):
+        return 'int'
+    if 'object' not in kinds:
+        return 'float'
+    return 'object'
+
+
+def column_kind(values):
+    kind = None
+    for value in values:
+        if value is not None:
+            kind = merge_kinds(kind, value_kind(value))
+            if kind == 'object':
+                break
+    return kind or 'object'
+
+
+def make_column(kind, values):
+    """
+    Parameters:
+        kind    : the column_kind of values
+        values  : the values of the column, with None for missing ones
+    
+    Returns:
+        (kind, column, nulls) where column is a typed array, with 0 in place of
+        None, unless the values don't fit one.  Then it's a list of the values.
+        nulls is the set of rows that are None
+    """
+    nulls = set()
+    if kind != 'object':
+        converted = []
+        for row, value in enumerate(values):
+            if value is None:
+                nulls.add(row)
+                value = 0
+            elif kind == 'float':
+                value = float(value)
+            converted.append(value)
+        try:
+            return (kind, array(TYPECODES[kind], converted), nulls)
+        except OverflowError:
+            # ints bigger than a C long
+            nulls = set()
+    
+    return ('object', list(values), nulls)
+
+
+# the smaller typecodes a column is pickled as, if its values fit
+PACKED_TYPECODES = {
+    'l' : ('b', 'h', 'i'),
+    'd' : ('f',),
+}
+
+
+def pack_column(column):
+    """
+    Returns:
+        (typecode, packed typecode, bytes) for an array, stored in the smallest
+        typecode that holds its values exactly.  Lists are returned as they are.
+    """
+    if not isinstance(column, array):
+        return column
+    
+    values = column.tolist()
+    for typecode in PACKED_TYPECODES.get(column.typecode, ()):
+        try:
+            packed = array(typecode, values)
+        except OverflowError:
+            continue
+        if packed.tolist() == values:
+            return (column.typecode, typecode, packed.tostring())
+    return (column.typecode, column.typecode, column.tostring())
+
+
+def unpack_column(packed):
+    if not isinstance(packed, tuple):
+        return packed
+    
+    typecode, packed_typecode, data = packed
+    column = array(packed_typecode)
+    column.fromstring(data)
+    if packed_typecode != typecode:
+        column = array(typecode, column)
+    return column
+
+
+def flatten(values):
+    """
+    Time series metrics return a dictionary of bucket to value for each of
+    their values.  Each bucket gets its own column, named (name, bucket).
+    """
+    flat = OrderedDict()
+    for name, value in values.items():
+        if isinstance(value, dict):
+            for bucket in sorted(value):
+                flat[(name, bucket)] = value[bucket]
+        else:
+            flat[name] = value
+    return flat
+
+
+class MetricResults(object):
+    """
+    The results of a metric for a list of users, kept as columns: an array of
+    user_ids and one typed array per value the metric computes, instead of a
+    dictionary for each user.  This is a lot smaller, in memory and pickled,
+    which matters because results are passed up the report tree and sent
+    through celery and the result store.
+    
+    It reads like the {user_id: {column: value}} dictionaries metrics return,
+    building each user's dictionary when it's asked for, and to_dict converts
+    it back to one for the API.  The project each row came from is kept too.
+    Time series values, {column: {bucket: value}}, are kept in one column per
+    bucket, named (column, bucket).
+    
+    Parameters:
+        user_ids    : one user_id per row, unique
+        columns     : OrderedDict of column name to (kind, column, nulls), as
+                      returned by make_column
+        projects    : list of (project, number of rows), in the order of the rows
+    """
+    
+    def __init__(self, user_ids, columns, projects=None):
+        kind, self.user_ids, nulls = make_column(column_kind(user_ids), user_ids)
+        if nulls:
+            # the odd None user_id
+            self.user_ids = list(user_ids)
+        self.kinds = OrderedDict()
+        self.columns = {}
+        self.nulls = {}
+        for name, (kind, column, nulls) in columns.items():
+            self.kinds[name] = kind
+            self.columns[name] = column
+            if nulls:
+                self.nulls[name] = nulls
+        self.projects = projects or [(None, len(self.user_ids))]
+        self.positions = None
+    
+    def __getstate__(self):
+        """
+        Python 2.7 pickles arrays as lists of numbers, so columns are pickled as
+        their bytes instead, see pack_column, and the rows that are None as
+        arrays too
+        """
+        state = self.__dict__.copy()
+        state['positions'] = None
+        state['user_ids'] = pack_column(self.user_ids)
+        state['columns'] = dict(
+            (name, pack_column(column)) for name, column in self.columns.items()
+        )
+        state['nulls'] = dict(
+            (name, pack_column(array('l', sorted(rows))))
+            for name, rows in self.nulls.items()
+        )
+        return state
+    
+    def __setstate__(self, state):
+        state['user_ids'] = unpack_column(state['user_ids'])
+        state['columns'] = dict(
+            (name, unpack_column(column)) for name, column in state['columns'].items()
+        )
+        state['nulls'] = dict(
+            (name, set(unpack_column(rows))) for name, rows in state['nulls'].items()
+        )
+        self.__dict__.update(state)
+    
+    @classmethod
+    def from_dict(cls, results, project=None):
+        """
+        Parameters:
+            results : dictionary of user_id to a dictionary of values, as
+                      metrics return them, or a MetricResults
+            project : the project the users belong to
+        """
+        if isinstance(results, MetricResults):
+            return results
+        
+        user_ids = results.keys()
+        rows = [flatten(results[user_id] or {}) for user_id in user_ids]
+        names = []
+        for row in rows:
+            for name in row:
+                if name not in names:
+                    names.append(name)
+        
+        columns = OrderedDict()
+        for name in names:
+            values = [row.get(name) for row in rows]
+            columns[name] = make_column(column_kind(values), values)
+        return cls(user_ids, columns, [(project, len(user_ids))])
+    
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Combines the results of reports on different users.  If the same
+        user_id shows up more than once, the last part's row is kept, just
+        like updating one dictionary with the others would.
+        
+        Parameters:
+            parts   : list of MetricResults or result dictionaries
+        """
+        parts = [cls.from_dict(part) for part in parts]
+        if len(parts) == 1:
+            return parts[0]
+        
+        keep = None
+        if len(set(u for part in parts for u in part.user_ids)) < sum(map(len, parts)):
+            kept = {}
+            for index, part in enumerate(parts):
+                for row, user_id in enumerate(part.user_ids):
+                    kept[user_id] = (index, row)
+            keep = set(kept.values())
+        
+        def rows(part_index, part, values):
+            if keep is None:
+                return values
+            return [v for row, v in enumerate(values) if (part_index, row) in keep]
+        
+        user_ids = []
+        projects = []
+        for index, part in enumerate(parts):
+            user_ids.extend(rows(index, part, part.user_ids))
+            start = 0
+            for project, count in part.projects:
+                kept_rows = rows(index, part, range(start, start + count))
+                projects.append((project, len(kept_rows)))
+                start += count
+        
+        names = []
+        kinds = {}
+        for part in parts:
+            for name, kind in part.kinds.items():
+                if name not in kinds:
+                    names.append(name)
+                kinds[name] = merge_kinds(kinds.get(name), kind)
+        
+        columns = OrderedDict()
+        for name in names:
+            values = []
+            for index, part in enumerate(parts):
+                values.extend(rows(index, part, part.column(name)))
+            columns[name] = make_column(kinds[name], values)
+        return cls(user_ids, columns, projects)
+    
+    def column(self, name):
+        """
+        Returns:
+            the values in column name as a list, with None where values are missing
+        """
+        if name not in self.columns:
+            return [None] * len(self.user_ids)
+        
+        values = list(self.columns[name])
+        if self.kinds[name] == 'bool':
+            values = map(bool, values)
+        for row in self.nulls.get(name, ()):
+            values[row] = None
+        return values
+    
+    def row(self, row):
+        values = {}
+        for name, kind in self.kinds.items():
+            if row in self.nulls.get(name, ()):
+                value = None
+            elif kind == 'bool':
+                value = bool(self.columns[name][row])
+            else:
+                value = self.columns[name][row]
+            
+            if isinstance(name, tuple):
+                name, bucket = name
+                values.setdefault(name, {})[bucket] = value
+            else:
+                values[name] = value
+        return values
+    
+    def position(self, user_id):
+        if self.positions is None:
+            self.positions = dict((u, row) for row, u in enumerate(self.user_ids))
+        return self.positions[user_id]
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    def __iter__(self):
+        return iter(self.user_ids)
+    
+    def __contains__(self, user_id):
+        try:
+            self.position(user_id)
+            return True
+        except KeyError:
+            return False
+    
+    def __getitem__(self, user_id):
+        return self.row(self.position(user_id))
+    
+    def get(self, user_id, default=None):
+        if user_id in self:
+            return self[user_id]
+        return default
+    
+    def keys(self):
+        return list(self.user_ids)
+    
+    def iteritems(self):
+        for row, user_id in enumerate(self.user_ids):
+            yield (user_id, self.row(row))
+    
+    def items(self):
+        return list(self.iteritems())
+    
+    def values(self):
+        return [self.row(row) for row in range(len(self.user_ids))]
+    
+    def to_dict(self):
+        """
+        Returns:
+            the {user_id: {column: value}} dictionary the metric would have returned
+        """
+        return dict(self.iteritems())
+    
+    def __eq__(self, other):
+        if isinstance(other, MetricResults):
+            other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __repr__(self):
+        return '<MetricResults({0} users, {1})>'.format(
+            len(self.user_ids), ', '.join(map(column_label, self.kinds.keys()))
+        )
+
+
+def column_label(name):
+    """
+    Returns:
+        the name of a column as a string, 'edits 2013-06-01' for time series
+    """
+    if isinstance(name, tuple):
+        return ' '.join(map(unicode, name))
+    return name
@@ -1,6 +1,7 @@
 from celery.utils.log import get_task_logger
 from report import ReportNode
 from metric_report import MetricReport
+from metric_results import MetricResults
 
 
 __all__ = ['MultiProjectMetricReport']
@@ -14,8 +15,11 @@ class MultiProjectMetricReport(ReportNode):
     project-heterogenous cohort. This just abstracts away the task
     of grouping the cohort by project and calling a MetricReport on
     each project-homogenous list of user_ids.
+    The projects are usually on different database hosts, so the
+    MetricReport children run in parallel.
     """
     show_in_ui = False
+    parallel_children = True
     
     def __init__(self, cohort, metric, *args, **kwargs):
         super(MultiProjectMetricReport, self).__init__(
@@ -31,10 +35,8 @@ class MultiProjectMetricReport(ReportNode):
             self.children.append(MetricReport(metric, user_ids, project))
     
     def finish(self, metric_results):
-        merged_individual_results = {}
         # TODO: handle collisions where the same ID is used accross projects
-        for res in metric_results:
-            merged_individual_results.update(res)
+        merged_individual_results = MetricResults.concatenate(metric_results)
         
         result = self.report_result(merged_individual_results)
         return result
@@ -5,11 +5,17 @@ from celery import current_task
 from celery.result import AsyncResult
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
+from sqlalchemy.exc import SQLAlchemyError
 # This is the hack you need if you use instance methods as celery tasks
 # from celery.contrib.methods import task_method
 from flask.ext.login import current_user
 from wikimetrics.configurables import db, queue
+from wikimetrics.utils import parallel_map
+from wikimetrics.report_status import publish_report_status
+from wikimetrics.fair_share import report_finished
+from wikimetrics.result_store import save_result, load_result, delete_results
 from ..persistent_report import PersistentReport
+from report_writer import ReportWriter
 
 
 __all__ = [
@@ -33,6 +39,13 @@ Specifically, we distinguish between `ReportLeaf` instances, which have no
 subreports, and `ReportNode` isntances, which require their children to be
 excecuted first, before carrying out their task.  Computing a simple
 metric would be a `ReportLeaf`, whereas any aggregator would be a `ReportNode`
+
+The result of each child report is checkpointed as soon as it's done, under the
+child's persistent_id, and so is each batch of users a MetricReport computes its
+metric on.  When a report runs past celery's soft time limit, the task is
+retried, up to REPORT_MAX_RESUMES times, and the retry picks up the checkpointed
+results instead of computing them again.  So big reports finish in several
+slices of at most the time limit, instead of failing.
 """
 
 
@@ -46,13 +59,97 @@ def queue_task(report):
         report,
         current_task.request.id,
     ))
-    return report.run()
+    resuming = False
+    try:
+        result = report.run()
+        delete_checkpoints(report)
+        return result
+    except SoftTimeLimitExceeded as exc:
+        max_resumes = db.config.get('REPORT_MAX_RESUMES', 0)
+        if current_task.request.retries < max_resumes:
+            # same task id, so whoever waits on the task gets the final result
+            task_logger.info('resuming {0} in a new slice'.format(report))
+            resuming = True
+            raise queue_task.retry(
+                args=[report],
+                exc=exc,
+                countdown=0,
+                max_retries=max_resumes,
+            )
+        task_logger.error('timeout exceeded for {0}'.format(report))
+        # the reports that were still running failed with it
+        for node in report_tree(report):
+            if node is report or node.status == celery.states.STARTED:
+                node.set_status(celery.states.FAILURE)
+        delete_checkpoints(report)
+        raise
+    except Exception:
+        # so the failure shows up without waiting for the status to be refreshed
+        report.set_status(celery.states.FAILURE)
+        raise
+    finally:
+        # write whatever the report tree buffered, see ReportWriter
+        if report.writer is not None:
+            report.writer.flush()
+        # let the next report in line run, see wikimetrics.fair_share
+        if not resuming:
+            report_finished(report)
+
+
+def run_report(report):
+    """
+    Module level helper so report.run can be mapped over a thread pool.
+    If reports can be resumed, the result is checkpointed, and a checkpointed
+    result is returned without running the report again.
+    """
+    if not db.config.get('REPORT_MAX_RESUMES', 0):
+        return report.run()
+    
+    result = report.load_checkpoint()
+    if result is None:
+        result = report.run()
+        try:
+            report.save_checkpoint(result)
+        except SQLAlchemyError:
+            # a thread left over from the last slice could have saved it already
+            task_logger.exception('could not checkpoint {0}'.format(report))
+    return result
+
+
+def checkpoint_key(report):
+    return 'checkpoint-{0}'.format(report.persistent_id)
+
+
+def report_tree(report):
+    """
+    Yields report and all the reports under it
+    """
+    yield report
+    for child in report.children or []:
+        for node in report_tree(child):
+            yield node
+
+
+def delete_checkpoints(report):
+    """
+    Deletes the checkpoints of the reports under report, once it's done with them
+    """
+    if not db.config.get('REPORT_MAX_RESUMES', 0):
+        return
+    try:
+        delete_results([
+            key for node in report_tree(report) for key in node.checkpoint_keys()
+        ])
+    except SQLAlchemyError:
+        task_logger.exception('could not delete the checkpoints of {0}'.format(report))
 
 
 class Report(object):
     
     show_in_ui = False
     task = queue_task
+    # set when the report is part of a tree saved by a ReportWriter
+    writer = None
     
     def __init__(self,
                  user_id=None,
@@ -84,11 +181,17 @@ class Report(object):
                               name=self.name,
                               show_in_ui=self.show_in_ui,
                               parameters=parameters)
-        db_session = db.get_session()
-        db_session.add(pj)
-        db_session.commit()
-        self.persistent_id = pj.id
-        db_session.close()
+        self.writer = ReportWriter.current()
+        if self.writer is not None:
+            # inserted with the rest of the report tree, see ReportWriter
+            self.persistent_id = None
+            self.writer.insert(self, pj)
+        else:
+            db_session = db.get_session()
+            db_session.add(pj)
+            db_session.commit()
+            self.persistent_id = pj.id
+            db_session.close()
     
     def __repr__(self):
         return '<Report("{0}")>'.format(self.persistent_id)
@@ -96,13 +199,33 @@ class Report(object):
     def set_status(self, status, task_id=None):
         """
         helper function for updating database status after celery
-        task has been started
+        task has been started.  Changes to reports shown in the UI are pushed
+        to the browser, see wikimetrics.report_status
+        """
+        self.status = status
+        values = {'status': status}
+        if task_id:
+            values['queue_result_key'] = task_id
+        self.save(values)
+        if self.show_in_ui:
+            publish_report_status(self.user_id, self.persistent_id, status)
+    
+    def save(self, values):
         """
+        Writes values to this report's PersistentReport row.  Reports built with a
+        ReportWriter buffer the changes, except for the ones shown in the UI.
+        
+        Parameters:
+            values  : dictionary of PersistentReport columns to their new values
+        """
+        if self.writer is not None:
+            self.writer.update(self, values, immediate=self.show_in_ui)
+            return
+        
         db_session = db.get_session()
         pj = db_session.query(PersistentReport).get(self.persistent_id)
-        pj.status = status
-        if task_id:
-            pj.queue_result_key = task_id
+        for column, value in values.items():
+            setattr(pj, column, value)
         db_session.add(pj)
         db_session.commit()
         db_session.close()
@@ -112,10 +235,30 @@ class Report(object):
         each report subclass should implement this method to do the
         meat of the task.  The return type can be anything"""
         pass
+    
+    def load_checkpoint(self):
+        """
+        Returns:
+            the result an earlier slice of the task checkpointed, or None
+        """
+        return load_result(checkpoint_key(self))
+    
+    def save_checkpoint(self, result):
+        save_result(checkpoint_key(self), result)
+    
+    def checkpoint_keys(self):
+        """
+        Returns:
+            the result keys this report's checkpoints can be saved under
+        """
+        return [checkpoint_key(self)]
 
 
 class ReportNode(Report):
     
+    # whether children can be run in parallel threads, see run_children
+    parallel_children = False
+    
     def run(self):
         """
         This specialized version of run first runs all the children, then
@@ -127,23 +270,61 @@ class ReportNode(Report):
         and passes them to the finish method.  Deadlocking and celery worker starvation
         are *much* less likely now.  Thank you Ori :)
         """
-        self.set_status(celery.states.STARTED, task_id=current_task.request.id)
+        # children running in their own threads have no current_task,
+        # so they use the queue_result_key handed down by their parent
+        if current_task:
+            self.queue_result_key = current_task.request.id
+        self.set_status(celery.states.STARTED, task_id=self.queue_result_key)
         results = []
         
         if self.children:
-            try:
-                child_results = [child.run() for child in self.children]
-                results = self.finish(child_results)
-            except SoftTimeLimitExceeded:
-                self.set_status(celery.states.FAILURE)
-                task_logger.error('timeout exceeded for {0}'.format(
-                    current_task.request.id
-                ))
-                raise
+            # a SoftTimeLimitExceeded goes up to queue_task, which either
+            # resumes the report or marks it failed
+            child_results = self.run_children()
+            results = self.finish(child_results)
         
         self.set_status(celery.states.SUCCESS)
         return results
     
+    def run_children(self):
+        """
+        Runs all the children and returns their results in the same order.
+        If parallel_children is set, the children run in a pool of up to
+        REPORT_MAX_THREADS threads.  Children that query mediawiki limit
+        themselves per database host (see Database.get_mw_host_slot) so a
+        cohort spread over many projects doesn't overwhelm any one host.
+        """
+        for child in self.children:
+            child.queue_result_key = self.queue_result_key
+        
+        max_threads = 1
+        if self.parallel_children:
+            max_threads = db.config.get('REPORT_MAX_THREADS', 1)
+        
+        return parallel_map(run_report, self.children, max_threads)
+    
+    def load_checkpoint(self):
+        checkpoint = super(ReportNode, self).load_checkpoint()
+        if not isinstance(checkpoint, dict):
+            return checkpoint
+        
+        result = {}
+        for result_key in checkpoint['result_keys']:
+            result[result_key] = load_result(result_key)
+            if result[result_key] is None:
+                return None
+        return result
+    
+    def save_checkpoint(self, result):
+        """
+        report_result already saved the results this node passes up, each under
+        its result_key, so only those keys are checkpointed
+        """
+        # without children there is no result_key, and nothing to save anyway
+        if isinstance(result, dict):
+            result = {'result_keys': result.keys()}
+        super(ReportNode, self).save_checkpoint(result)
+    
     def finish(self, results):
         """
         Each ReportNode sublcass should implement this method to deal with
@@ -154,8 +335,9 @@ class ReportNode(Report):
     
     def report_result(self, results, child_results=[]):
         """
-        Creates a unique identifier for this ReportNode, and returns a one element
-        dictionary with that identifier as the key and its results as the value.
+        Creates a unique identifier for this ReportNode, saves the results under it
+        in the result store, and returns a one element dictionary with that
+        identifier as the key and its results as the value.
         This allows ReportNode results to be merged as the tree of ReportNodes is
         evaluated.
         
@@ -166,12 +348,9 @@ class ReportNode(Report):
                               that are copied should not be preserved.
         """
         self.result_key = str(uuid4())
-        db_session = db.get_session()
-        pj = db_session.query(PersistentReport).get(self.persistent_id)
-        pj.result_key = self.result_key
-        db_session.add(pj)
-        db_session.commit()
-        db_session.close()
+        # saved before the result_key, so the result is there once the key is
+        save_result(self.result_key, results)
+        self.save({'result_key': self.result_key})
         
         merged = {self.result_key: results}
         for child_result in child_results:
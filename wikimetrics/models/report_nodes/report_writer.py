@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from threading import Lock, local
+from uuid import uuid4
+from sqlalchemy import case
+from wikimetrics.configurables import db
+from ..persistent_report import PersistentReport
+
+
+__all__ = ['ReportWriter']
+
+
+class ReportWriter(object):
+    """
+    A unit of work for the PersistentReport rows of a whole report tree.
+    Reports created inside `with ReportWriter():` are inserted together in one
+    multi-row INSERT when the block ends, instead of one transaction each.
+    Later, their status and result_key changes are buffered and written in a few
+    batched UPDATEs, either when a report shown in the UI changes (so the UI
+    never lags behind) or when the tree is done running (see queue_task).
+    Reports created outside of a ReportWriter still write right away.
+    """
+    
+    context = local()
+    
+    def __init__(self):
+        self.inserts = []
+        self.updates = OrderedDict()
+        self.updates_lock = Lock()
+        self.flush_lock = Lock()
+        self.previous = None
+    
+    def __getstate__(self):
+        # reports are pickled to be sent through celery, and locks can't be pickled
+        state = self.__dict__.copy()
+        del state['updates_lock']
+        del state['flush_lock']
+        state['previous'] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.updates_lock = Lock()
+        self.flush_lock = Lock()
+    
+    @classmethod
+    def current(cls):
+        """
+        Returns:
+            the ReportWriter new reports in this thread should use, or None
+        """
+        return getattr(cls.context, 'writer', None)
+    
+    def __enter__(self):
+        self.previous = ReportWriter.current()
+        ReportWriter.context.writer = self
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        ReportWriter.context.writer = self.previous
+        self.previous = None
+        # nothing is saved for a report tree that couldn't be built
+        if exc_type is None:
+            self.flush_inserts()
+        else:
+            self.inserts = []
+    
+    def insert(self, report, persistent_report):
+        """
+        Queues persistent_report to be inserted, report.persistent_id is set then
+        """
+        self.inserts.append((report, persistent_report))
+    
+    def flush_inserts(self):
+        """
+        Inserts the queued rows with one executemany, and reads their ids back in
+        one query.  The ORM would insert them one at a time, to get each id.
+        To find the rows again, each one gets a tag in queue_result_key, which
+        is cleared before the transaction commits.
+        """
+        if not self.inserts:
+            return
+        
+        table = PersistentReport.__table__
+        # fits in queue_result_key, String(50)
+        tag = 'writer-{0}-'.format(uuid4().hex)
+        # the id and created are left to the database
+        columns = [
+            column.name for column in table.columns
+            if not column.primary_key and column.default is None
+        ]
+        rows = []
+        for index, (report, pj) in enumerate(self.inserts):
+            row = dict((column, getattr(pj, column)) for column in columns)
+            row['queue_result_key'] = tag + str(index)
+            rows.append(row)
+        
+        db_session = db.get_session()
+        try:
+            db_session.execute(table.insert(), rows)
+            ids = dict(db_session.execute(
+                table.select()
+                .with_only_columns([table.c.queue_result_key, table.c.id])
+                .where(table.c.queue_result_key.like(tag + '%'))
+            ).fetchall())
+            db_session.execute(
+                table.update()
+                .where(table.c.id.in_(ids.values()))
+                .values(queue_result_key=None)
+            )
+            db_session.commit()
+        finally:
+            db_session.close()
+        
+        for index, (report, pj) in enumerate(self.inserts):
+            report.persistent_id = ids[tag + str(index)]
+        self.inserts = []
+    
+    def update(self, report, values, immediate=False):
+        """
+        Buffers changes to the PersistentReport row of report
+        
+        Parameters:
+            report      : a report created with this writer
+            values      : dictionary of PersistentReport columns to their new values
+            immediate   : write this and everything buffered before it right away
+        """
+        with self.updates_lock:
+            self.updates.setdefault(report.persistent_id, {}).update(values)
+        if immediate:
+            self.flush()
+    
+    def flush(self):
+        """
+        Writes the buffered changes in one transaction, with one UPDATE for each
+        set of columns changed, for example one for all the rows that only
+        changed status.
+        """
+        with self.flush_lock:
+            with self.updates_lock:
+                updates, self.updates = self.updates, OrderedDict()
+            if not updates:
+                return
+            
+            ids_by_columns = OrderedDict()
+            for persistent_id, values in updates.items():
+                columns = tuple(sorted(values.keys()))
+                ids_by_columns.setdefault(columns, []).append(persistent_id)
+            
+            table = PersistentReport.__table__
+            db_session = db.get_session()
+            try:
+                for columns, ids in ids_by_columns.items():
+                    values = {}
+                    for column in columns:
+                        values[column] = case(
+                            [(table.c.id == i, updates[i][column]) for i in ids]
+                        )
+                    db_session.execute(
+                        table.update().where(table.c.id.in_(ids)).values(**values)
+                    )
+                db_session.commit()
+            finally:
+                db_session.close()
@@ -6,7 +6,9 @@ from wikimetrics.models.cohort_user import CohortUser
 from wikimetrics.metrics import metric_classes
 from wikimetrics.utils import deduplicate
 from report import ReportNode
+from report_writer import ReportWriter
 from aggregate_report import AggregateReport
+from metric_fusion import fuse_metric_reports
 
 
 __all__ = ['RunReport']
@@ -17,9 +19,13 @@ class RunReport(ReportNode):
     Represents a batch of cohort-metric reports created by the
     user during a single reports/create/ workflow.  This is also
     intended to be the unit of work which could be easily re-run.
+    The cohort-metric reports are independent so they run in parallel.
+    All the reports in the tree share a ReportWriter, so they are inserted
+    together and their updates are batched.
     """
     
     show_in_ui = False
+    parallel_children = True
     
     def __init__(self, desired_responses, user_id=0, *args, **kwargs):
         """
@@ -29,8 +35,10 @@ class RunReport(ReportNode):
                 metric: the metric to run
                 aggregation: the aggregation options to use
         """
-        super(RunReport, self).__init__(user_id=user_id, *args, **kwargs)
-        self.parse_request(desired_responses)
+        # the whole tree of reports is saved together
+        with ReportWriter():
+            super(RunReport, self).__init__(user_id=user_id, *args, **kwargs)
+            self.parse_request(desired_responses)
     
     def parse_request(self, desired_responses):
         children = []
@@ -69,6 +77,9 @@ class RunReport(ReportNode):
                     aggregate_sum=metric_dict['aggregateSum'],
                     aggregate_average=metric_dict['aggregateAverage'],
                     aggregate_std_deviation=metric_dict['aggregateStandardDeviation'],
+                    aggregate_min_max=metric_dict.get('aggregateMinMax', False),
+                    aggregate_median=metric_dict.get('aggregateMedian', False),
+                    aggregate_percentiles=metric_dict.get('aggregatePercentiles', False),
                     name=cohort_metric_dict['name'],
                     user_id=self.user_id,
                 )
@@ -83,6 +94,9 @@ class RunReport(ReportNode):
         
         self.name = ', '.join(metric_names) + ' for ' + ', '.join(cohort_names)
         self.children = children
+        
+        # compatible metrics are computed together, in a single query
+        fuse_metric_reports(self)
     
     def finish(self, aggregated_results):
         result = self.report_result('Finished', child_results=aggregated_results)
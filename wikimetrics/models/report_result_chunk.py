@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, LargeBinary
+from wikimetrics.configurables import db
+
+__all__ = [
+    'ReportResultChunk',
+]
+
+
+class ReportResultChunk(db.WikimetricsBase):
+    """
+    One piece of the compressed result of a report node, stored under the
+    node's result_key.  See wikimetrics.result_store
+    """
+    
+    __tablename__ = 'report_result_chunk'
+    
+    result_key = Column(String(50), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True, autoincrement=False)
+    # mysql makes this a MEDIUMBLOB, big enough for any RESULT_STORE_CHUNK_SIZE
+    data = Column(LargeBinary(2 ** 24 - 1))
+    
+    def __repr__(self):
+        return '<ReportResultChunk("{0}", {1})>'.format(self.result_key, self.chunk_index)
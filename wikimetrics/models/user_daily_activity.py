@@ -0,0 +1,70 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Date, Index
+from wikimetrics.configurables import db
+
+__all__ = [
+    'UserDailyActivity',
+    'UserDailyActivityCoverage',
+]
+
+
+class UserDailyActivity(db.WikimetricsBase):
+    """
+    Stores how much a mediawiki user did on one day in one namespace of a project,
+    so revision based metrics don't have to scan the same revisions again.
+    Days with no activity have no rows, UserDailyActivityCoverage
+    tells which days have been looked at.  There is at most one row per project,
+    user, day, and namespace, even when reports store the same days at once.
+    """
+    
+    __tablename__ = 'user_daily_activity'
+    
+    id = Column(Integer, primary_key=True)
+    project = Column(String(45))
+    user_id = Column(Integer)
+    day = Column(Date)
+    namespace = Column(Integer)
+    edits = Column(Integer)
+    pages_created = Column(Integer)
+    # the sums of the positive and negative byte changes
+    bytes_added = Column(BigInteger)
+    bytes_removed = Column(BigInteger)
+    
+    def __repr__(self):
+        return '<UserDailyActivity("{0}")>'.format(self.id)
+
+
+Index(
+    'ix_user_daily_activity_project_user_day_namespace',
+    UserDailyActivity.project,
+    UserDailyActivity.user_id,
+    UserDailyActivity.day,
+    UserDailyActivity.namespace,
+    unique=True,
+)
+
+
+class UserDailyActivityCoverage(db.WikimetricsBase):
+    """
+    Stores the span of days for which a user's UserDailyActivity rows
+    are complete, from covered_from up to but not including covered_until.
+    There is at most one row per project and user.
+    """
+    
+    __tablename__ = 'user_daily_activity_coverage'
+    
+    id = Column(Integer, primary_key=True)
+    project = Column(String(45))
+    user_id = Column(Integer)
+    covered_from = Column(Date)
+    covered_until = Column(Date)
+    
+    def __repr__(self):
+        return '<UserDailyActivityCoverage("{0}")>'.format(self.id)
+
+
+Index(
+    'ix_user_daily_activity_coverage_project_user',
+    UserDailyActivityCoverage.project,
+    UserDailyActivityCoverage.user_id,
+    unique=True,
+)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, ForeignKey
 from wikimetrics.configurables import db
 
 __all__ = [
@@ -13,6 +13,9 @@ class WikiUser(db.WikimetricsBase):
     along with the project name on which that user registered.
     This class is mapped to the wiki_user table using
     sqlalchemy.declarative
+    
+    validating_cohort is the cohort a user was uploaded with, which lets
+    create_cohort insert users in bulk and find them again.
     """
     
     __tablename__ = 'wiki_user'
@@ -21,6 +24,7 @@ class WikiUser(db.WikimetricsBase):
     mediawiki_username = Column(String(50))
     mediawiki_userid = Column(Integer(50))
     project = Column(String(45))
+    validating_cohort = Column(Integer, ForeignKey('cohort.id'))
     
     def __repr__(self):
         return '<WikiUser("{0}")>'.format(self.id)
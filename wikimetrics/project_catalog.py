@@ -0,0 +1,243 @@
+"""
+This module knows which mediawiki projects exist and which database host
+(s1..s7) serves each of them.  The lists come from the dblists on
+noc.wikimedia.org, fetched concurrently, and are kept in a json cache file
+so workers don't all hit noc.wikimedia.org when they start.  The cache file
+records when it was fetched, and once it is older than its ttl, the lists are
+fetched again in a background thread while lookups keep using the old ones.
+Lookups go to an immutable ProjectIndex that is swapped for a new one in one
+assignment, so readers never see a half updated map.
+"""
+import json
+import os
+import tempfile
+from threading import Lock, Thread
+from time import time
+from urllib2 import urlopen
+from wikimetrics.utils import parallel_map
+
+
+__all__ = [
+    'ProjectCatalog',
+    'ProjectIndex',
+    'get_host_projects',
+    'get_host_projects_map',
+]
+
+
+DBLIST_URL_TEMPLATE = 'https://noc.wikimedia.org/conf/s{0}.dblist'
+# TODO: these numbers are hardcoded, is that ok?
+HOST_COUNT = 7
+# caches written in a different format are ignored
+CACHE_FORMAT = 1
+
+
+def get_host_projects(host_id, url_template=DBLIST_URL_TEMPLATE):
+    url = url_template.format(host_id)
+    projects = urlopen(url).read().splitlines()
+    return (host_id, projects)
+
+
+def get_host_projects_map(url_template=DBLIST_URL_TEMPLATE, host_count=HOST_COUNT):
+    """
+    Fetches the dblists of all the hosts at the same time.
+    
+    Returns:
+        dictionary from project name to the host (s1..s7) that serves it
+    """
+    host_projects = parallel_map(
+        lambda host_id: get_host_projects(host_id, url_template),
+        range(1, host_count + 1),
+        host_count,
+    )
+    project_host_map = {}
+    host_fmt = 's{0}'
+    for host_id, projects in host_projects:
+        host = host_fmt.format(host_id)
+        for project in projects:
+            project = project.strip()
+            if project:
+                project_host_map[project] = host
+    
+    return project_host_map
+
+
+class ProjectIndex(object):
+    """
+    A read-only map from project name to host, with the time it was fetched
+    and the version of the catalog it came from.
+    """
+    
+    def __init__(self, project_host_map, fetched, version):
+        self._map = dict(project_host_map)
+        self.fetched = fetched
+        self.version = version
+    
+    def __contains__(self, project):
+        return project in self._map
+    
+    def __getitem__(self, project):
+        return self._map[project]
+    
+    def __iter__(self):
+        return iter(self._map)
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def get(self, project, default=None):
+        return self._map.get(project, default)
+    
+    def keys(self):
+        return self._map.keys()
+    
+    def items(self):
+        return self._map.items()
+
+
+class ProjectCatalog(object):
+    """
+    Loads the project host map on first use, from the cache file if it's there
+    and from the dblists otherwise, and keeps it fresh.
+    
+    Parameters:
+        url_template    : where to fetch the dblist of each host from, with {0}
+                          for the host number.  file:// urls work too.
+        cache_path      : json file to keep the map in between runs, or None
+        ttl             : seconds before the map is fetched again
+        host_count      : how many hosts have dblists
+    """
+    
+    def __init__(self,
+                 url_template=DBLIST_URL_TEMPLATE,
+                 cache_path='project_host_map.json',
+                 ttl=24 * 60 * 60,
+                 host_count=HOST_COUNT):
+        
+        self.url_template = url_template
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.host_count = host_count
+        
+        self.index = None
+        self.lock = Lock()
+        self.refreshing = False
+    
+    def get_index(self):
+        """
+        Returns:
+            the current ProjectIndex, loading it first if needed.  A stale index
+            is still returned, and refreshed in the background.
+        """
+        index = self.index
+        if index is None:
+            with self.lock:
+                if self.index is None:
+                    self.index = self.load()
+                index = self.index
+        
+        if time() - index.fetched > self.ttl:
+            self.refresh_in_background()
+        return index
+    
+    def load(self):
+        """
+        Returns:
+            the ProjectIndex in the cache file, even a stale one, which get_index
+            then refreshes in the background.  Only fetches, and waits for it,
+            if there is no cache at all.
+        """
+        cached = self.read_cache()
+        if cached is not None:
+            return cached
+        
+        try:
+            return self.fetch(1)
+        except Exception:
+            raise Exception('Project host map could not be fetched or read')
+    
+    def fetch(self, version):
+        """
+        Fetches the dblists, writes them to the cache file, and returns the new index
+        """
+        index = ProjectIndex(
+            get_host_projects_map(self.url_template, self.host_count),
+            time(),
+            version,
+        )
+        self.write_cache(index)
+        return index
+    
+    def refresh(self):
+        """
+        Fetches the dblists again and swaps in the new index
+        """
+        current = self.index
+        self.index = self.fetch(current.version + 1 if current else 1)
+        return self.index
+    
+    def refresh_in_background(self):
+        """
+        Starts a thread that refreshes the index, unless one is already running
+        """
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        
+        def refresh():
+            try:
+                self.refresh()
+            except Exception:
+                # try again next time, but don't keep trying on every lookup
+                current = self.index
+                self.index = ProjectIndex(current.items(), time(), current.version)
+            finally:
+                self.refreshing = False
+        
+        thread = Thread(target=refresh, name='project-catalog-refresh')
+        thread.daemon = True
+        thread.start()
+    
+    def read_cache(self):
+        """
+        Returns:
+            the ProjectIndex in the cache file, or None if it's missing or unreadable
+        """
+        if not self.cache_path or not os.access(self.cache_path, os.R_OK):
+            return None
+        
+        try:
+            with open(self.cache_path) as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+        
+        if cached.get('format') != CACHE_FORMAT:
+            # caches written before the catalog are a plain map, and count as stale
+            if 'format' in cached:
+                return None
+            return ProjectIndex(cached, 0, 0)
+        return ProjectIndex(cached['projects'], cached['fetched'], cached['version'])
+    
+    def write_cache(self, index):
+        """
+        Writes index to a temporary file and moves it over the cache file, so
+        other processes reading the cache never see it half written
+        """
+        if not self.cache_path:
+            return
+        
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            handle, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as temporary_file:
+                json.dump({
+                    'format'    : CACHE_FORMAT,
+                    'version'   : index.version,
+                    'fetched'   : index.fetched,
+                    'projects'  : dict(index.items()),
+                }, temporary_file)
+            os.rename(temporary_path, self.cache_path)
+        except (IOError, OSError):
+            pass  # no rights to write the file, it's OK
@@ -0,0 +1,166 @@
+"""
+This module pushes report status changes to the browser, so the reports page
+doesn't have to keep asking for the whole list of reports.  When
+Report.set_status writes the status of a report shown in the UI, it bumps a
+version number kept in redis for the report's owner and publishes the change.
+The /reports/status/updates endpoint is a long poll: it answers right away if the
+client's version is old, and otherwise waits on the owner's channel until a change
+comes in or REPORT_STATUS_LONG_POLL_TIMEOUT seconds pass.
+
+Each long poll holds a web server thread for up to that long, so it is off
+unless REPORT_STATUS_LONG_POLL is set, and should only be turned on when the web
+server has a thread or worker to spare for every open reports page.
+
+The redis used is REPORT_STATUS_REDIS_URL in the db config, or by default the
+redis that Celery uses.  Without redis, or with long polling off, clients go back
+to polling.
+"""
+import json
+import socket
+from threading import Lock
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db, queue
+
+
+__all__ = [
+    'publish_report_status',
+    'wait_for_report_status',
+]
+
+
+task_logger = get_task_logger(__name__)
+
+clients = {}
+clients_lock = Lock()
+
+
+def get_redis(subscriber=False):
+    """
+    Parameters:
+        subscriber  : whether the client will wait on a channel, in which case its
+                      socket times out when the long poll should end
+    
+    Returns:
+        a redis client, or None if there is no redis to push statuses through
+    """
+    with clients_lock:
+        if subscriber not in clients:
+            url = db.config.get('REPORT_STATUS_REDIS_URL')
+            if not url:
+                url = queue.conf['CELERY_RESULT_BACKEND']
+            if not url or not url.startswith('redis://'):
+                clients[subscriber] = None
+            else:
+                # only needed if redis is there to push statuses through
+                import redis
+                socket_timeout = None
+                if subscriber:
+                    socket_timeout = long_poll_timeout()
+                clients[subscriber] = redis.StrictRedis.from_url(
+                    url,
+                    socket_timeout=socket_timeout,
+                )
+        
+        return clients[subscriber]
+
+
+def long_poll_timeout():
+    return db.config.get('REPORT_STATUS_LONG_POLL_TIMEOUT', 25)
+
+
+def version_key(user_id):
+    return 'wikimetrics:report-status:version:{0}'.format(user_id)
+
+
+def channel(user_id):
+    return 'wikimetrics:report-status:{0}'.format(user_id)
+
+
+def publish_report_status(user_id, report_id, status):
+    """
+    Tells the clients of user_id that one of their reports changed status.
+    This is best effort: reports run the same when redis is not there.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    
+    import redis
+    try:
+        pipeline = client.pipeline()
+        pipeline.incr(version_key(user_id))
+        pipeline.publish(channel(user_id), json.dumps({
+            'id'        : report_id,
+            'status'    : status,
+        }))
+        pipeline.execute()
+    except (redis.RedisError, socket.error):
+        task_logger.exception('could not publish status of report {0}'.format(
+            report_id
+        ))
+
+
+def wait_for_report_status(user_id, version):
+    """
+    Parameters:
+        user_id : the wikimetrics user whose reports to watch
+        version : the version the client last saw, or None on its first call
+    
+    Returns:
+        dictionary with:
+            supported   : False if long polling is off, statuses can't be pushed,
+                          or redis is down, so clients should poll
+            version     : the version to wait on next time
+            changed     : whether any report changed status since version
+            updates     : the changes that came in while waiting, if any
+    """
+    if not db.config.get('REPORT_STATUS_LONG_POLL', False):
+        return {'supported': False}
+    client = get_redis(subscriber=True)
+    if client is None:
+        return {'supported': False}
+    
+    import redis
+    pubsub = client.pubsub()
+    try:
+        # subscribe before reading the version, so no change can slip in between
+        pubsub.subscribe(channel(user_id))
+        current = client.get(version_key(user_id)) or '0'
+    except (redis.RedisError, socket.error):
+        # redis is configured but down, clients poll instead of asking again and again
+        task_logger.exception('could not watch the reports of user {0}'.format(
+            user_id
+        ))
+        pubsub.reset()
+        return {'supported': False}
+    
+    try:
+        if version is None or version != current:
+            return {
+                'supported' : True,
+                'version'   : current,
+                'changed'   : version is not None,
+                'updates'   : [],
+            }
+        
+        for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            return {
+                'supported' : True,
+                'version'   : client.get(version_key(user_id)) or '0',
+                'changed'   : True,
+                'updates'   : [json.loads(message['data'])],
+            }
+    except (redis.RedisError, socket.error):
+        # most likely the long poll timed out, either way the client asks again
+        pass
+    finally:
+        pubsub.reset()
+    
+    return {
+        'supported' : True,
+        'version'   : version,
+        'changed'   : False,
+        'updates'   : [],
+    }
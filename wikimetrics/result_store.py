@@ -0,0 +1,78 @@
+"""
+This module keeps the result of each report node in the wikimetrics database,
+under the node's result_key, so that results outlive the Celery result backend
+and one report's result can be read without loading the whole report tree's.
+Results are pickled, compressed with zlib, and split into chunks of
+RESULT_STORE_CHUNK_SIZE bytes to stay under the database's packet size.
+"""
+import cPickle
+import zlib
+from wikimetrics.configurables import db
+from wikimetrics.models.report_result_chunk import ReportResultChunk
+
+
+__all__ = [
+    'save_result',
+    'load_result',
+    'delete_results',
+]
+
+
+def save_result(result_key, result):
+    """
+    Parameters:
+        result_key  : the result_key of the report node
+        result      : anything that can be pickled
+    """
+    data = zlib.compress(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+    chunk_size = db.config.get('RESULT_STORE_CHUNK_SIZE', 512 * 1024)
+    table = ReportResultChunk.__table__
+    db_session = db.get_session()
+    try:
+        db_session.execute(table.insert(), [
+            {
+                'result_key'    : result_key,
+                'chunk_index'   : index,
+                'data'          : data[start:start + chunk_size],
+            }
+            for index, start in enumerate(xrange(0, max(len(data), 1), chunk_size))
+        ])
+        db_session.commit()
+    finally:
+        db_session.close()
+
+
+def load_result(result_key):
+    """
+    Returns:
+        the result saved under result_key, or None if there is none
+    """
+    db_session = db.get_session()
+    try:
+        chunks = db_session.query(ReportResultChunk.data)\
+            .filter(ReportResultChunk.result_key == result_key)\
+            .order_by(ReportResultChunk.chunk_index)\
+            .all()
+    finally:
+        db_session.close()
+    
+    if not chunks:
+        return None
+    return cPickle.loads(zlib.decompress(''.join(data for (data,) in chunks)))
+
+
+def delete_results(result_keys):
+    """
+    Deletes the results saved under any of result_keys
+    """
+    if not result_keys:
+        return
+    table = ReportResultChunk.__table__
+    db_session = db.get_session()
+    try:
+        db_session.execute(
+            table.delete().where(table.c.result_key.in_(list(result_keys)))
+        )
+        db_session.commit()
+    finally:
+        db_session.close()
@@ -3,6 +3,7 @@ import argparse
 import sys
 import logging
 import pprint
+import socket
 from .configurables import config_web, config_db, config_celery
 logger = logging.getLogger(__name__)
 
@@ -12,7 +13,12 @@ logger = logging.getLogger(__name__)
 ##################################
 def run_web():
     from configurables import app
-    app.run(host=app.config.get('SERVER_HOST'), port=app.config.get('SERVER_PORT'))
+    # a thread per request, so waiting for report status changes doesn't block others
+    app.run(
+        host=app.config.get('SERVER_HOST'),
+        port=app.config.get('SERVER_PORT'),
+        threaded=True,
+    )
 
 
 def run_test():
@@ -20,9 +26,27 @@ def run_test():
     nose.run(module='tests')
 
 
+def run_migrate():
+    from configurables import db
+    for statement in db.migrate():
+        logger.info('ran %s', statement)
+    logger.info('wikimetrics database is up to date')
+
+
 def run_celery():
     from configurables import queue
-    queue.start(argv=['celery', 'worker', '-l', 'DEBUG'])
+    argv = ['celery', 'worker', '-l', 'DEBUG']
+    if args.shard:
+        # a worker for one host's queue, see wikimetrics.task_routing
+        from task_routing import shard_queue
+        argv += [
+            '-Q', shard_queue(args.shard),
+            '-n', '{0}.{1}'.format(args.shard, socket.gethostname()),
+        ]
+        concurrency = queue.conf.get('SHARD_CONCURRENCY') or {}
+        if args.shard in concurrency:
+            argv += ['-c', str(concurrency[args.shard])]
+    queue.start(argv=argv)
 
 
 def setup_parser():
@@ -45,12 +69,14 @@ def setup_parser():
             'web',
             'test',
             'celery',
+            'migrate',
         ],
         # NOTE: flake made me format the strings this way, nothing could be uglier
         help='''
             web    : runs flask webserver...
             test   : run nosetests...
             celery : runs celery worker...
+            migrate: creates or updates the wikimetrics database tables...
             import : configures everything and runs nothing...
         ''',
     )
@@ -72,6 +98,12 @@ def setup_parser():
         help='Celery config file',
         dest='celery_config',
     )
+    parser.add_argument(
+        '--shard', '-s',
+        default=None,
+        help='in celery mode, only work on the queue of this host (s1..s7)',
+        dest='shard',
+    )
     return parser
 
 
@@ -97,6 +129,8 @@ def main():
         run_test()
     elif args.mode == 'celery':
         run_celery()
+    elif args.mode == 'migrate':
+        run_migrate()
     elif args.mode == 'import':
         pass
 
@@ -185,6 +185,9 @@ $(document).ready(function(){
             item.aggregateSum = ko.observable(true);
             item.aggregateAverage = ko.observable(false);
             item.aggregateStandardDeviation = ko.observable(false);
+            item.aggregateMinMax = ko.observable(false);
+            item.aggregateMedian = ko.observable(false);
+            item.aggregatePercentiles = ko.observable(false);
             item.outputConfigured = ko.computed(function(){
                 return this.individualResults()
                     || (
@@ -193,6 +196,9 @@ $(document).ready(function(){
                                 this.aggregateSum()
                              || this.aggregateAverage()
                              || this.aggregateStandardDeviation()
+                             || this.aggregateMinMax()
+                             || this.aggregateMedian()
+                             || this.aggregatePercentiles()
                             )
                        );
             }, item);
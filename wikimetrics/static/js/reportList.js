@@ -19,7 +19,35 @@ $(document).ready(function(){
         site.populateReports(viewModel);
     };
     getReports();
-    setInterval(getReports, 10000);
+    
+    // wait for status changes pushed by the server, or poll if it can't push them
+    var watchReports = function (version) {
+        var started = new Date().getTime();
+        // the first call has no version yet, and is answered right away with one
+        var first = typeof version === 'undefined';
+        $.get('/reports/status/updates', first ? {} : {version: version})
+            .done(function (data) {
+                if (!data.supported) {
+                    setInterval(getReports, 10000);
+                    return;
+                }
+                if (data.changed) {
+                    getReports();
+                }
+                // don't hammer the server if it answers without waiting
+                var quick = !first && new Date().getTime() - started < 1000;
+                setTimeout(function () {
+                    watchReports(data.version || '');
+                }, quick ? 10000 : 0);
+            })
+            .fail(function () {
+                setTimeout(function () {
+                    getReports();
+                    watchReports(version);
+                }, 10000);
+            });
+    };
+    watchReports();
     
     ko.applyBindings(viewModel);
 });
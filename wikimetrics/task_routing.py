@@ -0,0 +1,92 @@
+"""
+Routes reports to a celery queue for the mediawiki database host they query,
+so that a slow report on one host (say enwiki, on s1) only ties up the workers
+for that host, and reports on the other hosts keep going.
+
+All reports run as queue_task, with the whole report tree in one task (see
+ReportNode.run), so the report is routed as a whole: if every project it
+computes metrics on is served by one of the hosts in SHARD_QUEUES, it goes to
+that host's queue.  Reports that touch more than one host, or hosts without a
+queue of their own, go to the default queue like before.
+
+Each queue needs its own workers, started with:
+
+    wikimetrics --mode celery --shard s1
+
+and plain workers keep serving the default queue.  SHARD_CONCURRENCY sets how
+many processes each shard's workers run.
+"""
+from wikimetrics.configurables import db, queue
+
+
+__all__ = [
+    'ShardRouter',
+    'shard_queue',
+    'report_projects',
+]
+
+
+def shard_queue(host):
+    """
+    Returns:
+        the name of the celery queue for reports on host, like wikimetrics.s1
+    """
+    return 'wikimetrics.{0}'.format(host)
+
+
+def report_projects(report):
+    """
+    Returns:
+        the set of projects the reports in this report's tree compute metrics on
+    """
+    projects = set()
+    reports = [report]
+    while reports:
+        node = reports.pop()
+        project = getattr(node, 'project', None)
+        if project:
+            projects.add(project)
+        reports.extend(getattr(node, 'children', None) or [])
+    return projects
+
+
+class ShardRouter(object):
+    """
+    Celery router, see CELERY_ROUTES in celery_config.yaml
+    
+    Parameters:
+        shards      : the hosts that have their own queue, SHARD_QUEUES by default
+        host_map    : maps projects to hosts, db.project_host_map by default
+    """
+    
+    def __init__(self, shards=None, host_map=None):
+        self.shards = shards
+        self.host_map = host_map
+    
+    def route_for_task(self, task, args=None, kwargs=None):
+        """
+        Returns:
+            the queue for the report passed to a task, or None to leave the task
+            on the default queue
+        """
+        shards = self.shards
+        if shards is None:
+            shards = queue.conf.get('SHARD_QUEUES') or []
+        if not shards or not args:
+            return None
+        
+        projects = report_projects(args[0])
+        if not projects:
+            return None
+        
+        host_map = self.host_map
+        if host_map is None:
+            host_map = db.project_host_map
+        hosts = set(host_map.get(project, project) for project in projects)
+        if len(hosts) != 1:
+            return None
+        
+        host = hosts.pop()
+        if host not in shards:
+            return None
+        return {'queue': shard_queue(host)}
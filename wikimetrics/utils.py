@@ -2,9 +2,16 @@ import json
 import datetime
 import decimal
 from time import mktime
+from multiprocessing.pool import ThreadPool
 from flask import Response
 
 
+# how long to wait on a thread pool before giving up, see parallel_map
+THREAD_POOL_TIMEOUT = 60 * 60 * 24
+# how many characters of json to collect before sending them, see stream_json
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+
 def stringify(*args, **kwargs):
     return json.dumps(dict(*args, **kwargs), cls=BetterEncoder, indent=4)
 
@@ -21,6 +28,34 @@ def json_response(*args, **kwargs):
     return Response(data, mimetype='application/json')
 
 
+def stream_json(obj):
+    """
+    Encodes obj as compact json, yielding it in chunks of about
+    JSON_STREAM_CHUNK_SIZE characters instead of building the whole string.
+    Uses BetterEncoder, just like stringify.
+    """
+    encoder = BetterEncoder(separators=(',', ':'))
+    buffered = []
+    buffered_size = 0
+    for piece in encoder.iterencode(obj):
+        buffered.append(piece)
+        buffered_size += len(piece)
+        if buffered_size >= JSON_STREAM_CHUNK_SIZE:
+            yield ''.join(buffered)
+            buffered = []
+            buffered_size = 0
+    
+    if buffered:
+        yield ''.join(buffered)
+
+
+def json_stream_response(*args, **kwargs):
+    """
+    Like json_response, but compact and streamed in chunks, for big responses
+    """
+    return Response(stream_json(dict(*args, **kwargs)), mimetype='application/json')
+
+
 def json_error(message):
     """
     Standard json error response for when the ajax caller would rather
@@ -89,6 +124,54 @@ def deduplicate_by_key(list_of_objects, key_function):
     return uniques.values()
 
 
+def chunk(sequence, size):
+    """
+    Splits a list into consecutive lists of at most size items.
+    """
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
 def mediawiki_date(date_field):
     date = datetime.datetime.strptime(date_field.data, date_field.format)
     return date.strftime('%Y%m%d%H%M%S')
+
+
+def parse_date(value):
+    """
+    Returns the date in a DateField's data, which is either a date or a string
+    """
+    if hasattr(value, 'date'):
+        return value.date()
+    if hasattr(value, 'year'):
+        return value
+    return datetime.datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def parallel_map(function, sequence, max_threads):
+    """
+    Maps function over sequence using a pool of up to max_threads threads.
+    Results come back in the same order as the sequence, and the first
+    exception raised by function is re-raised in the calling thread.
+    With one thread or one item, this is just a normal map.
+    
+    Parameters:
+        function    : callable to apply to each item
+        sequence    : iterable of items
+        max_threads : maximum number of threads to use
+    
+    Returns:
+        list of results
+    """
+    items = list(sequence)
+    threads = min(max_threads or 1, len(items))
+    if threads <= 1:
+        return map(function, items)
+    
+    pool = ThreadPool(threads)
+    try:
+        # NOTE: get() needs a timeout, otherwise it waits uninterruptibly and
+        # signals like celery's SoftTimeLimitExceeded never reach this thread
+        return pool.map_async(function, items).get(THREAD_POOL_TIMEOUT)
+    finally:
+        pool.terminate()